@@ -0,0 +1,276 @@
+# services/merlin-api/app/api/v1/admin.py
+"""
+Operator endpoints for looking inside a running worker: request profiling,
+tracemalloc diffs, per-model memory footprint, pool/executor stats and
+shadow-scoring aggregates.
+
+Disabled (404) unless ADMIN_TOKEN is set; every call must send it in
+X-Admin-Token. Each worker answers for itself only, so with several workers
+repeat the call or target one with --workers 1.
+"""
+from __future__ import annotations
+import hmac
+import itertools
+import os
+import resource
+import sys
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from pydantic import BaseModel, Field
+
+from app.api.v1 import recs
+from app.db import pool as db_pool
+from app.log import debug_enabled, set_debug
+from app.serve import admission, cf_loader, content_index, mf_loader, profiling
+from app.serve.catalog_index import get_catalog_index
+from app.serve.executor import get_scoring_executor
+from app.serve.shadow import get_shadow
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# bounds for /profile: a window or sampling period outside these would pin a
+# profiler on the worker indefinitely or sample it into the ground
+PROFILE_MAX_REQUESTS = int(os.getenv("PROFILE_MAX_REQUESTS", "10000"))
+PROFILE_MAX_INTERVAL_MS = 1000.0
+
+# baseline for /tracemalloc/diff
+_snapshots: Dict[str, tracemalloc.Snapshot] = {}
+
+
+def _require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404)
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="bad admin token")
+
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(_require_admin)])
+
+
+# ---------- Models ----------
+class ProfileRequest(BaseModel):
+    path: str = "/api/v1/recommend"   # route path prefix to profile
+    requests: int = Field(50, ge=1, le=PROFILE_MAX_REQUESTS)  # window: first matching request .. n-th
+    mode: str = "sample"              # "sample" (all threads) or "cprofile" (event loop thread)
+    interval_ms: float = Field(5.0, ge=1.0, le=PROFILE_MAX_INTERVAL_MS, allow_inf_nan=False)  # mode="sample" period
+
+
+class LogLevelRequest(BaseModel):
+    debug: bool
+
+
+class ShadowRequest(BaseModel):
+    model_id: str                     # cf_itemknn | mf_als
+    version: Optional[str] = None     # shadow version; None stops shadowing model_id
+    sample: Optional[float] = None    # new SHADOW_SAMPLE (all models)
+    reset: bool = False               # clear the aggregates
+
+
+# ---------- Helpers ----------
+def _dict_bytes(d: Dict, sample: int = 1000) -> int:
+    """Approximate size of a dict of str -> small value: table + keys, extrapolated from a sample."""
+    if not d:
+        return sys.getsizeof(d)
+    keys = list(itertools.islice(d, sample))
+    per_key = sum(sys.getsizeof(k) for k in keys) / len(keys)
+    return int(sys.getsizeof(d) + per_key * len(d))
+
+
+def _list_bytes(items: List, sample: int = 1000) -> int:
+    if not items:
+        return sys.getsizeof(items)
+    head = [x for x in items[:sample] if x is not None]
+    per = (sum(sys.getsizeof(x) for x in head) / len(head)) if head else 0
+    return int(sys.getsizeof(items) + per * len(items))
+
+
+def _faiss_bytes(index) -> int:
+    code_size = getattr(index, "code_size", index.d * 4)
+    return int(index.ntotal * code_size)
+
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+
+def _rss_bytes() -> Dict[str, int]:
+    out = {"max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "RssAnon:", "RssFile:")):
+                    name, kb = line.split()[:2]
+                    out[name.rstrip(":").lower()] = int(kb) * 1024
+    except OSError:  # not Linux
+        pass
+    return out
+
+
+def _model_footprint() -> Dict[str, Any]:
+    models: Dict[str, Any] = {}
+    for (model_id, version), (item_ids, sims) in list(cf_loader._CACHE.items()):
+        models[f"{model_id}@{version}"] = {
+            "kind": "dense_itemknn",
+            "sims_bytes": int(sims.nbytes),
+            "item_ids": len(item_ids),
+            "item_ids_bytes": _list_bytes(item_ids),
+        }
+    for (model_id, version), (user_f, item_f, u2i, inv_items, index) in list(mf_loader._CACHE.items()):
+        models[f"{model_id}@{version}"] = {
+            "kind": "mf_als",
+            "user_factors_bytes": int(user_f.nbytes),
+            "item_factors_bytes": int(item_f.nbytes),
+            "quantized": not hasattr(user_f, "dtype"),
+            "users": len(u2i),
+            "user_map_bytes": _dict_bytes(u2i),
+            "items": len(inv_items),
+            "item_ids_bytes": _list_bytes(inv_items),
+            "faiss_ntotal": int(index.ntotal),
+            "faiss_bytes": _faiss_bytes(index),
+        }
+    knns = [("cf_itemknn", recs._itemknn)]
+    shadow_knn = recs._shadow_models.get("cf_itemknn")
+    if shadow_knn:
+        knns.append((f"cf_itemknn@{shadow_knn[0]} (shadow)", shadow_knn[1]))
+    for name, knn in knns:
+        if knn is None:
+            continue
+        models[name] = {
+            "kind": "sparse_itemknn",
+            "data_bytes": int(knn.data.nbytes),
+            "indices_bytes": int(knn.indices.nbytes),
+            "indptr_bytes": int(knn.indptr.nbytes),
+            "nnz": int(knn.data.size),
+            "items": len(knn.item_ids),
+            "index_bytes": _dict_bytes(knn.index),
+            "item_ids_bytes": _list_bytes(knn.item_ids),
+        }
+    content = content_index._content
+    if content is not None:
+        models[f"{content.model_id}@{content.version}"] = {
+            "kind": "content",
+            "items": len(content.item_ids),
+            "index_bytes": _dict_bytes(content.index_of),
+            "faiss_ntotal": int(content.index.ntotal),
+            "faiss_bytes": _faiss_bytes(content.index),
+        }
+    return models
+
+
+# ---------- Routes ----------
+
+@router.post("/profile")
+async def start_profile(req: ProfileRequest):
+    """Arm a profile for the next `requests` requests whose path starts with `path`."""
+    try:
+        session = profiling.arm(req.path, req.requests, req.mode, req.interval_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return session.status()
+
+
+@router.get("/profile")
+async def get_profile():
+    """Progress of the armed profile, with the report once its window has completed."""
+    return profiling.status() or {"armed": False}
+
+
+@router.post("/tracemalloc/start")
+def tracemalloc_start(frames: int = Query(default=10, ge=1, le=64)):
+    """Start tracing allocations and take the baseline snapshot."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    _snapshots["last"] = _take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    return {"tracing": True, "frames": tracemalloc.get_traceback_limit(), "traced_bytes": current, "peak_bytes": peak}
+
+
+@router.get("/tracemalloc/diff")
+def tracemalloc_diff(
+    top: int = Query(default=25, ge=1, le=200),
+    group_by: str = Query(default="lineno", pattern="^(lineno|filename|traceback)$"),
+):
+    """Allocation growth since the previous snapshot; the new snapshot becomes the baseline."""
+    if not tracemalloc.is_tracing() or "last" not in _snapshots:
+        raise HTTPException(status_code=409, detail="tracemalloc not started")
+    snap = _take_snapshot()
+    stats = snap.compare_to(_snapshots["last"], group_by)
+    _snapshots["last"] = snap
+    return {
+        "top": [
+            {
+                "where": [f"{fr.filename}:{fr.lineno}" for fr in st.traceback],
+                "size_diff": st.size_diff,
+                "size": st.size,
+                "count_diff": st.count_diff,
+            }
+            for st in stats[:top]
+        ],
+        "traced_bytes": tracemalloc.get_traced_memory()[0],
+    }
+
+
+@router.post("/tracemalloc/stop")
+def tracemalloc_stop():
+    _snapshots.pop("last", None)
+    tracemalloc.stop()
+    return {"tracing": False}
+
+
+@router.get("/memory")
+def memory():
+    """Per-model footprint (arrays, id maps, FAISS indexes) plus process RSS."""
+    return {
+        "pid": os.getpid(),
+        "rss": _rss_bytes(),
+        "models": _model_footprint(),
+        "catalog_items": len(get_catalog_index()),
+    }
+
+
+@router.get("/pool")
+def pool_stats():
+    """DB pool counters (psycopg_pool get_stats) plus scoring and admission state."""
+    p = db_pool._pool
+    pool: Dict[str, Any] = {"open": False}
+    if p is not None and not p.closed:
+        pool = {"open": True, "min_size": p.min_size, "max_size": p.max_size, **p.get_stats()}
+    return {
+        "pid": os.getpid(),
+        "db_pool": pool,
+        "scoring": get_scoring_executor().stats(),
+        "admission": admission.stats(),
+    }
+
+
+@router.post("/log-level")
+def log_level(req: LogLevelRequest):
+    """Flip request-path debug logging on this worker (see app/log.py)."""
+    set_debug(req.debug)
+    return {"debug": debug_enabled()}
+
+
+@router.get("/shadow")
+def shadow_stats():
+    """Shadow targets, queue counters and per (model, primary, shadow) version aggregates."""
+    return get_shadow().snapshot()
+
+
+@router.post("/shadow")
+def shadow_config(req: ShadowRequest):
+    if req.model_id not in ("cf_itemknn", "mf_als"):
+        raise HTTPException(status_code=400, detail="shadowing supports cf_itemknn and mf_als")
+    if req.sample is not None and not 0.0 <= req.sample <= 1.0:
+        raise HTTPException(status_code=400, detail="sample must be within [0, 1]")
+    shadow = get_shadow()
+    shadow.set_target(req.model_id, req.version, req.sample)
+    if req.reset:
+        shadow.reset()
+    return shadow.snapshot()
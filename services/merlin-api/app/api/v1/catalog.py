@@ -0,0 +1,40 @@
+# services/merlin-api/app/api/v1/catalog.py
+from __future__ import annotations
+from typing import List
+
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel
+
+from app.api.v1.recs import PosterItem
+from app.serve.catalog_index import get_catalog_index
+
+router = APIRouter()
+
+MAX_BULK_IDS = 1000
+
+
+class CatalogBulkRequest(BaseModel):
+    item_ids: List[str]
+
+
+class CatalogResponse(BaseModel):
+    items: List[PosterItem]
+
+
+@router.get("/catalog/search", response_model=CatalogResponse)
+async def catalog_search(
+    q: str = Query(..., min_length=1),
+    k: int = Query(default=20, ge=1, le=100),
+):
+    """Type-ahead title search over the in-memory item_catalog index."""
+    rows = get_catalog_index().search(q, k=k)
+    return CatalogResponse(items=[PosterItem(**r) for r in rows])
+
+
+@router.post("/catalog/bulk", response_model=CatalogResponse)
+async def catalog_bulk(req: CatalogBulkRequest):
+    """Hydrate many item_ids in one call. Unknown ids are omitted; order follows the request."""
+    if len(req.item_ids) > MAX_BULK_IDS:
+        raise HTTPException(status_code=400, detail=f"at most {MAX_BULK_IDS} item_ids per call")
+    rows = get_catalog_index().bulk(req.item_ids)
+    return CatalogResponse(items=[PosterItem(**r) for r in rows])
@@ -0,0 +1,97 @@
+# services/merlin-api/app/api/v1/encoding.py
+"""
+Opt-in fast encodings for recommendation responses, picked from the Accept header:
+
+  application/json (default)      RecommendResponse via pydantic, unchanged
+  application/vnd.merlin+json     orjson
+  application/msgpack             msgpack
+  ...; layout=columnar            {"item_ids": [...], "scores": [...], "why": ..., "meta": [...]}
+                                  instead of one object per item
+
+The fast paths encode straight from the (item_id, score) pairs that scoring
+returns. No ScoredItem is built per item and the response model is not
+re-validated. In the columnar layout the per-item work is a single zip, so
+encoding cost stays nearly flat in k.
+"""
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None  # type: ignore
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional speedup
+    msgpack = None  # type: ignore
+
+JSON_FAST = "application/vnd.merlin+json"
+MSGPACK = "application/msgpack"
+
+
+class Encoding(NamedTuple):
+    media_type: str
+    columnar: bool
+
+
+def negotiate(accept: Optional[str]) -> Optional[Encoding]:
+    """First fast media type listed in Accept that we can produce; None = default JSON."""
+    for part in (accept or "").split(","):
+        fields = [f.strip() for f in part.split(";")]
+        media_type = fields[0].lower()
+        params = dict(f.split("=", 1) for f in fields[1:] if "=" in f)
+        columnar = params.get("layout", "").strip().lower() == "columnar"
+        if media_type == JSON_FAST and orjson is not None:
+            return Encoding(JSON_FAST, columnar)
+        if media_type in (MSGPACK, "application/x-msgpack") and msgpack is not None:
+            return Encoding(MSGPACK, columnar)
+    return None
+
+
+def result_body(
+    pairs: List[Tuple[str, float]],
+    columnar: bool,
+    why: Optional[str] = None,
+    meta: Optional[List[Optional[Dict[str, Any]]]] = None,
+    **fields: Any,
+) -> Dict[str, Any]:
+    """Response dict for one ranked list; `fields` are the top-level extras (model_id, notes, ...)."""
+    body = dict(fields)
+    if columnar:
+        ids, scores = zip(*pairs) if pairs else ((), ())
+        body.update(item_ids=ids, scores=scores)
+        if why is not None:
+            body["why"] = why
+        if meta is not None:
+            body["meta"] = meta
+    else:
+        if why is None:
+            items = [{"item_id": iid, "score": score} for iid, score in pairs]
+        else:
+            items = [{"item_id": iid, "score": score, "why": why} for iid, score in pairs]
+        if meta is not None:
+            for item, m in zip(items, meta):
+                item["meta"] = m
+        body["items"] = items
+    return body
+
+
+def dumps(enc: Encoding, body: Dict[str, Any]) -> bytes:
+    if enc.media_type == MSGPACK:
+        return msgpack.packb(body, use_bin_type=True)
+    return orjson.dumps(body)
+
+
+def encode_response(enc: Encoding, body: Dict[str, Any]) -> Response:
+    return Response(content=dumps(enc, body), media_type=enc.media_type)
+
+
+def encode_stream(
+    enc: Encoding, key: str, results: Iterable[Tuple[str, List[Tuple[str, float]]]]
+) -> Iterator[bytes]:
+    """Batch variant: one record per query. JSON records are newline-delimited; msgpack records are concatenated."""
+    sep = b"" if enc.media_type == MSGPACK else b"\n"
+    for query_id, pairs in results:
+        yield dumps(enc, result_body(pairs, enc.columnar, **{key: query_id})) + sep
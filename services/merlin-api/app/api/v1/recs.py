@@ -1,83 +1,132 @@
 # services/merlin-api/app/api/v1/recs.py
 from __future__ import annotations
+import asyncio
+import itertools
+import logging
 import os
 import json
-from typing import List, Optional, Tuple, Any, Dict
-
-import psycopg
-from psycopg_pool import ConnectionPool
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel
-
+import threading
+import time
+import weakref
+from typing import List, NamedTuple, Optional, Tuple, Any, Dict, Iterator
+
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from psycopg import OperationalError
+from psycopg_pool import PoolTimeout
+from pydantic import BaseModel, Field
+
+from app.db.pool import pg_conn
+from app.log import get_logger
+from app.db import identity, user_state
 from app.serve.itemknn_loader import ItemKNN
-
-def _dsn_with_ssl_keepalives(raw: str) -> str:
-    """
-    Ensure sslmode=require and TCP keepalives for stability on Render + Supabase.
-    Works with both direct (5432) and pooler (6543) URLs.
-    """
-    dsn = (raw or "").strip()  # <-- trims any stray newline/space
-    sep = "&" if "?" in dsn else "?"
-    if "sslmode=" not in dsn:
-        dsn += f"{sep}sslmode=require"
-        sep = "&"
-    # Reduce idle disconnects when using the pooler or long-lived connections
-    if "keepalives=" not in dsn:
-        dsn += f"{sep}keepalives=1&keepalives_idle=30&keepalives_interval=10&keepalives_count=5"
-    return dsn
-
-
+from app.serve.catalog_index import get_catalog_index
+from app.serve.content_index import get_content_index
+from app.serve import session_tail
+from app.serve.session_markov_loader import load_session_markov
+from app.serve.filters import FilterSpec, drop_bitmaps, filter_mask
+from app.serve import ranker
+from app.serve.shadow import get_shadow
+from app.serve.executor import ScoringBusy, get_scoring_executor, mark_cold
+from app.serve.admission import RECOMMEND_BUDGET_MS, ConcurrencyLimiter, Deadline, limiter
+from app.serve.trending import SEED_POPULAR, get_trending
+from app.api.v1.encoding import Encoding, encode_response, encode_stream, negotiate, result_body
+
+log = get_logger("recs")
+
+MODEL_STAGE = os.getenv("MODEL_STAGE", "dev")
+# Registry rows are cached this long so /recommend doesn't wait on the DB pool per request
+MODEL_ROW_TTL_S = float(os.getenv("MODEL_ROW_TTL_S", "30"))
+# Models preloaded and exercised at startup before /readyz flips
+WARMUP_MODELS = [m.strip() for m in os.getenv("WARMUP_MODELS", "cf_itemknn,mf_als").split(",") if m.strip()]
+# /movies/popular counts events from this many days back (was all-time)
+POPULAR_WINDOW_DAYS = int(os.getenv("POPULAR_WINDOW_DAYS", "30"))
+# /recommend:batch request bounds: users/seeds per request, items per user/seed
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "1000"))
+BATCH_MAX_K = int(os.getenv("BATCH_MAX_K", "200"))
+# /recommend:batch results are scored and encoded this many users/seeds per scoring task
+BATCH_SCORE_CHUNK = int(os.getenv("BATCH_SCORE_CHUNK", "256"))
+BATCH_BUSY_BACKOFF_S = 0.05
 
 _itemknn = None
+_itemknn_lock = threading.Lock()
 def _get_itemknn():
     global _itemknn
     if _itemknn is None:
-        _itemknn = ItemKNN(model_id="cf_itemknn", stage="dev")
+        with _itemknn_lock:
+            if _itemknn is None:
+                mark_cold()
+                _itemknn = ItemKNN(model_id="cf_itemknn", stage=MODEL_STAGE)
     return _itemknn
 
 # Optional: import MF ALS recommender loader if present
 try:
+    from app.serve.mf_loader import load_mf_als
     from app.serve.mf_loader import recommend_for_user as als_recommend_for_user
+    from app.serve.mf_loader import recommend_for_users as als_recommend_for_users
+    from app.serve.mf_loader import item_index as als_item_index
+    from app.serve.mf_loader import evict as als_evict
 except Exception:  # pragma: no cover
+    load_mf_als = None  # type: ignore
+    als_item_index = None  # type: ignore
+    als_evict = None  # type: ignore
     als_recommend_for_user = None  # type: ignore
+    als_recommend_for_users = None  # type: ignore
 
 router = APIRouter()
 
-DATABASE_URL = os.environ.get("DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError("DATABASE_URL env var not set for merlin-api")
-
-# Build DSN with SSL and keepalives, then create a small global pool
-_DSN = _dsn_with_ssl_keepalives(DATABASE_URL)
-_pool = ConnectionPool(
-    _DSN,
-    min_size=1,
-    max_size=2,          # keep this low; Supabase pooler is finite
-    timeout=10,
-    kwargs={"autocommit": True},
-)
-
-def _pg_conn():
+def _pg_conn(timeout: Optional[float] = None):
     """Borrow a pooled connection. Usage:
         with _pg_conn() as conn, conn.cursor() as cur:
             cur.execute(...)
     """
-    return _pool.connection()
+    return pg_conn(timeout=timeout)
 
 
 # ---------- Models ----------
+class PosterItem(BaseModel):
+    item_id: str
+    title: Optional[str] = None
+    year: Optional[int] = None
+    genres: List[str] = []
+    poster_url: Optional[str] = None
+
+
 class ScoredItem(BaseModel):
     item_id: str
     score: float
     why: Optional[str] = None
+    meta: Optional[PosterItem] = None  # filled when RecommendRequest.hydrate is set
+
+
+class ItemFilters(BaseModel):
+    genres: List[str] = []          # any-of, matched against item_catalog.genres
+    exclude_genres: List[str] = []
+    year_min: Optional[int] = None
+    year_max: Optional[int] = None
+    available_only: bool = False
 
 
 class RecommendRequest(BaseModel):
     user_id: Optional[str] = None
     session_id: Optional[str] = None
     seed_item_id: Optional[str] = None
+    recent_item_ids: List[str] = []  # session_next: the session's latest items, newest first (else read server-side)
     algo: str = "mf_als"
     k: int = 10
+    hydrate: bool = False  # attach catalog metadata (title/year/poster) to each item
+    filters: Optional[ItemFilters] = None  # applied inside retrieval, not after
+    # MMR trade-off against near-duplicates; 0 = plain score order
+    diversity: float = Field(0.0, ge=0.0, le=1.0, allow_inf_nan=False)
+
+
+class BatchRecommendRequest(BaseModel):
+    # Provide user_ids (mf_als) or seed_item_ids (cf_itemknn)
+    user_ids: List[str] = Field(default_factory=list, max_length=BATCH_MAX_QUERIES)
+    seed_item_ids: List[str] = Field(default_factory=list, max_length=BATCH_MAX_QUERIES)
+    algo: str = "mf_als"
+    k: int = Field(10, ge=1, le=BATCH_MAX_K)
+    filters: Optional[ItemFilters] = None
 
 
 class RecommendResponse(BaseModel):
@@ -92,10 +141,13 @@ class RegisterRequest(BaseModel):
     email: str
     name: Optional[str] = None
     locale: Optional[str] = "en-AU"
+    session_id: Optional[str] = None  # anonymous session to merge into the user (see app/db/identity.py)
 
 
 class RegisterResponse(BaseModel):
     user_id: str
+    created: bool = False
+    merged_events: int = 0  # session events re-keyed to the user by this call
 
 
 class EventIn(BaseModel):
@@ -108,13 +160,6 @@ class EventIn(BaseModel):
     context: Dict[str, Any] = {}  # JSONB payload stored as-is
 
 
-class PosterItem(BaseModel):
-    item_id: str
-    title: Optional[str] = None
-    year: Optional[int] = None
-    poster_url: Optional[str] = None
-
-
 # ---------- Helpers ----------
 
 def _to01(v) -> int:
@@ -140,6 +185,145 @@ def _get_latest_model(conn, model_id: str) -> Tuple[str, str]:
             return (model_id, "dev")
         return (row[0], row[1])
 
+def _get_model_version_row(conn, model_id: str, version: str) -> Optional[Dict[str, str]]:
+    """Registry row of one specific version (any stage). None if not registered."""
+    sql = "select model_id, version, artifact_uri from public.model_registry where model_id = %s and version = %s"
+    with conn.cursor() as cur:
+        cur.execute(sql, (model_id, version))
+        row = cur.fetchone()
+        if not row:
+            return None
+        return {"model_id": row[0], "version": row[1], "artifact_uri": row[2]}
+
+def _get_latest_model_row(conn, model_id: str) -> Optional[Dict[str, str]]:
+    """Like _get_latest_model, but also returns artifact_uri. None if not registered."""
+    sql = (
+        "select model_id, version, artifact_uri from public.model_registry "
+        "where model_id = %s order by created_at desc nulls last, version desc limit 1"
+    )
+    with conn.cursor() as cur:
+        cur.execute(sql, (model_id,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        return {"model_id": row[0], "version": row[1], "artifact_uri": row[2]}
+
+_model_rows: Dict[str, Tuple[float, Optional[Dict[str, str]]]] = {}
+
+def _lookup_model_row(model_id: str, timeout: float) -> Optional[Dict[str, str]]:
+    with _pg_conn(timeout=timeout) as conn:
+        row = _get_latest_model_row(conn, model_id)
+    _model_rows[model_id] = (time.monotonic(), row)
+    return row
+
+class _Degraded(Exception):
+    """The request can't be answered within its budget; serve the fallback list."""
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+async def _resolve_model_row(model_id: str, deadline: Deadline) -> Optional[Dict[str, str]]:
+    """
+    Latest registry row for model_id, from a MODEL_ROW_TTL_S cache. A refresh may
+    only wait on the pool for what's left of the deadline; if the DB is slow a
+    stale row is still used, and with no row at all the request degrades.
+    """
+    cached = _model_rows.get(model_id)
+    if cached and time.monotonic() - cached[0] < MODEL_ROW_TTL_S:
+        return cached[1]
+    budget = deadline.remaining_s()
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(_lookup_model_row, model_id, budget), budget)
+    except (PoolTimeout, OperationalError, asyncio.TimeoutError):
+        if cached:
+            _model_rows[model_id] = (time.monotonic(), cached[1])  # retry after another TTL
+            return cached[1]
+        raise _Degraded("db_slow")
+
+def _lookup_session_tail(session_id: str, timeout: float) -> List[str]:
+    with _pg_conn(timeout=timeout) as conn:
+        return session_tail.load_tail(conn, session_id)
+
+async def _resolve_session_tail(req: RecommendRequest, deadline: Deadline) -> List[str]:
+    """The session's last items: from the request, the in-process tail, or (once per TTL) the events table."""
+    if req.recent_item_ids:
+        return req.recent_item_ids[: session_tail.SESSION_TAIL_LEN]
+    if not req.session_id:
+        return []
+    tail = session_tail.get_tail(req.session_id)
+    if tail is not None:
+        return tail
+    budget = deadline.remaining_s()
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(_lookup_session_tail, req.session_id, budget), budget)
+    except (PoolTimeout, OperationalError, asyncio.TimeoutError):
+        raise _Degraded("db_slow")
+
+def _lookup_seeds(user_id: str, timeout: float) -> List[str]:
+    with _pg_conn(timeout=timeout) as conn:
+        return identity.load_seeds(conn, user_id)
+
+async def _resolve_seeds(user_id: str, deadline: Deadline) -> List[str]:
+    """A user's latest items: in-process (set by a session merge, kept by /events), else read once per TTL."""
+    seeds = identity.cached_seeds(user_id)
+    if seeds is not None:
+        return seeds
+    budget = deadline.remaining_s()
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(_lookup_seeds, user_id, budget), budget)
+    except (PoolTimeout, OperationalError, asyncio.TimeoutError):
+        raise _Degraded("db_slow")
+
+async def _score(label: str, deadline: Deadline, fn, *args):
+    """Run fn on the scoring executor, degrading if it can't finish before the deadline."""
+    executor = get_scoring_executor()
+    if executor.estimate_ms(label) > deadline.remaining_ms():
+        raise _Degraded("deadline")
+    try:
+        return await asyncio.wait_for(executor.run(label, fn, *args), deadline.remaining_s())
+    except ScoringBusy:
+        raise _Degraded("scoring_busy")
+    except asyncio.TimeoutError:
+        raise _Degraded("deadline")
+
+def _ndjson_lines(key: str, results) -> Iterator[str]:
+    """Encode (query_id, [(item_id, score), ...]) pairs as one JSON line each."""
+    for query_id, pairs in results:
+        yield json.dumps({
+            key: query_id,
+            "items": [{"item_id": iid, "score": score} for iid, score in pairs],
+        }) + "\n"
+
+def _filter_spec(f: Optional[ItemFilters]) -> Optional[FilterSpec]:
+    if f is None:
+        return None
+    return FilterSpec(
+        genres=tuple(f.genres),
+        exclude_genres=tuple(f.exclude_genres),
+        year_min=f.year_min,
+        year_max=f.year_max,
+        available_only=f.available_only,
+    )
+
+def _itemknn_mask(knn: ItemKNN, f: Optional[ItemFilters]):
+    return filter_mask((knn.model_id, knn.version), knn.item_ids, _filter_spec(f))
+
+def _als_mask(row: Dict[str, str], f: Optional[ItemFilters]):
+    spec = _filter_spec(f)
+    if spec is None or spec.is_empty():
+        return None
+    _, _, _, inv_items, _ = load_mf_als(row["model_id"], row["version"], row["artifact_uri"])
+    return filter_mask((row["model_id"], row["version"]), inv_items, spec)
+
+def _hydrate(items: List[ScoredItem]) -> List[ScoredItem]:
+    """Attach catalog metadata from the in-memory index (one pass, no DB round-trip)."""
+    by_id = get_catalog_index().by_id
+    for it in items:
+        row = by_id.get(it.item_id)
+        if row is not None:
+            it.meta = PosterItem(**row)
+    return items
+
 def _ensure_item(conn, item_id: str, meta: dict | None = None):
     meta = meta or {}
     with conn.cursor() as cur:
@@ -148,59 +332,399 @@ def _ensure_item(conn, item_id: str, meta: dict | None = None):
             (item_id,),
         )
        
+# ---------- Scoring (runs on the scoring executor, off the event loop) ----------
+
+def _graph_similarity(model):
+    """Candidate similarity block from a sparse-triplet model (ItemKNN, SessionMarkov)."""
+    return lambda ids: ranker.sparse_similarity(
+        model.data, model.indices, model.indptr, ranker.item_rows(model.index, ids), model._decode)
+
+def _score_similar(req: RecommendRequest, knn: Optional[ItemKNN] = None) -> Tuple[List[Tuple[str, float]], str]:
+    """Item-KNN neighbors of the seed; content neighbors for seeds KNN has never seen."""
+    knn = knn or _get_itemknn()
+    pool = ranker.pool_size(req.k, req.diversity)
+    pairs = knn.similar_items(req.seed_item_id, k=pool, mask=_itemknn_mask(knn, req.filters))
+    if pairs:
+        return ranker.diversify(pairs, req.k, req.diversity, _graph_similarity(knn)), "item-knn"
+    # cold-start seed (not in the KNN graph yet): fall back to content neighbors
+    content = get_content_index(MODEL_STAGE)
+    if content is not None:
+        mask = filter_mask((content.model_id, content.version), content.item_ids, _filter_spec(req.filters))
+        # not diversified: content neighbors of a brand-new item have no graph edges to compare
+        pairs = content.similar_items(req.seed_item_id, k=req.k, mask=mask)
+    return pairs, "content"
+
+def _score_session(row: Dict[str, str], recent: List[str], req: RecommendRequest) -> List[Tuple[str, float]]:
+    model = load_session_markov(row["model_id"], row["version"], row["artifact_uri"])
+    mask = filter_mask((model.model_id, model.version), model.item_ids, _filter_spec(req.filters))
+    pairs = model.next_items(recent, k=ranker.pool_size(req.k, req.diversity), mask=mask)
+    return ranker.diversify(pairs, req.k, req.diversity, _graph_similarity(model))
+
+def _score_seeds(seeds: List[str], req: RecommendRequest) -> List[Tuple[str, float]]:
+    """Item-KNN neighbors of a user's latest items, each older seed weighted down by IDENTITY_SEED_DECAY."""
+    knn = _get_itemknn()
+    pool = ranker.pool_size(req.k, req.diversity)
+    scores: Dict[str, float] = {}
+    for step, (_, pairs) in enumerate(knn.similar_items_batch(seeds, k=pool, mask=_itemknn_mask(knn, req.filters))):
+        w = identity.IDENTITY_SEED_DECAY ** step
+        for iid, score in pairs:
+            scores[iid] = scores.get(iid, 0.0) + w * score
+    seen = set(seeds)
+    pairs = sorted(((iid, s) for iid, s in scores.items() if iid not in seen), key=lambda p: p[1], reverse=True)
+    return ranker.diversify(pairs[:pool], req.k, req.diversity, _graph_similarity(knn))
+
+def _score_als(row: Dict[str, str], req: RecommendRequest) -> List[Tuple[str, float]]:
+    pairs = als_recommend_for_user(
+        req.user_id, ranker.pool_size(req.k, req.diversity), row["model_id"], row["version"],
+        row["artifact_uri"], mask=_als_mask(row, req.filters),
+    )
+    if req.diversity <= 0:
+        return pairs
+    _, item_f, _, _, _ = load_mf_als(row["model_id"], row["version"], row["artifact_uri"])
+    rows_of = als_item_index(row["model_id"], row["version"], row["artifact_uri"])
+    # FAISS only returns indexed items, so every candidate has a factor row
+    similarity = lambda ids: ranker.factor_similarity(item_f[ranker.item_rows(rows_of, ids)])
+    return ranker.diversify(pairs, req.k, req.diversity, similarity)
+
+# ---------- Shadow scoring (background thread, after the response is sent) ----------
+
+# {model_id: loaded shadow version}: an ItemKNN, or the mf_als registry row. One per
+# model, so switching the shadow target frees the previous one.
+_shadow_models: Dict[str, Tuple[str, Any]] = {}
+_shadow_lock = threading.Lock()
+
+def _shadow_model(model_id: str, version: str):
+    with _shadow_lock:
+        loaded = _shadow_models.get(model_id)
+        if loaded and loaded[0] == version:
+            return loaded[1]
+        if model_id == "cf_itemknn":
+            model = ItemKNN(model_id=model_id, stage=MODEL_STAGE, version=version)
+        else:
+            with _pg_conn() as conn:
+                model = _get_model_version_row(conn, model_id, version)
+            if model is None:
+                raise RuntimeError(f"{model_id} {version} not registered")
+        if loaded:
+            # free the previous shadow version, unless it has been promoted meanwhile
+            old = loaded[0]
+            primary = (_model_rows.get(model_id) or (0.0, None))[1]
+            if model_id != "cf_itemknn" and als_evict is not None and (primary or {}).get("version") != old:
+                als_evict(model_id, old)
+            drop_bitmaps((model_id, old))
+        _shadow_models[model_id] = (version, model)
+        return model
+
+def _score_shadow(model_id: str, req: RecommendRequest, version: str) -> List[str]:
+    model = _shadow_model(model_id, version)
+    if model_id == "cf_itemknn":
+        pairs, _ = _score_similar(req, model)
+    else:
+        pairs = _score_als(model, req)
+    return [iid for iid, _ in pairs]
+
+def _offer_shadow(req: RecommendRequest, ranked: _Ranked) -> None:
+    """Queue a replay of an answered item-KNN / ALS request against the shadow version, if any."""
+    if not ranked.pairs or ranked.why not in ("item-knn", "mf-als"):
+        return
+    if ranked.why == "item-knn":
+        model_id, version = "cf_itemknn", _get_itemknn().version
+    else:
+        model_id, version = ranked.model_id, ranked.version
+    get_shadow().offer(model_id, version, [iid for iid, _ in ranked.pairs], req.k,
+                       lambda shadow_version: _score_shadow(model_id, req, shadow_version))
+
+# ---------- Lifecycle ----------
+
+def warm_models(query: bool = True) -> Dict[str, Any]:
+    """
+    Preload the active models and run one dummy query against each so the first
+    user request doesn't pay artifact loading / FAISS page-in. Returns a per-model
+    report (load+query ms, or the reason it was skipped). Failures never raise:
+    a missing model must not keep the service from becoming ready.
+    query=False only loads: the preforking master (app/cli/serve.py) must not
+    start OpenMP threads before it forks.
+    """
+    report: Dict[str, Any] = {}
+    for model_id in WARMUP_MODELS:
+        t0 = time.perf_counter()
+        try:
+            if model_id == "cf_itemknn":
+                knn = _get_itemknn()
+                if query and knn.item_ids:
+                    knn.similar_items(knn.item_ids[0], k=10)
+            elif model_id == "mf_als":
+                if load_mf_als is None:
+                    report[model_id] = "loader unavailable"
+                    continue
+                with _pg_conn() as conn:
+                    row = _get_latest_model_row(conn, model_id)
+                if row is None:
+                    report[model_id] = "not registered"
+                    continue
+                _, _, u2i, _, _ = load_mf_als(row["model_id"], row["version"], row["artifact_uri"])
+                if query and u2i:
+                    als_recommend_for_user(
+                        next(iter(u2i)), 10, row["model_id"], row["version"], row["artifact_uri"]
+                    )
+            elif model_id == "session_markov":
+                with _pg_conn() as conn:
+                    row = _get_latest_model_row(conn, model_id)
+                if row is None:
+                    report[model_id] = "not registered"
+                    continue
+                model = load_session_markov(row["model_id"], row["version"], row["artifact_uri"])
+                if query and model.item_ids:
+                    model.next_items(model.item_ids[:1], k=10)
+            elif model_id == "cf_content":
+                content = get_content_index(MODEL_STAGE)
+                if content is None:
+                    report[model_id] = "not registered"
+                    continue
+                if query and content.item_ids:
+                    content.similar_items(content.item_ids[0], k=10)
+            else:
+                report[model_id] = "unknown model"
+                continue
+            report[model_id] = {"warm_ms": round((time.perf_counter() - t0) * 1000.0, 1)}
+        except Exception as e:
+            report[model_id] = f"error: {e}"
+        print(f"[MERLIN] warm-up {model_id}: {report[model_id]}", flush=True)
+    return report
+
 # ---------- Routes ----------
 
-@router.post("/recommend", response_model=RecommendResponse)
-async def recommend(req: RecommendRequest):
-    """Unified recommendation endpoint used by the UI."""
-    with _pg_conn() as conn:
-        # pick a model entry so response includes id/version
-        target_model_id = "mf_als" if req.algo.lower().startswith("mf") else "cf_itemknn"
-        model_id, version = _get_latest_model(conn, target_model_id)
+class _Ranked(NamedTuple):
+    """Scoring outcome, rendered as RecommendResponse or a fast encoding (see encoding.py)."""
+    model_id: str
+    version: str
+    pairs: List[Tuple[str, float]]
+    why: Optional[str]
+    notes: Optional[str]
+
+def _render(req: RecommendRequest, ranked: _Ranked, enc: Optional[Encoding]):
+    if enc is None:
+        items = [ScoredItem(item_id=iid, score=score, why=ranked.why) for iid, score in ranked.pairs]
+        if req.hydrate:
+            items = _hydrate(items)
+        return RecommendResponse(model_id=ranked.model_id, version=ranked.version, items=items, notes=ranked.notes)
+    meta = None
+    if req.hydrate:
+        by_id = get_catalog_index().by_id
+        meta = [by_id.get(iid) for iid, _ in ranked.pairs]
+    body = result_body(ranked.pairs, enc.columnar, why=ranked.why, meta=meta,
+                       model_id=ranked.model_id, version=ranked.version, notes=ranked.notes)
+    return encode_response(enc, body)
+
+def _fallback(req: RecommendRequest, reason: str) -> _Ranked:
+    """Trending list from memory (no DB, no scoring), flagged in notes."""
+    trending = get_trending()
+    pairs = trending.top(req.k, _filter_spec(req.filters))
+    return _Ranked("trending", trending.version, pairs, "trending", f"fallback:{reason}")
 
-    # ALS path (personalized recommendations)
+@router.post("/recommend", response_model=RecommendResponse)
+async def recommend(req: RecommendRequest, request: Request, background: BackgroundTasks):
+    """
+    Unified recommendation endpoint used by the UI.
+    Runs under a RECOMMEND_BUDGET_MS deadline and the endpoint's in-flight limit.
+    When either can't be met the in-memory trending list is returned instead,
+    with notes="fallback:<reason>", so overload costs quality rather than latency.
+    Clients may ask for orjson/msgpack (optionally columnar) via Accept; see encoding.py.
+    A SHADOW_SAMPLE of answered requests is replayed against the shadow version
+    once the response is out (app/serve/shadow.py).
+    """
+    enc = negotiate(request.headers.get("accept"))
+    with limiter("recommend").admit() as admitted:
+        if not admitted:
+            log.warning("recommend shed", extra={"fields": {"algo": req.algo, "reason": "overloaded"}})
+            return _render(req, _fallback(req, "overloaded"), enc)
+        try:
+            ranked = await _recommend(req, Deadline(RECOMMEND_BUDGET_MS))
+            background.add_task(_offer_shadow, req, ranked)
+        except _Degraded as e:
+            log.info("recommend degraded", extra={"fields": {"algo": req.algo, "reason": e.reason}})
+            ranked = _fallback(req, e.reason)
+    return _render(req, ranked, enc)
+
+async def _recommend(req: RecommendRequest, deadline: Deadline) -> _Ranked:
+    # Item-KNN path (seed-based similar items)
     if req.algo.lower() == "cf_itemknn":
         if not req.seed_item_id:
             # you can decide to return empty or popular when no seed is provided
-            return RecommendResponse(model_id="cf_itemknn", version="0.0.1", items=[], notes="seed required")
+            return _Ranked("cf_itemknn", _get_itemknn().version, [], None, "seed required")
+        pairs, why = await _score("cf_itemknn", deadline, _score_similar, req)
+        return _Ranked("cf_itemknn", _get_itemknn().version, pairs, why, "cf_itemknn")
+
+    # Session next-item path (anonymous-friendly; no FAISS)
+    if req.algo.lower() == "session_next":
+        row = await _resolve_model_row("session_markov", deadline)
+        if not row:
+            return _Ranked("session_markov", "dev", [], None, "session_markov not registered")
+        recent = await _resolve_session_tail(req, deadline)
+        if not recent:
+            return _Ranked(row["model_id"], row["version"], [], None, "session has no events yet")
+        pairs = await _score("session_next", deadline, _score_session, row, recent, req)
+        return _Ranked(row["model_id"], row["version"], pairs, "session-next", req.algo)
+
+    # a session merged into a user (POST /users/register) is served as that user
+    if not req.user_id and req.session_id:
+        owner = identity.user_for_session(req.session_id)
+        if owner:
+            req = req.model_copy(update={"user_id": owner})
+
+    # pick a model entry so response includes id/version
+    target_model_id = "mf_als" if req.algo.lower().startswith("mf") else "cf_itemknn"
+    row = await _resolve_model_row(target_model_id, deadline)
+    model_id, version = (row["model_id"], row["version"]) if row else (target_model_id, "dev")
+
+    # ALS path (personalized recommendations)
+    if target_model_id == "mf_als" and row and req.user_id and als_recommend_for_user is not None:
+        pairs = await _score("mf_als", deadline, _score_als, row, req)
+        if pairs:
+            return _Ranked(model_id, version, pairs, "mf-als", req.algo)
+        # not in the ALS model yet (e.g. registered since it was trained): seed from their history
+        seeds = await _resolve_seeds(req.user_id, deadline)
+        if seeds:
+            pairs = await _score("cf_itemknn", deadline, _score_seeds, seeds, req)
+            return _Ranked("cf_itemknn", _get_itemknn().version, pairs, "user-seeds", req.algo)
+
+    # Unknown algo or cold user: return an empty list to avoid incorrect assumptions.
+    return _Ranked(model_id, version, [], None, req.algo)
+
+
+@router.post("/recommend:batch")
+async def recommend_batch(req: BatchRecommendRequest, request: Request):
+    """
+    Batch recommendations for offline jobs (emails, notifications).
+    Resolves the model once and streams one NDJSON line per user/seed:
+      {"user_id": "...", "items": [{"item_id": "...", "score": 0.9}, ...]}
+    Model id/version are returned in the X-Model-Id / X-Model-Version headers.
+    At most BATCH_MAX_INFLIGHT streams run at once; callers beyond that get 503.
+    """
+    lim = limiter("recommend_batch")
+    if not lim.try_acquire():
+        raise HTTPException(status_code=503, detail="too many concurrent batch requests",
+                            headers={"Retry-After": "5"})
+    try:
+        # model load / registry lookup block; keep them off the event loop
+        resp = await asyncio.to_thread(_batch_stream, req, negotiate(request.headers.get("accept")))
+    except BaseException:
+        lim.release()
+        raise
+    _hold_slot(lim, resp)
+    return resp
+
+def _hold_slot(lim: ConcurrencyLimiter, resp: StreamingResponse) -> None:
+    """
+    Keep lim's slot until resp's body is done: sent, failed or abandoned by a
+    disconnect. (resp.background is skipped when the stream raises.)
+    """
+    held = {"slot": True}
+    def release() -> None:
+        if held.pop("slot", False):  # once, whichever path gets here first
+            lim.release()
+    body = resp.body_iterator
+    async def chunks():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            release()
+    resp.body_iterator = chunks()
+    # a stream cancelled before its first chunk never enters the try
+    weakref.finalize(resp.body_iterator, release)
+
+def _stream(label: str, key: str, results, enc: Optional[Encoding], headers: Dict[str, str]) -> StreamingResponse:
+    if enc is None:
+        lines, media_type = _ndjson_lines(key, results), "application/x-ndjson"
+    else:
+        lines, media_type = encode_stream(enc, key, results), enc.media_type
+    return StreamingResponse(_on_scoring_executor(label, lines), media_type=media_type, headers=headers)
+
+async def _on_scoring_executor(label: str, lines):
+    """
+    Drive a lazy batch body BATCH_SCORE_CHUNK records per task on the scoring
+    executor, so batch scoring shares its thread bound and OMP/BLAS caps with
+    /recommend. A full queue makes the batch wait, never /recommend.
+    """
+    executor = get_scoring_executor()
+    take = lambda: list(itertools.islice(lines, BATCH_SCORE_CHUNK))
+    while True:
+        try:
+            parts = await executor.run(label, take)
+        except ScoringBusy:
+            await asyncio.sleep(BATCH_BUSY_BACKOFF_S)
+            continue
+        if not parts:
+            return
+        for part in parts:
+            yield part
+
+def _batch_stream(req: BatchRecommendRequest, enc: Optional[Encoding]) -> StreamingResponse:
+    algo = req.algo.lower()
+    if algo == "cf_itemknn":
+        if not req.seed_item_ids:
+            raise HTTPException(status_code=400, detail="seed_item_ids required for cf_itemknn")
         knn = _get_itemknn()
-        pairs = knn.similar_items(req.seed_item_id, k=req.k)
-        items = [ScoredItem(item_id=iid, score=score, why="item-knn") for iid, score in pairs]
-        return RecommendResponse(model_id="cf_itemknn", version="0.0.1", items=items, notes="cf_itemknn")
+        headers = {"X-Model-Id": "cf_itemknn", "X-Model-Version": knn.version}
+        results = knn.similar_items_batch(req.seed_item_ids, k=req.k, mask=_itemknn_mask(knn, req.filters))
+        return _stream("batch:cf_itemknn", "seed_item_id", results, enc, headers)
+
+    if algo.startswith("mf"):
+        if not req.user_ids:
+            raise HTTPException(status_code=400, detail="user_ids required for mf_als")
+        if als_recommend_for_users is None:
+            raise HTTPException(status_code=503, detail="mf_als loader unavailable")
+        with _pg_conn() as conn:
+            row = _get_latest_model_row(conn, "mf_als")
+        if not row:
+            raise HTTPException(status_code=404, detail="no mf_als model registered")
+        headers = {"X-Model-Id": row["model_id"], "X-Model-Version": row["version"]}
+        results = als_recommend_for_users(
+            req.user_ids, req.k, row["model_id"], row["version"], row["artifact_uri"],
+            mask=_als_mask(row, req.filters),
+        )
+        return _stream("batch:mf_als", "user_id", results, enc, headers)
 
-    # Simple content-based / fallback demo: if a seed is given, echo top-k similar would go here.
-    # For now, return an empty list to avoid incorrect assumptions.
-    return RecommendResponse(model_id=model_id, version=version, items=[], notes=req.algo)
+    raise HTTPException(status_code=400, detail=f"unsupported algo for batch: {req.algo}")
 
 
 @router.post("/users/register", response_model=RegisterResponse)
-async def register_user(req: RegisterRequest):
-    """Lightweight registration: upsert by email, return internal user_id."""
-    sql_sel = "select user_id from public.users where email = %s limit 1"
-    # user_id has DEFAULT gen_random_uuid(); don't supply it explicitly
-    sql_ins = (
-        "insert into public.users (email, locale, name) "
-        "values (%s, %s, %s) returning user_id"
-    )
-    with _pg_conn() as conn, conn.cursor() as cur:
-        cur.execute(sql_sel, (req.email,))
-        row = cur.fetchone()
-        if row:
-            return RegisterResponse(user_id=str(row[0]))
-        cur.execute(sql_ins, (req.email, req.locale, req.name))
-        new_id = cur.fetchone()[0]
-        return RegisterResponse(user_id=str(new_id))
+def register_user(req: RegisterRequest):
+    """
+    Lightweight registration: one upsert-returning statement by email (safe under
+    concurrent sign-ups), return internal user_id. With session_id, the anonymous
+    session's events and like-states are re-keyed to the user in the same
+    transaction, and its items seed the user's recommendations right away.
+    """
+    if not req.session_id:
+        cached = identity.user_for_email(req.email)
+        if cached is not None:
+            return RegisterResponse(user_id=cached)
+    merged = None
+    with _pg_conn() as conn, conn.transaction():
+        user_id, created = identity.register(conn, req.email, req.locale, req.name)
+        if req.session_id:
+            merged = identity.merge_session(conn, req.session_id, user_id)
+    if merged is None:
+        return RegisterResponse(user_id=user_id, created=created)
+    identity.after_merge(req.session_id, user_id, merged)
+    return RegisterResponse(user_id=user_id, created=created, merged_events=merged["events"])
 
 
 @router.post("/events")
 async def record_event(ev: EventIn):
     """Record a single interaction. Stores optional JSONB context."""
+    with limiter("events").admit() as admitted:
+        if not admitted:
+            raise HTTPException(status_code=503, detail="overloaded", headers={"Retry-After": "1"})
+        # pool checkout and the insert block; the slot stays held until they finish
+        return await asyncio.to_thread(_record_event, ev)
+
+def _record_event(ev: EventIn) -> Dict[str, Any]:
     if not ev.item_id or not ev.event_type:
         raise HTTPException(status_code=400, detail="item_id and event_type are required")
 
-    # Debug: show inbound payload (useful while you’re tracing)
-    print("[MERLIN] /events inbound", ev.dict(), flush=True)
-
     # Prepare context: preserve raw and add normalized value for 'like'
     raw_ctx = ev.context or {}
     # Extract raw value if present
@@ -226,24 +750,47 @@ async def record_event(ev: EventIn):
                 normalized_ctx[k] = raw_ctx[k]
     normalized_ctx.setdefault("event_schema_version", 1)
 
-    # Insert including context as JSONB; ts uses DEFAULT now()
+    # Insert including context as JSONB; ts uses DEFAULT now(). Events of a session
+    # merged into a user (public.session_identity) are stamped with that user.
     sql = """
         insert into public.events (user_id, session_id, item_id, event_type, context)
-        values (%s, %s, %s, %s, %s::jsonb)
+        values (coalesce(%s, (select user_id from public.session_identity where session_id = %s)),
+                %s, %s, %s, %s::jsonb)
+        returning ts, user_id
     """
 
-    with _pg_conn() as conn:
+    with _pg_conn() as conn, conn.transaction():
         # Ensure the item exists to satisfy the FK (optionally using meta if your catalog supports it)
         meta = raw_ctx.get("meta") if isinstance(raw_ctx, dict) else None
         _ensure_item(conn, ev.item_id, meta)
+        if ev.session_id and not ev.user_id:
+            # a concurrent merge of this session must see this row, or stamp it (identity.py)
+            identity.lock_session(conn, ev.session_id, shared=True)
         with conn.cursor() as cur:
-            cur.execute(sql, (ev.user_id, ev.session_id, ev.item_id, ev.event_type, json.dumps(normalized_ctx)))
-
-    print("[MERLIN] /events inserted", {
-        "item_id": ev.item_id,
-        "event_type": ev.event_type,
-        "context": normalized_ctx
-    }, flush=True)
+            cur.execute(sql, (ev.user_id, ev.session_id, ev.session_id, ev.item_id, ev.event_type,
+                              json.dumps(normalized_ctx)))
+            ts, user_id = cur.fetchone()
+        # caches and projections key on the text form, whatever type the column returns (as identity.register)
+        user_id = str(user_id) if user_id is not None else None
+        # Keep the like-state projection in step with the event (same transaction)
+        if ev.event_type == "like":
+            user_state.apply_like(conn, user_id, ev.session_id, ev.item_id, normalized_ctx["value"], ts)
+    if ev.event_type == "like":
+        user_state.invalidate(user_id, ev.session_id)
+    if ev.session_id:
+        session_tail.push(ev.session_id, ev.item_id)
+        if user_id and not ev.user_id:
+            identity.remember_session(ev.session_id, user_id)
+    if user_id:
+        identity.note_event(user_id, ev.item_id)
+
+    # ids and context values stay out of the log; only the event's shape is recorded
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("event recorded", extra={"fields": {
+            "event_type": ev.event_type,
+            "identity": "user" if ev.user_id else "session" if ev.session_id else "anonymous",
+            "context_keys": sorted(normalized_ctx),
+        }})
 
     return {"ok": True}
 
@@ -260,73 +807,43 @@ async def get_user_ratings(
     limit: int = Query(default=500, ge=1, le=5000),
 ):
     """
-    Return the latest like-state per item for a user (or session) from public.events.
-    We store toggle state in events.context->>'value':
+    Return the latest like-state per item for a user (or session).
+    Served from the user_item_state projection (maintained by /events), through an
+    in-process read-through cache that /events invalidates on write.
       - 1 = liked (on)
       - 0 = unliked (off)
-    Old rows without context default to 1.
     """
     if not user_id and not session_id:
         raise HTTPException(status_code=400, detail="Provide user_id or session_id")
 
-    where = "user_id = %s" if user_id else "session_id = %s"
-    who = user_id or session_id
-
-    # Latest 'like' event per item for this identity.
-    # Derive numeric value from context->>'value', defaulting to 1 for legacy rows.
-    sql = f"""
-        WITH ranked AS (
-            SELECT
-                item_id,
-                COALESCE( (context->>'value')::int, 1 ) AS value,
-                ts,
-                ROW_NUMBER() OVER (PARTITION BY item_id ORDER BY ts DESC) AS rn
-            FROM public.events
-            WHERE {where}
-              AND event_type = 'like'
-        )
-        SELECT item_id, value
-        FROM ranked
-        WHERE rn = 1
-        ORDER BY ts DESC
-        LIMIT %s
-    """
+    kind, who = ("user", user_id) if user_id else ("session", session_id)
+    rows = user_state.get_states(_pg_conn, kind, who, limit)
+    return [UserRating(item_id=item_id, value=value) for item_id, value in rows]
 
-    out: List[UserRating] = []
-    with _pg_conn() as conn, conn.cursor() as cur:
-        cur.execute(sql, (who, limit))
-        for item_id, value in cur.fetchall():
-            out.append(UserRating(item_id=item_id, value=int(value)))
-    return out
+
+# Bounded to a window so the scan stays on the recent events partitions
+POPULAR_SQL = """
+select item_id, count(*) as c
+from public.events
+where ts > now() - make_interval(days => %s)
+group by item_id
+order by c desc
+limit %s
+"""
 
 
 @router.get("/movies/popular")
 async def movies_popular(k: int = Query(default=20, ge=1, le=200)):
     """Return a simple popular list based on recent events; fallback to a seed list."""
-    sql = (
-        "select item_id, count(*) as c from public.events "
-        "group by item_id order by c desc limit %s"
-    )
     items: List[dict] = []
     with _pg_conn() as conn, conn.cursor() as cur:
-        cur.execute(sql, (k,))
+        cur.execute(POPULAR_SQL, (POPULAR_WINDOW_DAYS, k))
         rows = cur.fetchall()
         items = [{"item_id": r[0]} for r in rows]
 
     if not items:
         # Fallback to a few well-known IMDb ids
-        seed = [
-            "tt1375666",  # Inception
-            "tt0133093",  # The Matrix
-            "tt0111161",  # Shawshank
-            "tt0120737",  # LOTR:FOTR
-            "tt0468569",  # The Dark Knight
-            "tt0816692",  # Interstellar
-            "tt0103064",  # Terminator 2
-            "tt0088763",  # Back to the Future
-            "tt2395427",  # Avengers: Age of Ultron
-            "tt4154796",  # Avengers: Endgame
-        ][:k]
+        seed = SEED_POPULAR[:k]
         items = [{"item_id": x} for x in seed]
 
     return {"items": items}
\ No newline at end of file
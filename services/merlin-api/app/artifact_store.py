@@ -0,0 +1,427 @@
+# services/merlin-api/app/artifact_store.py
+"""
+Artifact store: where trainers publish model versions and where serving reads
+them from. ARTIFACT_URI_BASE picks the backend:
+
+  file:///models/           FileStore: a local or shared directory
+  http(s)://host/prefix/    HttpStore: any object store or static server that
+                            answers GET with Range and accepts PUT (MinIO or S3
+                            behind a gateway, nginx WebDAV, Supabase storage,
+                            or `python -m app.cli.artifacts serve` locally)
+
+Every version carries manifest.json with the sha256 and size of each file.
+Trainers write into staging_dir(). publish() then hashes the files and writes
+the manifest. For http it uploads the files, with the manifest last, so a
+version without a manifest is never read.
+
+Serving calls local_path(uri). For file:// that is the directory itself. For
+http, files are fetched in parallel Range chunks into a node-local
+content-addressed cache (ARTIFACT_CACHE_DIR/blobs/<sha256>) and verified
+against the manifest. They are then hard-linked into a per-version directory
+keyed by the uri and the manifest's own digest. Every local_path() re-reads the
+remote manifest, so a version republished under the same uri is fetched again
+rather than served stale. Files whose digest is already cached (item ids,
+pipelines, anything a retrain left unchanged) are never downloaded twice.
+"""
+from __future__ import annotations
+import abc
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_URI_BASE = "file:///models/"  # ARTIFACT_URI_BASE is read on use, after the CLIs' load_dotenv()
+ARTIFACT_STAGING_DIR = os.getenv("ARTIFACT_STAGING_DIR", os.path.join(tempfile.gettempdir(), "merlin-staging"))
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "merlin-artifacts"))
+ARTIFACT_HTTP_TOKEN = os.getenv("ARTIFACT_HTTP_TOKEN", "")  # sent as "Authorization: Bearer ..."
+ARTIFACT_HTTP_TIMEOUT_S = float(os.getenv("ARTIFACT_HTTP_TIMEOUT_S", "60"))
+ARTIFACT_FETCH_THREADS = int(os.getenv("ARTIFACT_FETCH_THREADS", "8"))
+ARTIFACT_CHUNK_MB = float(os.getenv("ARTIFACT_CHUNK_MB", "8"))  # 0 = one GET per file (no Range)
+ARTIFACT_RETRIES = int(os.getenv("ARTIFACT_RETRIES", "3"))
+ARTIFACT_VERIFY = os.getenv("ARTIFACT_VERIFY", "0") == "1"  # re-hash file:// versions on load
+
+MANIFEST = "manifest.json"
+_BUF = 1 << 20
+
+
+# ---------- manifest ----------
+def sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_BUF), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _files(local_dir: str) -> List[str]:
+    """Relative paths of every file in local_dir (posix separators), manifest excluded."""
+    out = []
+    for root, _, names in os.walk(local_dir):
+        for name in names:
+            rel = os.path.relpath(os.path.join(root, name), local_dir).replace(os.sep, "/")
+            if rel != MANIFEST:
+                out.append(rel)
+    return sorted(out)
+
+
+def build_manifest(local_dir: str, model_id: str, version: str) -> Dict[str, Any]:
+    files = {}
+    for rel in _files(local_dir):
+        path = os.path.join(local_dir, rel)
+        files[rel] = {"sha256": sha256_file(path), "size": os.path.getsize(path)}
+    return {
+        "model_id": model_id,
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "files": files,
+    }
+
+
+def read_manifest(local_dir: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(local_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None  # versions published before manifests existed
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json_atomic(path: str, obj: Dict[str, Any]) -> None:
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+
+
+def verify(local_dir: str, manifest: Dict[str, Any]) -> List[str]:
+    """Files that are missing or don't match their manifest entry."""
+    bad = []
+    for rel, meta in manifest["files"].items():
+        path = os.path.join(local_dir, rel)
+        if not os.path.exists(path) or os.path.getsize(path) != meta["size"] or sha256_file(path) != meta["sha256"]:
+            bad.append(rel)
+    return bad
+
+
+# ---------- backends ----------
+class ArtifactStore(abc.ABC):
+    """Backend interface. uri() is "<base><model_id>/<version>/" for every backend."""
+
+    def __init__(self, base: str):
+        self.base = base if base.endswith("/") else base + "/"
+
+    def uri(self, model_id: str, version: str) -> str:
+        return f"{self.base}{model_id}/{version}/"
+
+    @abc.abstractmethod
+    def staging_dir(self, model_id: str, version: str) -> str:
+        """Local directory a trainer writes the version's files into."""
+
+    @abc.abstractmethod
+    def publish(self, model_id: str, version: str, local_dir: Optional[str] = None) -> str:
+        """Write the manifest, make the version readable at uri(); returns the uri."""
+
+    @abc.abstractmethod
+    def local_path(self, uri: str) -> str:
+        """Local directory holding the version at uri, fetched first if needed."""
+
+    @abc.abstractmethod
+    def list_files(self, uri: str) -> List[str]:
+        """File names of the version at uri, without fetching it ([] if it doesn't exist)."""
+
+
+class FileStore(ArtifactStore):
+    def __init__(self, base: str):
+        super().__init__(base)
+        self.root = self.base[len("file://"):]
+
+    def staging_dir(self, model_id: str, version: str) -> str:
+        # trainers write in place; the version dir is the published artifact
+        return os.path.join(self.root, model_id, version)
+
+    def publish(self, model_id: str, version: str, local_dir: Optional[str] = None) -> str:
+        outdir = self.staging_dir(model_id, version)
+        if local_dir and os.path.abspath(local_dir) != os.path.abspath(outdir):
+            shutil.copytree(local_dir, outdir, dirs_exist_ok=True)
+        manifest = build_manifest(outdir, model_id, version)
+        _write_json_atomic(os.path.join(outdir, MANIFEST), manifest)
+        return self.uri(model_id, version)
+
+    def local_path(self, uri: str) -> str:
+        path = uri[len("file://"):]
+        if ARTIFACT_VERIFY:
+            manifest = read_manifest(path)
+            bad = verify(path, manifest) if manifest else []
+            if bad:
+                raise ValueError(f"artifact {uri} fails its manifest: {bad}")
+        return path
+
+    def list_files(self, uri: str) -> List[str]:
+        path = uri[len("file://"):]
+        return _files(path) if os.path.isdir(path) else []
+
+
+class _NoRange(Exception):
+    pass
+
+
+class HttpStore(ArtifactStore):
+    """GET/PUT object store with a node-local content-addressed cache."""
+
+    def __init__(self, base: str, cache_dir: str = ARTIFACT_CACHE_DIR):
+        super().__init__(base)
+        self.cache_dir = cache_dir
+        self.chunk = int(ARTIFACT_CHUNK_MB * (1 << 20))
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    # --- http ---
+    def _request(self, url: str, method: str = "GET", headers: Optional[Dict[str, str]] = None,
+                 body_path: Optional[str] = None, want=None):
+        """One request with retries on connection errors and 5xx. want(resp) reads the body."""
+        hdrs = dict(headers or {})
+        if ARTIFACT_HTTP_TOKEN:
+            hdrs["Authorization"] = f"Bearer {ARTIFACT_HTTP_TOKEN}"
+        for attempt in range(ARTIFACT_RETRIES + 1):
+            try:
+                if body_path is not None:
+                    hdrs["Content-Length"] = str(os.path.getsize(body_path))
+                    with open(body_path, "rb") as body:
+                        req = urllib.request.Request(url, data=body, method=method, headers=hdrs)
+                        with urllib.request.urlopen(req, timeout=ARTIFACT_HTTP_TIMEOUT_S) as resp:
+                            return want(resp) if want else None
+                req = urllib.request.Request(url, method=method, headers=hdrs)
+                with urllib.request.urlopen(req, timeout=ARTIFACT_HTTP_TIMEOUT_S) as resp:
+                    return want(resp) if want else None
+            except urllib.error.HTTPError as e:
+                if e.code < 500 or attempt == ARTIFACT_RETRIES:
+                    raise
+            except (urllib.error.URLError, OSError):
+                if attempt == ARTIFACT_RETRIES:
+                    raise
+            time.sleep(0.5 * 2 ** attempt)
+
+    def _get_range(self, url: str, fd: int, start: int, end: int, whole: bool) -> None:
+        """Write bytes [start, end] of url at the same offset of fd."""
+        def read(resp):
+            if resp.status != 206 and not (whole and resp.status == 200):
+                raise _NoRange(url)
+            off = start
+            for block in iter(lambda: resp.read(_BUF), b""):
+                os.pwrite(fd, block, off)
+                off += len(block)
+            if off != end + 1:
+                raise OSError(f"short read on {url}: {off - start} of {end + 1 - start} bytes")
+        headers = {} if whole else {"Range": f"bytes={start}-{end}"}
+        self._request(url, headers=headers, want=read)
+
+    # --- cache ---
+    def _blob(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, "blobs", digest)
+
+    def _version_prefix(self, uri: str) -> str:
+        return os.path.join(self.cache_dir, "versions", hashlib.sha256(uri.encode()).hexdigest()[:24])
+
+    def _version_dir(self, uri: str, manifest_digest: str) -> str:
+        return f"{self._version_prefix(uri)}-{manifest_digest[:16]}"
+
+    def _newest_cached(self, uri: str) -> Optional[str]:
+        """Most recently fetched copy of uri, whatever its manifest."""
+        prefix = self._version_prefix(uri)
+        root, name = os.path.split(prefix)
+        found = [os.path.join(root, d) for d in (os.listdir(root) if os.path.isdir(root) else [])
+                 if d.startswith(name + "-") and ".tmp-" not in d and os.path.isdir(os.path.join(root, d))]
+        return max(found, key=os.path.getmtime) if found else None
+
+    def _lock(self, path: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def _fetch_blobs(self, uri: str, wanted: Dict[str, Dict[str, Any]]) -> int:
+        """Download the files in wanted ({rel: meta}) into blobs/, chunks in parallel. Returns bytes fetched."""
+        parts: Dict[str, Tuple[str, int]] = {}
+        tasks = []
+        for rel, meta in wanted.items():
+            part = f"{self._blob(meta['sha256'])}.part-{os.getpid()}"
+            fd = os.open(part, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o644)
+            os.ftruncate(fd, meta["size"])
+            parts[rel] = (part, fd)
+            size, step = meta["size"], self.chunk or meta["size"]
+            whole = size <= step
+            for start in range(0, size, max(step, 1)):
+                tasks.append((uri + rel, fd, start, min(start + step, size) - 1, whole))
+        try:
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, ARTIFACT_FETCH_THREADS)) as pool:
+                    for fut in [pool.submit(self._get_range, *t) for t in tasks]:
+                        fut.result()
+            finally:
+                for _, fd in parts.values():
+                    os.close(fd)
+            for rel, (part, _) in parts.items():
+                got = sha256_file(part)
+                if got != wanted[rel]["sha256"]:
+                    raise ValueError(f"{uri}{rel}: sha256 {got} does not match manifest {wanted[rel]['sha256']}")
+                os.replace(part, self._blob(wanted[rel]["sha256"]))
+        except _NoRange:
+            raise RuntimeError(f"{uri}: server ignores Range requests; set ARTIFACT_CHUNK_MB=0")
+        finally:
+            for part, _ in parts.values():
+                if os.path.exists(part):
+                    os.remove(part)
+        return sum(m["size"] for m in wanted.values())
+
+    # --- interface ---
+    def staging_dir(self, model_id: str, version: str) -> str:
+        return os.path.join(ARTIFACT_STAGING_DIR, model_id, version)
+
+    def publish(self, model_id: str, version: str, local_dir: Optional[str] = None) -> str:
+        outdir = local_dir or self.staging_dir(model_id, version)
+        manifest = build_manifest(outdir, model_id, version)
+        _write_json_atomic(os.path.join(outdir, MANIFEST), manifest)
+        uri = self.uri(model_id, version)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, ARTIFACT_FETCH_THREADS)) as pool:
+            futs = [pool.submit(self._request, uri + rel, "PUT", None, os.path.join(outdir, rel))
+                    for rel in manifest["files"]]
+            for fut in futs:
+                fut.result()
+        self._request(uri + MANIFEST, "PUT", {"Content-Type": "application/json"},
+                      os.path.join(outdir, MANIFEST))
+        nbytes = sum(m["size"] for m in manifest["files"].values())
+        print(f"[artifacts] uploaded {uri} files={len(manifest['files'])} bytes={nbytes:,} "
+              f"in {time.perf_counter() - t0:.2f}s", flush=True)
+        if local_dir is None:
+            shutil.rmtree(outdir, ignore_errors=True)
+        return uri
+
+    def local_path(self, uri: str) -> str:
+        uri = uri if uri.endswith("/") else uri + "/"
+        try:
+            raw = self._request(uri + MANIFEST, want=lambda r: r.read())
+        except urllib.error.HTTPError:
+            raise
+        except (urllib.error.URLError, OSError) as e:
+            # store unreachable: a cached copy beats failing the load
+            cached = self._newest_cached(uri)
+            if cached is None:
+                raise
+            print(f"[MERLIN] artifacts: {uri} manifest unavailable ({e}); using cached {cached}", flush=True)
+            return cached
+        vdir = self._version_dir(uri, hashlib.sha256(raw).hexdigest())
+        if os.path.isdir(vdir):
+            return vdir
+        os.makedirs(os.path.join(self.cache_dir, "blobs"), exist_ok=True)
+        os.makedirs(os.path.dirname(vdir), exist_ok=True)
+        # threads of this process, then other workers / processes on the node
+        with self._lock(vdir), open(vdir + ".lock", "w") as lockf:
+            fcntl.flock(lockf, fcntl.LOCK_EX)
+            if os.path.isdir(vdir):
+                return vdir
+            t0 = time.perf_counter()
+            manifest = json.loads(raw)
+            wanted = {}
+            for rel, meta in manifest["files"].items():
+                if not os.path.exists(self._blob(meta["sha256"])):
+                    wanted.setdefault(meta["sha256"], (rel, meta))
+            nbytes = self._fetch_blobs(uri, dict(wanted.values()))
+
+            tmp = f"{vdir}.tmp-{os.getpid()}"
+            shutil.rmtree(tmp, ignore_errors=True)
+            for rel, meta in manifest["files"].items():
+                dst = os.path.join(tmp, rel)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.link(self._blob(meta["sha256"]), dst)
+            _write_json_atomic(os.path.join(tmp, MANIFEST), manifest)
+            os.rename(tmp, vdir)  # the version appears complete or not at all
+            print(f"[MERLIN] artifacts: {uri} files={len(manifest['files'])} fetched={len(wanted)} "
+                  f"bytes={nbytes:,} in {time.perf_counter() - t0:.2f}s", flush=True)
+            return vdir
+
+    def list_files(self, uri: str) -> List[str]:
+        uri = uri if uri.endswith("/") else uri + "/"
+        try:
+            manifest = json.loads(self._request(uri + MANIFEST, want=lambda r: r.read()))
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return []
+            raise
+        return sorted(manifest["files"])
+
+    def prune(self, keep: int) -> Dict[str, int]:
+        """Keep the `keep` most recently fetched versions; drop blobs no kept version links to."""
+        vroot = os.path.join(self.cache_dir, "versions")
+        vdirs = sorted((os.path.join(vroot, d) for d in os.listdir(vroot)
+                        if os.path.isdir(os.path.join(vroot, d)) and ".tmp-" not in d),
+                       key=os.path.getmtime, reverse=True) if os.path.isdir(vroot) else []
+        for d in vdirs[keep:]:
+            shutil.rmtree(d, ignore_errors=True)
+            if os.path.exists(d + ".lock"):
+                os.remove(d + ".lock")
+        broot = os.path.join(self.cache_dir, "blobs")
+        freed = dropped = 0
+        for name in os.listdir(broot) if os.path.isdir(broot) else []:
+            path = os.path.join(broot, name)
+            st = os.stat(path)
+            if st.st_nlink == 1 and ".part-" not in name:  # no version dir links to it
+                os.remove(path)
+                freed += st.st_size
+                dropped += 1
+        return {"versions_removed": max(0, len(vdirs) - keep), "blobs_removed": dropped, "bytes_freed": freed}
+
+
+# ---------- module api ----------
+_STORES: Dict[str, ArtifactStore] = {}
+
+
+def _family(uri: str) -> str:
+    if uri.startswith("file://"):
+        return "file"
+    if uri.startswith(("http://", "https://")):
+        return "http"
+    raise ValueError(f"Unsupported artifact URI: {uri}")
+
+
+def _uri_base() -> str:
+    return os.getenv("ARTIFACT_URI_BASE", DEFAULT_URI_BASE)
+
+
+def default_store() -> ArtifactStore:
+    """The backend for ARTIFACT_URI_BASE; trainers publish here."""
+    return store_for(_uri_base())
+
+
+def store_for(uri: str) -> ArtifactStore:
+    """
+    Backend able to read uri. Reading only depends on the scheme, so registry
+    rows written under an older ARTIFACT_URI_BASE keep loading.
+    """
+    family = _family(uri)
+    store = _STORES.get(family)
+    if store is None:
+        base = _uri_base() if _family(_uri_base()) == family else uri
+        store = _STORES[family] = FileStore(base) if family == "file" else HttpStore(base)
+    return store
+
+
+def staging_dir(model_id: str, version: str) -> str:
+    return default_store().staging_dir(model_id, version)
+
+
+def publish(model_id: str, version: str, local_dir: Optional[str] = None) -> str:
+    return default_store().publish(model_id, version, local_dir)
+
+
+def local_path(uri: str) -> str:
+    return store_for(uri).local_path(uri)
+
+
+def list_files(uri: str) -> List[str]:
+    return store_for(uri).list_files(uri)
@@ -0,0 +1,138 @@
+# services/merlin-api/app/cli/artifacts.py
+"""
+Artifact store tools (see app/artifact_store.py).
+
+  python -m app.cli.artifacts serve --root /tmp/objstore --port 9000
+      local stand-in for an object store: GET/HEAD with Range, PUT
+  python -m app.cli.artifacts publish --model-id mf_als --version v3 --dir /models/mf_als/v3
+      write the manifest for an existing version dir and publish it to ARTIFACT_URI_BASE
+  python -m app.cli.artifacts fetch http://localhost:9000/models/mf_als/v3/
+      pull a version into this node's cache before a deploy
+  python -m app.cli.artifacts prune --keep 6
+      drop all but the newest cached versions and the blobs only they used
+
+Against the stand-in:
+
+  ARTIFACT_URI_BASE=http://localhost:9000/models/ python -m app.cli.train_session_markov
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app import artifact_store  # noqa: E402  (ARTIFACT_* settings may come from .env)
+
+_RANGE = re.compile(r"bytes=(\d+)-(\d*)$")
+
+
+class _ObjectHandler(BaseHTTPRequestHandler):
+    root = "."
+    protocol_version = "HTTP/1.1"
+
+    def _path(self) -> str:
+        rel = os.path.normpath(self.path.split("?", 1)[0].lstrip("/"))
+        if rel.startswith(".."):
+            raise PermissionError(self.path)
+        return os.path.join(self.root, rel)
+
+    def _reply(self, code: int, length: int = 0, extra=None) -> None:
+        self.send_response(code)
+        self.send_header("Content-Length", str(length))
+        for k, v in (extra or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+
+    def _get(self, body: bool) -> None:
+        path = self._path()
+        if not os.path.isfile(path):
+            return self._reply(404)
+        size = os.path.getsize(path)
+        start, end, code, extra = 0, size - 1, 200, {"Accept-Ranges": "bytes"}
+        m = _RANGE.match(self.headers.get("Range", ""))
+        if m:
+            start = int(m.group(1))
+            end = min(int(m.group(2)) if m.group(2) else size - 1, size - 1)
+            if start > end:
+                return self._reply(416, extra={"Content-Range": f"bytes */{size}"})
+            code, extra["Content-Range"] = 206, f"bytes {start}-{end}/{size}"
+        self._reply(code, end - start + 1, extra)
+        if body:
+            with open(path, "rb") as f:
+                f.seek(start)
+                left = end - start + 1
+                while left > 0:
+                    block = f.read(min(left, 1 << 20))
+                    self.wfile.write(block)
+                    left -= len(block)
+
+    def do_GET(self):
+        self._get(body=True)
+
+    def do_HEAD(self):
+        self._get(body=False)
+
+    def do_PUT(self):
+        path = self._path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        left = int(self.headers.get("Content-Length", "0"))
+        tmp = f"{path}.upload-{os.getpid()}-{id(self)}"
+        with open(tmp, "wb") as f:
+            while left > 0:
+                block = self.rfile.read(min(left, 1 << 20))
+                if not block:
+                    break
+                f.write(block)
+                left -= len(block)
+        os.replace(tmp, path)
+        self._reply(201)
+
+    def log_message(self, fmt, *args):
+        print(f"[artifacts] {self.address_string()} {fmt % args}", flush=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Artifact store tools.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("serve", help="local GET/PUT object store stand-in")
+    s.add_argument("--root", required=True)
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=9000)
+    p = sub.add_parser("publish", help="manifest + publish an existing version dir to ARTIFACT_URI_BASE")
+    p.add_argument("--model-id", required=True)
+    p.add_argument("--version", required=True)
+    p.add_argument("--dir", required=True)
+    f = sub.add_parser("fetch", help="pull a version into the node cache")
+    f.add_argument("uri")
+    f.add_argument("--verify", action="store_true", help="re-hash the local files against the manifest")
+    r = sub.add_parser("prune", help="trim the node cache")
+    r.add_argument("--keep", type=int, default=6, help="cached versions to keep (most recently fetched)")
+    args = ap.parse_args()
+
+    if args.cmd == "serve":
+        os.makedirs(args.root, exist_ok=True)
+        _ObjectHandler.root = args.root
+        print(f"[artifacts] serving {args.root} on http://{args.host}:{args.port}/", flush=True)
+        ThreadingHTTPServer((args.host, args.port), _ObjectHandler).serve_forever()
+    elif args.cmd == "publish":
+        local = os.path.abspath(args.dir)
+        uri = artifact_store.publish(args.model_id, args.version, local)
+        print(json.dumps({"artifact_uri": uri}, indent=2))
+    elif args.cmd == "fetch":
+        path = artifact_store.local_path(args.uri)
+        manifest = artifact_store.read_manifest(path)
+        bad = artifact_store.verify(path, manifest) if (args.verify and manifest) else []
+        print(json.dumps({"artifact_uri": args.uri, "local_path": path, "bad_files": bad}, indent=2))
+        if bad:
+            raise SystemExit(1)
+    elif args.cmd == "prune":
+        print(json.dumps(artifact_store.store_for("http://").prune(args.keep), indent=2))
+
+
+if __name__ == "__main__":
+    main()
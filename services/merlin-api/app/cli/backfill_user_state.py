@@ -0,0 +1,27 @@
+# services/merlin-api/app/cli/backfill_user_state.py
+from __future__ import annotations
+import os
+
+import psycopg
+from dotenv import load_dotenv
+
+from app.db import user_state
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+
+def main():
+    """Create user_item_state (if needed) and rebuild it from public.events like history."""
+    if not DATABASE_URL:
+        raise SystemExit("DATABASE_URL not set")
+    print(f"Connecting to DB at {DATABASE_URL.split('@')[-1]} ...")
+    with psycopg.connect(DATABASE_URL) as conn:
+        n = user_state.backfill(conn)
+        conn.commit()
+    print(f"[backfill] user_item_state rows written: {n:,}")
+
+
+if __name__ == "__main__":
+    main()
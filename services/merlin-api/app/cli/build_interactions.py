@@ -0,0 +1,104 @@
+# services/merlin-api/app/cli/build_interactions.py
+"""
+Build the shared interaction matrix (app/trainers/interactions.py) and register
+it as model_id "interactions".
+
+  python -m app.cli.build_interactions --sources movielens,events
+  python -m app.cli.train_mfals_register --version v9 --interactions latest
+  python -m app.cli.train_and_register --version 0.1.0 --source interactions --interactions latest
+
+Ids stay on the rows/columns of --parent (default: the latest build). When the
+result has the parent's fingerprint nothing is published unless --force.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import time
+
+import psycopg
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app import artifact_store  # noqa: E402  (ARTIFACT_* / MOVIELENS_* settings may come from .env)
+from app.cli.train_and_register import _upsert_registry  # noqa: E402
+from app.trainers import interactions  # noqa: E402
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+SOURCES = ("movielens", "events")
+
+
+def _parent(conn, ref: str):
+    if ref == "none":
+        return None
+    try:
+        return interactions.load_ref(conn, ref)
+    except SystemExit:
+        if ref == "latest":  # first build
+            return None
+        raise
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build and register the shared interaction matrix.")
+    ap.add_argument("--version", default="auto", help="version tag; 'auto' = ix-<UTC timestamp>")
+    ap.add_argument("--stage", default="dev", choices=["dev", "staging", "prod"])
+    ap.add_argument("--sources", default="movielens,events",
+                    help=f"comma-separated subset of {','.join(SOURCES)}")
+    ap.add_argument("--days", type=int, default=0, help="event history used (0 = all)")
+    ap.add_argument("--parent", default="latest", help="build whose ids keep their rows: a version, latest, or none")
+    ap.add_argument("--force", action="store_true", help="publish even if the fingerprint is unchanged")
+    args = ap.parse_args()
+
+    sources = [s.strip() for s in args.sources.split(",") if s.strip()]
+    unknown = sorted(set(sources) - set(SOURCES))
+    if unknown or not sources:
+        raise SystemExit(f"--sources must be a subset of {','.join(SOURCES)} (got {args.sources!r})")
+    if not DATABASE_URL:
+        raise SystemExit("DATABASE_URL is not set")
+    version = time.strftime("ix-%Y%m%dT%H%M%S", time.gmtime()) if args.version == "auto" else args.version
+
+    with psycopg.connect(DATABASE_URL) as conn:
+        parent = _parent(conn, args.parent)
+        frames, meta = [], {"version": version, "sources": sources, "watermark_ts": None}
+        if "movielens" in sources:
+            try:
+                frames.append(interactions.movielens_source())
+            except FileNotFoundError as e:
+                raise SystemExit(str(e))
+            meta.update({"movielens_threshold": interactions.IMPLICIT_THRESHOLD,
+                         "movielens_weight": interactions.MOVIELENS_WEIGHT})
+        if "events" in sources:
+            df, watermark = interactions.events_source(conn, args.days)
+            print(f"[events] rows={len(df):,} watermark={watermark}", flush=True)
+            frames.append(df)
+            meta.update({"event_weights": interactions.EVENT_WEIGHTS, "days": args.days, "watermark_ts": watermark})
+
+        t0 = time.perf_counter()
+        ix = interactions.build(frames, parent, meta)
+        print(f"[build] {ix.X.shape[0]:,} users x {ix.X.shape[1]:,} items nnz={ix.X.nnz:,} "
+              f"(+{ix.meta['new_users']:,} users, +{ix.meta['new_items']:,} items) "
+              f"in {time.perf_counter() - t0:.2f}s fingerprint={ix.fingerprint[:12]}", flush=True)
+
+        if parent is not None and parent.fingerprint == ix.fingerprint and not args.force:
+            print(json.dumps({"model_id": interactions.MODEL_ID, "version": parent.meta["version"],
+                              "fingerprint": ix.fingerprint, "unchanged": True}, indent=2))
+            return
+
+        interactions.save(artifact_store.staging_dir(interactions.MODEL_ID, version), ix)
+        artifact_uri = artifact_store.publish(interactions.MODEL_ID, version)
+        _upsert_registry(conn, interactions.MODEL_ID, version, args.stage, artifact_uri, ix.meta, "csr_npy",
+                         notes=f"Interaction matrix ({', '.join(sources)})")
+
+        print(json.dumps({
+            "model_id": interactions.MODEL_ID,
+            "version": version,
+            "stage": args.stage,
+            "artifact_uri": artifact_uri,
+            "metrics": ix.meta,
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# services/merlin-api/app/cli/migrate.py
+"""
+Apply schema migrations and maintain the monthly events partitions.
+
+  python -m app.cli.migrate                      # apply pending migrations + create upcoming partitions
+  python -m app.cli.migrate --status             # applied / pending migrations and partition sizes
+  python -m app.cli.migrate --check-plans        # EXPLAIN the events read paths, exit 1 on a bad plan
+
+Plan check against a throwaway local Postgres (seeding refuses non-local hosts):
+
+  docker run -d --rm -p 5433:5432 -e POSTGRES_PASSWORD=pg postgres:16
+  DATABASE_URL=postgresql://postgres:pg@localhost:5433/postgres \\
+      python -m app.cli.migrate --seed-events 500000 --check-plans
+"""
+from __future__ import annotations
+import argparse
+import os
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Set
+
+import psycopg
+from dotenv import load_dotenv
+from psycopg import sql
+from psycopg.conninfo import conninfo_to_dict
+
+from app.db import migrations
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+class PlanCheck(NamedTuple):
+    name: str
+    query: str
+    params: Callable[[Any], Optional[Sequence[Any]]]  # None = nothing to probe with; skipped
+    index: Optional[str]             # parent index the plan must use
+    max_partitions: Optional[int]    # upper bound on started (non-future) events partitions scanned
+
+
+def _sample(column: str, *extra: Any):
+    """Params for probing with a real id from `column` (plus any fixed trailing params)."""
+    def params(cur) -> Optional[Sequence[Any]]:
+        cur.execute(sql.SQL(
+            "select {c} from public.events where {c} is not null and event_type = 'like' limit 1"
+        ).format(c=sql.Identifier(column)))
+        row = cur.fetchone()
+        return (row[0], *extra) if row else None
+    return params
+
+
+def _checks() -> List[PlanCheck]:
+    # imported here so plain migrate runs don't load the serving stack
+    from app.api.v1.recs import POPULAR_SQL, POPULAR_WINDOW_DAYS
+    from app.serve.session_tail import RECENT_SQL, SESSION_TAIL_LEN
+    from app.serve.trending import TRENDING_SQL, TRENDING_SIZE, TRENDING_WINDOW_DAYS
+
+    like_history = """
+        select distinct on (item_id) item_id, context, ts
+        from public.events
+        where {col} = %s and event_type = 'like'
+        order by item_id, ts desc
+    """
+    return [
+        PlanCheck("user_like_history", like_history.format(col="user_id"),
+                  _sample("user_id"), "events_user_like_idx", None),
+        PlanCheck("session_like_history", like_history.format(col="session_id"),
+                  _sample("session_id"), "events_session_like_idx", None),
+        PlanCheck("session_recent", RECENT_SQL,
+                  _sample("session_id", SESSION_TAIL_LEN * 3),
+                  "events_session_recent_idx", None),
+        PlanCheck("trending", TRENDING_SQL,
+                  lambda cur: (TRENDING_WINDOW_DAYS, TRENDING_SIZE), None, 2),
+        PlanCheck("popular", POPULAR_SQL,
+                  lambda cur: (POPULAR_WINDOW_DAYS, 20), None, 2),
+        PlanCheck("incremental_export",
+                  "select user_id, item_id, event_type, ts from public.events "
+                  "where item_id is not null and ts > now() - make_interval(days => %s)",
+                  lambda cur: (1,), None, 2),
+    ]
+
+
+def _walk(node: Dict[str, Any]):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from _walk(child)
+
+
+def _index_family(cur, parent: str) -> Set[str]:
+    """The parent index plus its per-partition children (auto-named on each partition)."""
+    cur.execute(
+        "select c.relname from pg_inherits i join pg_class c on c.oid = i.inhrelid "
+        "where i.inhparent = to_regclass(%s)",
+        (f"public.{parent}",),
+    )
+    return {parent} | {r[0] for r in cur.fetchall()}
+
+
+def check_plans(conn) -> bool:
+    """Refresh stats + visibility maps, then EXPLAIN each read path. True if every check passes."""
+    now = datetime.now(timezone.utc)
+    # open-ended ts bounds keep the (empty) partitions made ahead of time; they cost nothing
+    future = {name for name, lo, _, _ in migrations.partitions(conn) if lo is not None and lo > now}
+    with conn.cursor() as cur:
+        cur.execute("vacuum (analyze) public.events")
+        ok = True
+        for check in _checks():
+            params = check.params(cur)
+            if params is None:
+                print(f"[plan] SKIP {check.name}: no matching rows to probe with")
+                continue
+            cur.execute("explain (format json) " + check.query, params)
+            nodes = list(_walk(cur.fetchone()[0][0]["Plan"]))
+            relations = sorted({n["Relation Name"] for n in nodes if "Relation Name" in n})
+            used = {n["Index Name"] for n in nodes if "Index Name" in n}
+            problems = []
+            started = [r for r in relations if r not in future]
+            if check.max_partitions is not None and len(started) > check.max_partitions:
+                problems.append(f"scans {len(started)} partitions (max {check.max_partitions})")
+            if check.index and not used & _index_family(cur, check.index):
+                problems.append(f"does not use {check.index}")
+            ok = ok and not problems
+            node_types = sorted({n["Node Type"] for n in nodes})
+            print(f"[plan] {'FAIL' if problems else 'PASS'} {check.name}: "
+                  f"partitions={started} (+{len(relations) - len(started)} future) nodes={node_types}"
+                  + (f" -- {'; '.join(problems)}" if problems else ""))
+    return ok
+
+
+def _require_local(dsn: str) -> None:
+    host = conninfo_to_dict(dsn).get("host") or "localhost"
+    if host not in LOCAL_HOSTS and not host.startswith("/"):
+        raise SystemExit(f"refusing to seed synthetic events into non-local host {host!r}")
+
+
+def seed_events(conn, n: int, months: int, users: int = 2000, items: int = 5000) -> None:
+    """Synthetic events spread over the last `months` months (skewed item popularity)."""
+    migrations.ensure_partitions(conn, months_back=months)
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(
+            "select format_type(atttypid, atttypmod) from pg_attribute "
+            "where attrelid = 'public.events'::regclass and attname = 'user_id'"
+        )
+        user_type = sql.SQL(cur.fetchone()[0])
+        cur.execute(
+            "insert into public.item_catalog (item_id) "
+            "select 'seed-' || lpad(g::text, 5, '0') from generate_series(0, %s) g "
+            "on conflict (item_id) do nothing",
+            (items,),
+        )
+        # a quarter of the events are anonymous (session only)
+        cur.execute(sql.SQL("""
+            insert into public.events (user_id, session_id, item_id, event_type, context, ts)
+            select case when mod(g, 4) = 0 then null
+                        else (md5('seed-user-' || mod(g, %(users)s))::uuid)::text::{user_type} end,
+                   case when mod(g, 4) = 0 then 'seed-session-' || mod(g, %(users)s) end,
+                   'seed-' || lpad(floor(random() * random() * %(items)s)::int::text, 5, '0'),
+                   (array['view', 'view', 'click', 'like', 'save'])[1 + floor(random() * 5)::int],
+                   jsonb_build_object('value', 1, 'event_schema_version', 1),
+                   now() - random() * make_interval(days => %(days)s)
+            from generate_series(1, %(n)s) g
+        """).format(user_type=user_type), {"users": users, "items": items, "days": months * 30, "n": n})
+    print(f"[seed] inserted {n:,} synthetic events over ~{months} months")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Apply schema migrations and maintain events partitions.")
+    ap.add_argument("--status", action="store_true", help="show migrations and partitions, change nothing")
+    ap.add_argument("--partitions-ahead", type=int, default=migrations.EVENTS_PARTITIONS_AHEAD,
+                    help="months of events partitions to keep ready (default EVENTS_PARTITIONS_AHEAD)")
+    ap.add_argument("--seed-events", type=int, default=0,
+                    help="insert N synthetic events first (local databases only)")
+    ap.add_argument("--seed-months", type=int, default=12, help="history spanned by --seed-events")
+    ap.add_argument("--check-plans", action="store_true",
+                    help="EXPLAIN the events read paths; exit 1 if one misses its index or partition bound")
+    args = ap.parse_args()
+
+    if not DATABASE_URL:
+        raise SystemExit("DATABASE_URL not set")
+    print(f"Connecting to DB at {DATABASE_URL.split('@')[-1]} ...")
+    with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+        if args.status:
+            applied = migrations.applied_versions(conn)
+            for version, name, applied_at in applied:
+                print(f"[migrate] {version:>3} {name:<28} applied {applied_at:%Y-%m-%d %H:%M}")
+            for m in migrations.pending(conn):
+                print(f"[migrate] {m.version:>3} {m.name:<28} PENDING")
+            for name, lo, hi, rows in migrations.partitions(conn):
+                print(f"[partition] {name:<16} [{lo or 'minvalue'}, {hi or 'maxvalue'})  ~{rows:,} rows")
+            return
+
+        for name in migrations.migrate(conn):
+            print(f"[migrate] applied {name}")
+        for name in migrations.ensure_partitions(conn, months_ahead=args.partitions_ahead):
+            print(f"[migrate] created partition {name}")
+
+        if args.seed_events:
+            _require_local(DATABASE_URL)
+            seed_events(conn, args.seed_events, args.seed_months)
+        if args.check_plans and not check_plans(conn):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# services/merlin-api/app/cli/serve.py
+"""
+Preforked multi-worker server.
+
+The master process imports the app, loads the models once, then binds the
+listening socket and forks N uvicorn workers that share it. Model arrays (item-KNN
+CSR, ALS factors, FAISS index) are inherited copy-on-write instead of being loaded
+N times, and the DB connection budget (DB_POOL_MAX) is split across workers.
+
+The master never runs a query. A FAISS search starts libgomp's thread pool, and
+a child forked after that deadlocks on its first parallel region; the warm-up
+queries run in each worker's lifespan instead.
+
+    python -m app.cli.serve --workers auto --port 8080
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+RESPAWN_BACKOFF_S = 1.0
+
+
+def _resolve_workers(value: str) -> int:
+    if value == "auto":
+        try:
+            return max(1, len(os.sched_getaffinity(0)))
+        except AttributeError:  # not available on macOS
+            return max(1, os.cpu_count() or 1)
+    return max(1, int(value))
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _preload() -> None:
+    """Load models (no queries, see module docstring) in the master so forked workers share the pages."""
+    from app.api.v1 import recs
+    from app.db.pool import close_pool
+
+    t0 = time.perf_counter()
+    try:
+        recs.warm_models(query=False)
+    finally:
+        # Never hand an open pool (live sockets) to forked children; each worker
+        # opens its own slice of the budget in the app lifespan.
+        close_pool()
+    print(f"[MERLIN] master preload done in {time.perf_counter() - t0:.1f}s", flush=True)
+    # Move everything allocated so far out of the GC's tracked generations so
+    # collections in workers don't touch (and un-share) the inherited objects.
+    gc.collect()
+    gc.freeze()
+
+
+def _run_worker(sock: socket.socket, args) -> None:
+    import uvicorn
+    from app.main import app
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=args.log_level, proxy_headers=True, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run merlin-api with N preforked workers sharing preloaded models.")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    ap.add_argument("--workers", default=os.getenv("WEB_CONCURRENCY", "1"),
+                    help="worker count, or 'auto' for one per available core")
+    ap.add_argument("--no-preload", action="store_true", help="skip loading models in the master")
+    ap.add_argument("--log-level", default="info")
+    args = ap.parse_args()
+
+    n = _resolve_workers(args.workers)
+    # Every worker needs at least one connection; past the node budget (what
+    # app.db.pool reads as DB_POOL_BUDGET) workers would hold more than DB_POOL_MAX.
+    budget = int(os.getenv("DB_POOL_MAX", "2"))
+    if n > budget:
+        if args.workers != "auto":
+            raise SystemExit(f"[MERLIN] {n} workers exceed DB_POOL_MAX={budget}; "
+                             f"raise DB_POOL_MAX or lower --workers / WEB_CONCURRENCY")
+        print(f"[MERLIN] --workers auto: {n} cores, clamped to DB_POOL_MAX={budget} worker(s)", flush=True)
+        n = max(1, budget)
+    # Must be set before app.db.pool is imported: the pool sizes itself from it.
+    os.environ["MERLIN_WORKERS"] = str(n)
+
+    from app.main import app  # noqa: F401  (import once in the master)
+    from app.db import pool
+
+    print(f"[MERLIN] serving on {args.host}:{args.port} with {n} worker(s); "
+          f"db pool per worker min={pool.DB_POOL_MIN} max={pool.DB_POOL_MAX}", flush=True)
+
+    if not args.no_preload:
+        _preload()
+
+    sock = _bind(args.host, args.port)
+
+    if n == 1:
+        _run_worker(sock, args)
+        return
+
+    children: Dict[int, int] = {}  # pid -> slot
+    stopping = False
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(sock, args)
+            finally:
+                os._exit(0)
+        children[pid] = slot
+        print(f"[MERLIN] worker {slot} started pid={pid}", flush=True)
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for slot in range(n):
+        spawn(slot)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        if slot is None or stopping:
+            continue
+        print(f"[MERLIN] worker {slot} pid={pid} exited (status={status}); respawning", flush=True)
+        time.sleep(RESPAWN_BACKOFF_S)
+        spawn(slot)
+
+    sock.close()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,30 +10,26 @@ import numpy as np
 import pandas as pd
 import psycopg
 from dotenv import load_dotenv
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse import csr_matrix
 import implicit 
 
+from app import artifact_store
+from app.trainers.content_embed import content_text, fit_pipeline
+from app.trainers.quantize import SIM_MODES, quantize_sims, sims_drift, write_manifest
+
 # ---------- env ----------
 load_dotenv()  # loads services/merlin-api/.env when run from that working dir
 
+from app.trainers import interactions  # noqa: E402  (MOVIELENS_* settings may come from .env)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
-ARTIFACT_URI_BASE = os.getenv("ARTIFACT_URI_BASE", "file:///models/")
 
-# Optional: MovieLens settings (used when --source=movielens)
-MOVIELENS_DIR = os.getenv("MOVIELENS_DIR", "/app/data/movielens")  # path to extracted MovieLens files
-IMPLICIT_THRESHOLD = float(os.getenv("IMPLICIT_THRESHOLD", "4.0"))  # ratings >= threshold count as positive
 ITEMKNN_TOPK = int(os.getenv("ITEMKNN_TOPK", "200"))  # neighbors per item to retain
 
 # ---------- helpers ----------
 def _artifact_dir(model_id: str, version: str) -> str:
-    # support file:// URIs; only local file scheme is implemented in this CLI
-    if ARTIFACT_URI_BASE.startswith("file://"):
-        base_path = ARTIFACT_URI_BASE[len("file://") :]
-        return os.path.join(base_path, model_id, version)
-    # Future: implement supabase:// or s3:// here
-    raise ValueError(f"ARTIFACT_URI_BASE {ARTIFACT_URI_BASE} not supported by this CLI yet.")
+    # local dir the files are written to; publish() moves them to ARTIFACT_URI_BASE
+    return artifact_store.staging_dir(model_id, version)
 
 def _fetch_catalog(conn) -> pd.DataFrame:
     sql = """
@@ -43,154 +39,86 @@ def _fetch_catalog(conn) -> pd.DataFrame:
     """
     return pd.read_sql(sql, conn)
 
-def _build_content_vectors(df: pd.DataFrame) -> Dict[str, np.ndarray]:
-    # Concatenate title + overview + genres for simple content signal
-    text = (
-        df["title"].astype(str)
-        + " "
-        + df["overview"].astype(str)
-        + " "
-        + df["genres"].apply(lambda g: " ".join(g) if isinstance(g, list) else str(g))
-    )
-
-    # TF-IDF is fine for v1; later we can swap to SBERT/CLIP/etc.
-    vec = TfidfVectorizer(max_features=50000, ngram_range=(1, 2))
-    X = vec.fit_transform(text)  # sparse [items x vocab]
-    # Map: item_id -> dense vector (we’ll keep dense for simplicity; you could keep sparse too)
-    # For cosine_similarity across items, dense is convenient for np.savez
-    X_dense = X.astype(np.float32).toarray()
-    return {iid: X_dense[i] for i, iid in enumerate(df["item_id"].tolist())}
-
-def _tt_from_imdb_int(imdb_int):
+def _build_content_vectors(df: pd.DataFrame) -> Dict[str, Any]:
     """
-    Convert MovieLens imdbId (numeric) to IMDb 'tt' style, zero-padded to 7.
-    Example: 1375666 -> 'tt1375666'
+    TF-IDF over title + overview + genres, kept sparse and reduced with
+    TruncatedSVD to a compact unit-norm embedding [items x CONTENT_DIM].
+    The fitted pipeline is returned too so serving can embed new catalog rows.
     """
-    if pd.isna(imdb_int):
-        return None
-    try:
-        s = str(int(imdb_int))
-        return f"tt{s.zfill(7)}"
-    except Exception:
-        return None
-
-def _load_movielens_interactions() -> pd.DataFrame:
+    # same text builder serving uses for new items, so embeddings stay comparable
+    pipe, E = fit_pipeline([content_text(r) for r in df.to_dict("records")])
+    print(f"[content] embeddings: items={E.shape[0]:,} dim={E.shape[1]}", flush=True)
+    return {"item_ids": df["item_id"].astype(str).tolist(), "embeddings": E, "pipeline": pipe}
+
+def _train_cf_itemknn(vectors: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Load implicit positives from MovieLens.
-    Supports:
-      - CSV style: ratings.csv (+ optional links.csv for IMDb mapping)
-      - 100K style: u.data (tab-delimited)
-    Returns: DataFrame with columns [userId, item_id] where item_id is:
-      - IMDb 'tt...' if links.csv available (CSV style only)
-      - else MovieLens movieId as string
+    Content item-KNN: top-K neighbors by inner product over unit-norm embeddings,
+    found with a FAISS flat index in chunks (never an N x N dense matrix).
+    The index itself is kept as an artifact so new items can be added later.
     """
-    print("Movielens dir " + MOVIELENS_DIR, flush=True)
-
-    ratings_csv = os.path.join(MOVIELENS_DIR, "ratings.csv")
-    links_csv   = os.path.join(MOVIELENS_DIR, "links.csv")
-    udata_path  = os.path.join(MOVIELENS_DIR, "u.data")
-
-    # ---- Path A: CSV style (ml-20m/25m)
-    if os.path.exists(ratings_csv):
-        print(f"[load] reading {ratings_csv} ...", flush=True)
-        ratings = pd.read_csv(
-            ratings_csv,
-            usecols=["userId", "movieId", "rating"],
-            dtype={"userId": "int32", "movieId": "int32", "rating": "float32"},
-            low_memory=False,
-        )
-        print(f"[load] ratings shape={ratings.shape}", flush=True)
-
-        pos = ratings.loc[ratings["rating"] >= IMPLICIT_THRESHOLD, ["userId", "movieId"]].copy()
-        print(f"[filter] positives >= {IMPLICIT_THRESHOLD}: {len(pos):,}", flush=True)
-
-        if os.path.exists(links_csv):
-            print(f"[map] reading {links_csv} ...", flush=True)
-            links = pd.read_csv(links_csv, usecols=["movieId", "imdbId"])
-            links["item_id"] = links["imdbId"].apply(_tt_from_imdb_int)
-            pos = pos.merge(links[["movieId", "item_id"]], on="movieId", how="left")
-            pos["item_id"] = pos["item_id"].where(pos["item_id"].notna(),
-                                                  pos["movieId"].astype(str))
-        else:
-            print("[map] links.csv not found; using movieId strings", flush=True)
-            pos["item_id"] = pos["movieId"].astype(str)
-
-        out = pos[["userId", "item_id"]]
-        print(f"[out] interactions rows={len(out):,}", flush=True)
-        return out
-
-    # ---- Path B: ML-100K style (u.data)
-    if os.path.exists(udata_path):
-        print(f"[load] reading {udata_path} (ML-100K) ...", flush=True)
-        # u.data columns: user id | item id | rating | timestamp (tab-separated)
-        ratings = pd.read_csv(
-            udata_path,
-            sep="\t",
-            header=None,
-            names=["userId", "movieId", "rating", "timestamp"],
-            dtype={"userId": "int32", "movieId": "int32", "rating": "float32", "timestamp": "int64"},
-            engine="python",
-        )
-        print(f"[load] u.data shape={ratings.shape}", flush=True)
-
-        pos = ratings.loc[ratings["rating"] >= IMPLICIT_THRESHOLD, ["userId", "movieId"]].copy()
-        print(f"[filter] positives >= {IMPLICIT_THRESHOLD}: {len(pos):,}", flush=True)
-
-        # ML-100K has no links.csv; use movieId strings as item ids
-        pos["item_id"] = pos["movieId"].astype(str)
-
-        out = pos[["userId", "item_id"]]
-        print(f"[out] interactions rows={len(out):,}", flush=True)
-        return out
-
-    # ---- Neither format found
-    raise FileNotFoundError(
-        f"No MovieLens files found.\n"
-        f"Looked for CSV: {ratings_csv}\n"
-        f"and ML-100K: {udata_path}\n"
-        f"Set MOVIELENS_DIR correctly and mount the folder into the container."
-    )
+    import faiss
+
+    item_ids: List[str] = vectors["item_ids"]
+    E: np.ndarray = vectors["embeddings"]
+    n = E.shape[0]
+    index = faiss.IndexFlatIP(E.shape[1])
+    index.add(E)
 
-def _train_cf_itemknn(vectors: Dict[str, np.ndarray]) -> Dict[str, Any]:
-    item_ids: List[str] = list(vectors.keys())
-    mat = np.stack([vectors[i] for i in item_ids]).astype(np.float32)  # [N x D]
-    sims = cosine_similarity(mat)  # [N x N]
+    k = min(ITEMKNN_TOPK + 1, n)  # +1: the item itself comes back first
+    indptr = [0]; indices = []; data = []
+    for lo in range(0, n, 4096):
+        D, I = index.search(E[lo:lo + 4096], k)
+        for r in range(D.shape[0]):
+            keep = (I[r] >= 0) & (I[r] != lo + r)
+            indices.extend(I[r][keep].tolist())
+            data.extend(D[r][keep].tolist())
+            indptr.append(len(indices))
 
-    avg_sim = float(np.mean(sims))
+    S = csr_matrix(
+        (np.asarray(data, dtype=np.float32),
+         np.asarray(indices, dtype=np.int32),
+         np.asarray(indptr, dtype=np.int32)),
+        shape=(n, n),
+    )
     return {
         "item_ids": item_ids,
-        "similarity": sims,
-        "metrics": {"avg_sim": avg_sim},
+        "similarity_sparse": {
+            "data": S.data,
+            "indices": S.indices,
+            "indptr": S.indptr,
+            "shape": S.shape,
+        },
+        "content_index": index,
+        "content_pipeline": vectors["pipeline"],
+        "metrics": {
+            "avg_sim": float(S.data.mean()) if S.nnz > 0 else 0.0,
+            "n_items": n,
+            "dim": int(E.shape[1]),
+            "nnz": int(S.nnz),
+        },
     }
 
  # add at top with other imports
 
-def _train_itemknn_from_interactions(interactions: pd.DataFrame) -> Dict[str, Any]:
+def _train_itemknn_from_interactions(ix: interactions.Interactions) -> Dict[str, Any]:
     """
-    Train item-item cosine KNN from implicit interactions (userId, item_id).
+    Train item-item cosine KNN from the shared interaction matrix, binarized
+    (any positive weight is one positive).
     Keeps only TOP-K neighbors per item using implicit.nearest_neighbours.CosineRecommender.
     """
     # 1) Light tail filters to shrink graph (tune as needed)
-    item_cnt = interactions.groupby("item_id").size()
-    keep_items = set(item_cnt[item_cnt >= 5].index)    # items with >=5 positives
-    user_cnt = interactions.groupby("userId").size()
-    keep_users = set(user_cnt[user_cnt >= 5].index)     # users with >=5 positives
-    interactions = interactions[interactions["item_id"].isin(keep_items) &
-                                interactions["userId"].isin(keep_users)]
-    print(f"[train] after min-count filter: users={interactions['userId'].nunique():,} "
-          f"items={interactions['item_id'].nunique():,} rows={len(interactions):,}", flush=True)
-
-    # 2) Build CSR
-    users = interactions["userId"].astype("category")
-    items = interactions["item_id"].astype("category")
-    u = users.cat.codes.to_numpy()
-    i = items.cat.codes.to_numpy()
-    n_users = int(users.cat.categories.size)
-    n_items = int(items.cat.categories.size)
-
-    from scipy.sparse import coo_matrix, csr_matrix
-    X = coo_matrix((np.ones(len(interactions), dtype=np.float32), (u, i)),
-                   shape=(n_users, n_items)).tocsr()
+    B = ix.X.copy()
+    B.eliminate_zeros()
+    B.data = np.ones_like(B.data, dtype=np.float32)
+    keep_users = np.flatnonzero(np.diff(B.indptr) >= 5)                   # users with >=5 positives
+    keep_items = np.flatnonzero(np.bincount(B.indices, minlength=B.shape[1]) >= 5)  # items with >=5 positives
+    X = B[keep_users][:, keep_items].tocsr()
+    seen = np.bincount(X.indices, minlength=X.shape[1]) > 0  # items left without any kept user drop out
+    X, keep_items = X[:, seen].tocsr(), keep_items[seen]
+    n_users, n_items = X.shape
+    print(f"[train] after min-count filter: users={n_users:,} items={n_items:,} rows={X.nnz:,}", flush=True)
+
+    # 2) CSR (already built by the interactions stage)
     Xi = X.T.tocsr()  # item × user
     print(f"[train] matrix: users={n_users:,} items={n_items:,} nnz={X.nnz:,}", flush=True)
 
@@ -224,7 +152,6 @@ def _train_itemknn_from_interactions(interactions: pd.DataFrame) -> Dict[str, An
 
         indptr.append(len(indices))
 
-    from scipy.sparse import csr_matrix
     S = csr_matrix(
         (np.asarray(data, dtype=np.float32),
          np.asarray(indices, dtype=np.int32),
@@ -232,7 +159,7 @@ def _train_itemknn_from_interactions(interactions: pd.DataFrame) -> Dict[str, An
         shape=(n_items, n_items),
     )
 
-    item_ids = list(items.cat.categories.astype(str))
+    item_ids = [ix.item_ids[j] for j in keep_items]
     avg_sim = float(S.data.mean()) if S.nnz > 0 else 0.0
 
     return {
@@ -251,7 +178,7 @@ def _train_itemknn_from_interactions(interactions: pd.DataFrame) -> Dict[str, An
         },
     }
 
-def _save_artifacts(model_id: str, version: str, payload: Dict[str, Any]) -> str:
+def _save_artifacts(model_id: str, version: str, payload: Dict[str, Any], quantize: str | None = None) -> str:
     outdir = _artifact_dir(model_id, version)
     print(f"[save] writing artifacts to: {outdir}", flush=True)
     os.makedirs(outdir, exist_ok=True)
@@ -272,18 +199,36 @@ def _save_artifacts(model_id: str, version: str, payload: Dict[str, Any]) -> str
         with open(os.path.join(outdir, "sims_shape.json"), "w") as f:
             json.dump({"shape": sp["shape"]}, f)
         fmt = "sparse_triplet"
+        if quantize:
+            # quantized scores next to the float32 ones (served when SERVE_QUANTIZED=1)
+            q, params = quantize_sims(sp["data"], quantize)
+            np.save(os.path.join(outdir, "sims_data_q.npy"), q)
+            drift = sims_drift(np.asarray(sp["data"]), q, params, np.asarray(sp["indptr"]))
+            report = {"sims": params, "data_bytes_fp32": int(np.asarray(sp["data"]).nbytes),
+                      "data_bytes_q": int(q.nbytes), "drift": drift}
+            write_manifest(outdir, report)
+            payload.setdefault("metrics", {})["quantization"] = report
+            print(f"[quantize] {quantize}: overlap@{drift['k']}={drift['overlap_at_k']:.4f} "
+                  f"top1={drift['top1_agreement']:.4f}", flush=True)
     else:
         raise ValueError("Payload missing similarity entries")
 
+    # Content models also ship their FAISS index + embedding pipeline so serving
+    # can add new catalog items without a retrain (see app/serve/content_index.py)
+    if "content_index" in payload:
+        import faiss
+        import joblib
+        faiss.write_index(payload["content_index"], os.path.join(outdir, "content.index"))
+        joblib.dump(payload["content_pipeline"], os.path.join(outdir, "content_pipeline.joblib"))
+
     with open(os.path.join(outdir, "training_metrics.json"), "w") as f:
         json.dump(payload.get("metrics", {}), f, indent=2)
 
-    # Return artifact URI (keep same scheme as base)
-    if ARTIFACT_URI_BASE.startswith("file://"):
-        return f"{ARTIFACT_URI_BASE}{model_id}/{version}/"
-    return f"{ARTIFACT_URI_BASE}{model_id}/{version}/"
+    # manifest (sha256 per file) + upload for remote stores; returns the artifact URI
+    return artifact_store.publish(model_id, version)
 
-def _upsert_registry(conn, model_id: str, version: str, stage: str, artifact_uri: str, metrics: Dict[str, Any], fmt: str):
+def _upsert_registry(conn, model_id: str, version: str, stage: str, artifact_uri: str, metrics: Dict[str, Any], fmt: str,
+                     notes: str = "Item-item similarity model"):
     sql = """
     insert into model_registry (model_id, version, stage, artifact_uri, format, feature_schema_id, metrics_json, notes)
     values (%s, %s, %s, %s, %s, %s, %s::jsonb, %s)
@@ -303,7 +248,7 @@ def _upsert_registry(conn, model_id: str, version: str, stage: str, artifact_uri
         fmt,           # dense or sparse
         "v1",
         json.dumps(metrics),
-        "Item-item similarity model",
+        notes,
     )
     with conn.cursor() as cur:
         cur.execute(sql, params)
@@ -314,8 +259,13 @@ def main():
     parser.add_argument("--model-id", default="cf_itemknn", help="Registry model_id")
     parser.add_argument("--version", required=True, help="Version tag, e.g., 0.0.1")
     parser.add_argument("--stage", default="dev", choices=["dev", "staging", "prod"])
-    parser.add_argument("--source", default="movielens", choices=["movielens", "catalog_content"],
-                        help="movielens: item-KNN from interactions; catalog_content: TF-IDF content item-KNN")
+    parser.add_argument("--source", default="movielens", choices=["movielens", "interactions", "catalog_content"],
+                        help="movielens: item-KNN from MovieLens ratings; interactions: item-KNN from a "
+                             "shared interaction matrix (see --interactions); catalog_content: TF-IDF content item-KNN")
+    parser.add_argument("--interactions", default="latest",
+                        help="with --source interactions: matrix version, latest, or a path/URI")
+    parser.add_argument("--quantize", choices=SIM_MODES, default=None,
+                        help="also write quantized similarity scores (served when SERVE_QUANTIZED=1)")
     args = parser.parse_args()
 
     if not DATABASE_URL:
@@ -333,20 +283,27 @@ def main():
             # 2) Build content vectors
             vectors = _build_content_vectors(df)
 
-            # 3) Train CF over content vectors (dense)
+            # 3) Top-K content neighbors via FAISS (sparse)
             result = _train_cf_itemknn(vectors)
-            fmt = "npz_dense"
+            fmt = "sparse_triplet"
+
+        elif args.source == "interactions":
+            # Shared matrix (python -m app.cli.build_interactions): no CSV parsing, no events query
+            ix = interactions.load_ref(conn, args.interactions)
+            result = _train_itemknn_from_interactions(ix)
+            result["metrics"]["interactions"] = {"version": ix.meta["version"], "fingerprint": ix.fingerprint}
+            fmt = "sparse_triplet"
 
         else:
             # MovieLens interactions path (sparse)
-            interactions = _load_movielens_interactions()
-            if interactions.empty:
+            ml = interactions.movielens_source()
+            if ml.empty:
                 raise SystemExit("No MovieLens interactions after thresholding.")
 
-            result = _train_itemknn_from_interactions(interactions)
+            result = _train_itemknn_from_interactions(interactions.build([ml]))
             fmt = "sparse_triplet"
 
-        artifact_uri = _save_artifacts(args.model_id, args.version, result)
+        artifact_uri = _save_artifacts(args.model_id, args.version, result, args.quantize)
         _upsert_registry(conn, args.model_id, args.version, args.stage, artifact_uri, result.get("metrics", {}), fmt)
 
         print(json.dumps({
@@ -10,32 +10,74 @@ import faiss
 from implicit.als import AlternatingLeastSquares
 from dotenv import load_dotenv
 
+from app import artifact_store
+from app.trainers import als_sweep
+from app.trainers.interactions import EVENT_WEIGHTS, IDENTITY_SQL, load_ref as load_interactions
+from app.trainers.quantize import FACTOR_MODES, factor_drift, quantize_rows, save_rows, load_rows, write_manifest
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
-ARTIFACT_URI_BASE = os.getenv("ARTIFACT_URI_BASE", "file:///models/")
+
+# --reg / --alpha when not given (an --incremental run takes its parent's instead)
+DEFAULT_REG = 0.05
+DEFAULT_ALPHA = 40.0
 
 # ---------- helpers ----------
 
 def _artifact_dir(model_id: str, version: str) -> str:
-    if ARTIFACT_URI_BASE.startswith("file://"):
-        base = ARTIFACT_URI_BASE[len("file://"):]
-        return os.path.join(base, model_id, version)
-    raise ValueError(f"ARTIFACT_URI_BASE {ARTIFACT_URI_BASE} not supported")
+    # local dir the files are written to; artifact_store.publish() moves them to ARTIFACT_URI_BASE
+    return artifact_store.staging_dir(model_id, version)
 
+def _weighted(df: pd.DataFrame) -> pd.DataFrame:
+    df["weight"] = df["event_type"].map(EVENT_WEIGHTS).fillna(0.1)
+    return df[["user_id", "item_id", "weight", "ts"]]
+
+# Anonymous events count for their session, as in the shared interaction matrix
+# (IDENTITY_SQL), so a parent built either way shares ids with its increments.
 def _fetch_events(conn) -> pd.DataFrame:
-    # You can tweak weights below (views get tiny weight, likes/saves bigger)
-    sql = """
-    select user_id, item_id, event_type
+    # You can tweak weights in EVENT_WEIGHTS (app/trainers/interactions.py)
+    sql = f"""
+    select {IDENTITY_SQL} as user_id, item_id, event_type, ts
     from events
-    where item_id is not null
+    where item_id is not null and (user_id is not null or session_id is not null)
     """
     df = pd.read_sql(sql, conn)
     if df.empty:
         raise SystemExit("No events found. Insert some interactions first.")
-    weight_map = {"view": 0.1, "click": 0.3, "like": 1.0, "save": 1.2}
-    df["weight"] = df["event_type"].map(weight_map).fillna(0.1)
-    return df[["user_id", "item_id", "weight"]]
+    return _weighted(df)
+
+def _fetch_events_since(conn, since, overlap_minutes: int) -> pd.DataFrame:
+    """
+    Events newer than the parent's watermark. The window is widened by
+    overlap_minutes because ts is assigned at insert but rows become visible at
+    commit; re-reading a few events is harmless (affected rows are re-solved from
+    full history, not accumulated).
+    """
+    sql = f"""
+    select {IDENTITY_SQL} as user_id, item_id, event_type, ts
+    from events
+    where item_id is not null and (user_id is not null or session_id is not null)
+      and ts > %(since)s::timestamptz - make_interval(mins => %(overlap)s)
+    """
+    return _weighted(pd.read_sql(sql, conn, params={"since": since, "overlap": overlap_minutes}))
+
+def _fetch_history(conn, user_ids: list[str], item_ids: list[str]) -> pd.DataFrame:
+    """
+    Full interaction history of the given identities and items (rows to re-solve).
+    Users and sessions are matched on their own columns, so each arm can use an index.
+    """
+    sessions = [u[len("session:"):] for u in user_ids if u.startswith("session:")]
+    users = [u for u in user_ids if not u.startswith("session:")]
+    sql = f"""
+    select {IDENTITY_SQL} as user_id, item_id, event_type, ts
+    from events
+    where item_id is not null
+      and (user_id::text = any(%(users)s)
+           or (user_id is null and session_id = any(%(sessions)s))
+           or (item_id = any(%(items)s) and (user_id is not null or session_id is not null)))
+    """
+    return _weighted(pd.read_sql(sql, conn, params={"users": users, "sessions": sessions, "items": item_ids}))
 
 def _build_csr(df: pd.DataFrame):
     # Ordered lists of unique users/items
@@ -55,19 +97,196 @@ def _build_csr(df: pd.DataFrame):
     # Return both lists and dicts
     return mat, users, items, u2i, it2i
 
-def _train_als(csr: sp.csr_matrix, factors=64, reg=0.05, alpha=40.0, iters=20, seed=42):
+def _train_als(csr: sp.csr_matrix, factors=64, reg=0.05, alpha=40.0, iters=20, seed=42, threads=0, progress=True):
     # Convert to "confidence" by scaling with alpha (Hu et al.)
     Cui = csr.astype(np.float32) * alpha
     model = AlternatingLeastSquares(
-        factors=factors, regularization=reg, iterations=iters, random_state=seed, use_gpu=False
+        factors=factors, regularization=reg, iterations=iters, random_state=seed, use_gpu=False,
+        num_threads=threads,  # 0 = all cores
     )
     # implicit expects item-user CSR
-    model.fit(Cui.T)
+    model.fit(Cui.T, show_progress=progress)
     # Factors
     user_f = np.array(model.user_factors, dtype=np.float32)
     item_f = np.array(model.item_factors, dtype=np.float32)
     return user_f, item_f, {"factors": factors, "reg": reg, "alpha": alpha, "iters": iters}
 
+def _orient_factors(user_f: np.ndarray, item_f: np.ndarray, csr: sp.csr_matrix, users: list[str], items: list[str]):
+    """Resolve factor orientation robustly (implicit versions differ on user/item order)."""
+    rows, cols = csr.shape  # rows == number of users; cols == number of items
+    uf_n, if_n = user_f.shape[0], item_f.shape[0]
+
+    # Case A: already aligned with CSR shape
+    if (uf_n, if_n) == (rows, cols):
+        pass
+    # Case B: swapped relative to CSR shape
+    elif (uf_n, if_n) == (cols, rows):
+        user_f, item_f = item_f, user_f
+        uf_n, if_n = user_f.shape[0], item_f.shape[0]
+    else:
+        # Try alignment against explicit lists as a second signal
+        if (uf_n, if_n) == (len(users), len(items)):
+            pass
+        elif (uf_n, if_n) == (len(items), len(users)):
+            user_f, item_f = item_f, user_f
+            uf_n, if_n = user_f.shape[0], item_f.shape[0]
+        else:
+            raise AssertionError(
+                "ALS factor orientation cannot be resolved: "
+                f"user_f={user_f.shape}, item_f={item_f.shape}, "
+                f"csr={csr.shape}, users={len(users)}, items={len(items)}"
+            )
+
+    # Final sanity checks (must match CSR and list lengths)
+    assert user_f.shape[0] == rows and len(users) == rows, (user_f.shape, rows, len(users))
+    assert item_f.shape[0] == cols and len(items) == cols, (item_f.shape, cols, len(items))
+    return user_f, item_f
+
+def _load_parent(conn, model_id: str, version: str | None) -> Dict[str, Any]:
+    """Factors, id lists and watermark of a registered version (latest if version is None)."""
+    sql = "select version, artifact_uri, metrics_json from model_registry where model_id = %s"
+    params: list = [model_id]
+    if version:
+        sql += " and version = %s"
+        params.append(version)
+    else:
+        sql += " order by created_at desc limit 1"
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        row = cur.fetchone()
+    if not row:
+        raise SystemExit(f"No parent version found for {model_id} ({version or 'latest'})")
+    parent_version, artifact_uri, metrics = row[0], row[1], row[2] or {}
+    base = artifact_store.local_path(artifact_uri)
+
+    state_path = os.path.join(base, "training_state.json")
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+    watermark = state.get("watermark_ts") or metrics.get("watermark_ts")
+    if not watermark:
+        raise SystemExit(f"{model_id} {parent_version} has no watermark_ts; run a full train first")
+
+    mp = np.load(os.path.join(base, "mappings.npz"), allow_pickle=True)
+    return {
+        "version": parent_version,
+        "watermark_ts": watermark,
+        # confidence scaling the parent was solved with; None for versions that didn't record it
+        "interactions": metrics.get("interactions"),
+        "reg": state.get("reg", metrics.get("reg")),
+        "alpha": state.get("alpha", metrics.get("alpha")),
+        "user_f": np.load(os.path.join(base, "user_factors.npz"))["user_factors"].astype(np.float32),
+        "item_f": np.load(os.path.join(base, "item_factors.npz"))["item_factors"].astype(np.float32),
+        # mappings are saved aligned to factor rows, so list order == row order
+        "users": [str(u) for u, _ in mp["user_to_index"].tolist()],
+        "items": [str(i) for i, _ in mp["item_to_index"].tolist()],
+    }
+
+def _incremental_hparams(parent: Dict[str, Any], reg: float | None, alpha: float | None,
+                         override: bool) -> Tuple[float, float]:
+    """
+    reg/alpha for re-solving the parent's rows. They must be the parent's: the
+    rows held fixed were solved with them. A different value needs override.
+    """
+    out = {}
+    for name, given, default in (("reg", reg, DEFAULT_REG), ("alpha", alpha, DEFAULT_ALPHA)):
+        recorded = parent[name]
+        if recorded is None:
+            out[name] = default if given is None else given
+            print(f"[incremental] parent {parent['version']} has no recorded {name}; using {out[name]}", flush=True)
+        elif given is not None and float(given) != float(recorded) and not override:
+            raise SystemExit(f"--{name} {given} differs from parent {parent['version']}'s {recorded}; "
+                             "drop it, or pass --override-hparams to re-solve with it anyway")
+        else:
+            out[name] = float(recorded if given is None else given)
+    return out["reg"], out["alpha"]
+
+def _train_incremental(conn, parent: Dict[str, Any], reg=DEFAULT_REG, alpha=DEFAULT_ALPHA, iters=3,
+                       overlap_minutes=10, seed=42):
+    """
+    Warm-start ALS from a parent version using only events since its watermark.
+    Users/items touched by new events are the only rows re-solved: each
+    iteration recomputes their factors (implicit partial_fit_users/items) from
+    their full history while every other row stays fixed at the parent value.
+    New users/items are appended after the parent's rows, so existing ids keep
+    their index.
+    """
+    delta = _fetch_events_since(conn, parent["watermark_ts"], overlap_minutes)
+    users, items = list(parent["users"]), list(parent["items"])
+    user_f, item_f = parent["user_f"], parent["item_f"]
+    factors = user_f.shape[1]
+    hp = {"factors": factors, "reg": reg, "alpha": alpha, "iters": iters, "incremental": True,
+          "delta_events": int(len(delta))}
+    if delta.empty:
+        print("[incremental] no new events since watermark; factors unchanged", flush=True)
+        return user_f, item_f, users, items, hp, parent["watermark_ts"]
+
+    aff_users = delta["user_id"].astype(str).unique().tolist()
+    aff_items = delta["item_id"].astype(str).unique().tolist()
+    hist = _fetch_history(conn, aff_users, aff_items)
+    print(f"[incremental] delta={len(delta):,} events, users={len(aff_users):,} "
+          f"items={len(aff_items):,}, history rows={len(hist):,}", flush=True)
+
+    # Extend mappings: parent ids keep their rows, unseen ids go at the end
+    u2i = {u: i for i, u in enumerate(users)}
+    it2i = {it: i for i, it in enumerate(items)}
+    for u in hist["user_id"].astype(str).unique():
+        if u not in u2i:
+            u2i[u] = len(users)
+            users.append(u)
+    for it in hist["item_id"].astype(str).unique():
+        if it not in it2i:
+            it2i[it] = len(items)
+            items.append(it)
+
+    rng = np.random.default_rng(seed)
+    n_new_u, n_new_i = len(users) - user_f.shape[0], len(items) - item_f.shape[0]
+    user_f = np.vstack([user_f, rng.random((n_new_u, factors), dtype=np.float32) * 0.01])
+    item_f = np.vstack([item_f, rng.random((n_new_i, factors), dtype=np.float32) * 0.01])
+
+    rows = hist["user_id"].astype(str).map(u2i).values
+    cols = hist["item_id"].astype(str).map(it2i).values
+    data = hist["weight"].astype(np.float32).values * alpha  # confidence scaling, as in _train_als
+    Cui = sp.csr_matrix((data, (rows, cols)), shape=(len(users), len(items)))
+    Ciu = Cui.T.tocsr()
+
+    uids = np.array(sorted(u2i[u] for u in aff_users), dtype=np.int64)
+    iids = np.array(sorted(it2i[it] for it in aff_items), dtype=np.int64)
+
+    model = AlternatingLeastSquares(
+        factors=factors, regularization=reg, iterations=iters, random_state=seed, use_gpu=False
+    )
+    model.user_factors = user_f
+    model.item_factors = item_f
+    for _ in range(iters):
+        model.partial_fit_users(uids, Cui[uids])
+        model.partial_fit_items(iids, Ciu[iids])
+
+    watermark = max(pd.Timestamp(parent["watermark_ts"]), delta["ts"].max()).isoformat()
+    hp.update({"updated_users": int(len(uids)), "updated_items": int(len(iids)),
+               "new_users": int(n_new_u), "new_items": int(n_new_i)})
+    return (np.asarray(model.user_factors, dtype=np.float32),
+            np.asarray(model.item_factors, dtype=np.float32), users, items, hp, watermark)
+
+def _sweep_train(csr: sp.csr_matrix, config: Dict[str, Any], threads: int) -> Tuple[np.ndarray, np.ndarray]:
+    """One sweep candidate (runs in an als_sweep worker process)."""
+    user_f, item_f, _ = _train_als(csr, threads=threads, progress=False, **config)
+    return _orient_factors(user_f, item_f, csr, range(csr.shape[0]), range(csr.shape[1]))
+
+def _csv(cast):
+    return lambda s: [cast(x) for x in s.split(",") if x.strip()]
+
+def _run_sweep(csr: sp.csr_matrix, args) -> Dict[str, Any]:
+    space = {"factors": args.sweep_factors, "reg": args.sweep_reg,
+             "alpha": args.sweep_alpha, "iters": args.sweep_iters or [args.iters]}
+    configs = als_sweep.sample(space, args.sweep_trials) if args.sweep_trials else als_sweep.grid(space)
+    workers = args.sweep_workers or len(configs)
+    return als_sweep.run_sweep(
+        csr, configs, _sweep_train, workers, k=args.sweep_k, holdout=args.sweep_holdout,
+        max_eval_users=args.sweep_eval_users, log=lambda msg: print(msg, flush=True),
+    )
+
 def _build_faiss_index(item_f: np.ndarray):
     # Inner product ANN. Normalize to use cosine equivalently if you prefer.
     norms = np.linalg.norm(item_f, axis=1, keepdims=True) + 1e-12
@@ -84,7 +303,8 @@ def _save_artifacts(
     users: list[str],
     items: list[str],
     idx: faiss.Index,
-) -> str:
+    state: Dict[str, Any] | None = None,
+) -> None:
     outdir = _artifact_dir(model_id, version)
     os.makedirs(outdir, exist_ok=True)
 
@@ -102,9 +322,27 @@ def _save_artifacts(
     # 3) save faiss index
     faiss.write_index(idx, os.path.join(outdir, "items.index"))
 
-    # 4) return artifact uri
-    base = ARTIFACT_URI_BASE.rstrip("/")
-    return f"{base}/{model_id}/{version}/"
+    # 4) lineage + event watermark, read back by --incremental
+    with open(os.path.join(outdir, "training_state.json"), "w") as f:
+        json.dump(state or {}, f, indent=2)
+
+def _save_quantized(model_id: str, version: str, user_f: np.ndarray, item_f: np.ndarray, mode: str) -> Dict[str, Any]:
+    """
+    Write float16/int8 copies of the factors next to the float32 ones and report
+    how far serving rankings move when scoring from them.
+    """
+    outdir = _artifact_dir(model_id, version)
+    save_rows(os.path.join(outdir, "user_factors_q.npz"), quantize_rows(user_f, mode))
+    save_rows(os.path.join(outdir, "item_factors_q.npz"), quantize_rows(item_f, mode))
+    user_q = load_rows(os.path.join(outdir, "user_factors_q.npz"))
+    report = {
+        "factors": mode,
+        "user_bytes_fp32": int(user_f.nbytes),
+        "user_bytes_q": user_q.nbytes,
+        "drift": factor_drift(user_f, user_q, item_f),
+    }
+    write_manifest(outdir, report)
+    return report
 
 def _upsert_registry(conn, model_id: str, version: str, stage: str, artifact_uri: str, metrics: Dict[str,Any], notes: str):
     sql = """
@@ -131,65 +369,117 @@ def main():
     ap.add_argument("--version", required=True)
     ap.add_argument("--stage", default="dev", choices=["dev","staging","prod"])
     ap.add_argument("--factors", type=int, default=64)
-    ap.add_argument("--reg", type=float, default=0.05)
-    ap.add_argument("--alpha", type=float, default=40.0)
+    ap.add_argument("--reg", type=float, default=None, help=f"default {DEFAULT_REG}; --incremental: the parent's")
+    ap.add_argument("--alpha", type=float, default=None, help=f"default {DEFAULT_ALPHA}; --incremental: the parent's")
     ap.add_argument("--iters", type=int, default=20)
+    ap.add_argument("--incremental", action="store_true",
+                    help="warm-start from --parent-version using only events since its watermark")
+    ap.add_argument("--parent-version", default=None, help="parent for --incremental (default: latest)")
+    ap.add_argument("--inc-iters", type=int, default=3, help="ALS iterations in --incremental mode")
+    ap.add_argument("--override-hparams", action="store_true",
+                    help="--incremental: allow --reg/--alpha that differ from the parent's")
+    ap.add_argument("--overlap-minutes", type=int, default=10,
+                    help="re-read this much history before the watermark (late commits)")
+    ap.add_argument("--interactions", default=None,
+                    help="train on a shared interaction matrix (version, latest, or path/URI; "
+                         "see app.cli.build_interactions) instead of querying events")
+    ap.add_argument("--quantize", choices=FACTOR_MODES, default=None,
+                    help="also write quantized factors (served when SERVE_QUANTIZED=1)")
+    ap.add_argument("--sweep", action="store_true",
+                    help="train every --sweep-* combination on a held-out split; register only the best")
+    ap.add_argument("--sweep-factors", type=_csv(int), default=[32, 64, 128])
+    ap.add_argument("--sweep-reg", type=_csv(float), default=[0.01, 0.05, 0.1])
+    ap.add_argument("--sweep-alpha", type=_csv(float), default=[10.0, 40.0])
+    ap.add_argument("--sweep-iters", type=_csv(int), default=None, help="default: --iters")
+    ap.add_argument("--sweep-trials", type=int, default=0,
+                    help="random search: sample this many configs from the grid (0 = full grid)")
+    ap.add_argument("--sweep-workers", type=int, default=0,
+                    help="processes (default: one per config, capped by cores); cores are split evenly")
+    ap.add_argument("--sweep-k", type=int, default=20, help="cutoff for NDCG@k / recall@k")
+    ap.add_argument("--sweep-holdout", type=float, default=0.2, help="fraction of each user's events held out")
+    ap.add_argument("--sweep-eval-users", type=int, default=2000, help="users sampled for scoring")
     args = ap.parse_args()
+    if args.sweep and args.incremental:
+        raise SystemExit("--sweep trains from full history; it cannot be combined with --incremental")
+    if args.interactions and args.incremental:
+        raise SystemExit("--incremental reads events since the parent's watermark; it cannot use --interactions")
 
     if not DATABASE_URL:
         raise SystemExit("DATABASE_URL not set")
 
     print(f"Connecting to DB at {DATABASE_URL.split('@')[-1]} ...")
     with psycopg.connect(DATABASE_URL) as conn:
-        df = _fetch_events(conn)
-
-        # 2) build CSR
-        csr, users, items, u2i, it2i = _build_csr(df)
-
-        # 3) train ALS
-        user_f, item_f, hp = _train_als(
-            csr, factors=args.factors, reg=args.reg, alpha=args.alpha, iters=args.iters
-        )
-
-        # --- Resolve factor orientation robustly ---
-        rows, cols = csr.shape  # rows == number of users; cols == number of items
-        uf_n, if_n = user_f.shape[0], item_f.shape[0]
-
-        # Case A: already aligned with CSR shape
-        if (uf_n, if_n) == (rows, cols):
-            pass
-        # Case B: swapped relative to CSR shape
-        elif (uf_n, if_n) == (cols, rows):
-            user_f, item_f = item_f, user_f
-            uf_n, if_n = user_f.shape[0], item_f.shape[0]
+        ix = None  # shared interaction matrix, with --interactions
+        if args.incremental:
+            parent = _load_parent(conn, args.model_id, args.parent_version)
+            if parent["interactions"]:
+                # its rows also hold MovieLens positives that the events re-read here don't have
+                raise SystemExit(f"{args.model_id} {parent['version']} was trained on interactions "
+                                 f"{parent['interactions'].get('version')}; retrain it with --interactions "
+                                 "on a fresh build instead of --incremental")
+            print(f"[incremental] parent={parent['version']} watermark={parent['watermark_ts']}", flush=True)
+            reg, alpha = _incremental_hparams(parent, args.reg, args.alpha, args.override_hparams)
+            user_f, item_f, users, items, hp, watermark = _train_incremental(
+                conn, parent, reg=reg, alpha=alpha, iters=args.inc_iters,
+                overlap_minutes=args.overlap_minutes,
+            )
+            parent_version = parent["version"]
+            sweep = None
+            notes = f"Implicit ALS warm-start from {parent_version} + FAISS index"
         else:
-            # Try alignment against explicit lists as a second signal
-            if (uf_n, if_n) == (len(users), len(items)):
-                pass
-            elif (uf_n, if_n) == (len(items), len(users)):
-                user_f, item_f = item_f, user_f
-                uf_n, if_n = user_f.shape[0], item_f.shape[0]
+            if args.interactions:
+                # 1-2) shared matrix: ids and CSR as built by app.cli.build_interactions
+                ix = load_interactions(conn, args.interactions)
+                csr, users, items = ix.X, ix.user_ids, ix.item_ids
             else:
-                raise AssertionError(
-                    "ALS factor orientation cannot be resolved: "
-                    f"user_f={user_f.shape}, item_f={item_f.shape}, "
-                    f"csr={csr.shape}, users={len(users)}, items={len(items)}"
-                )
-
-        # Final sanity checks (must match CSR and list lengths)
-        assert user_f.shape[0] == rows and len(users) == rows, (user_f.shape, rows, len(users))
-        assert item_f.shape[0] == cols and len(items) == cols, (item_f.shape, cols, len(items))
+                df = _fetch_events(conn)
+
+                # 2) build CSR
+                csr, users, items, u2i, it2i = _build_csr(df)
+
+            # 3) train ALS (with --sweep: pick the config first, then refit it on all events)
+            sweep = None
+            if args.sweep:
+                sweep = _run_sweep(csr, args)
+                print(f"[sweep] best {sweep['best']} {sweep['metric']}="
+                      f"{sweep['candidates'][0][sweep['metric']]:.4f} in {sweep['wall_s']}s", flush=True)
+                hp_args = sweep["best"]
+            else:
+                hp_args = {"factors": args.factors, "iters": args.iters,
+                           "reg": DEFAULT_REG if args.reg is None else args.reg,
+                           "alpha": DEFAULT_ALPHA if args.alpha is None else args.alpha}
+            user_f, item_f, hp = _train_als(csr, **hp_args)
+            user_f, item_f = _orient_factors(user_f, item_f, csr, users, items)
+            watermark = ix.meta.get("watermark_ts") if ix is not None else pd.Timestamp(df["ts"].max()).isoformat()
+            parent_version = None
+            notes = "Implicit ALS factors + FAISS index"
+            if ix is not None:
+                notes += f" (interactions {ix.meta['version']})"
+            if sweep is not None:
+                notes += f" (best of {len(sweep['candidates'])} sweep configs by {sweep['metric']})"
 
         # 4) build FAISS on normalized item factors (cosine/IP)
         idx = _build_faiss_index(item_f)
 
         # 5) save artifacts (pass users/items, not dicts)
-        artifact_uri = _save_artifacts(
-            args.model_id, args.version, user_f, item_f, users, items, idx
+        state = {"watermark_ts": watermark, "parent_version": parent_version,
+                 "reg": hp["reg"], "alpha": hp["alpha"]}
+        _save_artifacts(
+            args.model_id, args.version, user_f, item_f, users, items, idx, state
         )
 
         # 6) simple metrics
-        metrics = {"num_users": int(user_f.shape[0]), "num_items": int(item_f.shape[0]), **hp}
+        metrics = {"num_users": int(user_f.shape[0]), "num_items": int(item_f.shape[0]), **hp, **state}
+        if sweep is not None:
+            metrics["sweep"] = sweep
+        if ix is not None:
+            metrics["interactions"] = {"version": ix.meta["version"], "fingerprint": ix.fingerprint}
+        if args.quantize:
+            metrics["quantization"] = _save_quantized(args.model_id, args.version, user_f, item_f, args.quantize)
+            drift = metrics["quantization"]["drift"]
+            print(f"[quantize] {args.quantize}: overlap@{drift['k']}={drift['overlap_at_k']:.4f} "
+                  f"top1={drift['top1_agreement']:.4f}", flush=True)
+        artifact_uri = artifact_store.publish(args.model_id, args.version)
 
         # 7) registry upsert
         _upsert_registry(
@@ -199,7 +489,7 @@ def main():
             args.stage,
             artifact_uri,
             metrics,
-            "Implicit ALS factors + FAISS index"
+            notes
         )
 
         # Log summary for CLI
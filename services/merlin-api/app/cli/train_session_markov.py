@@ -0,0 +1,86 @@
+# services/merlin-api/app/cli/train_session_markov.py
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+
+import pandas as pd
+import psycopg
+from dotenv import load_dotenv
+
+from app.cli.train_and_register import _save_artifacts, _upsert_registry
+from app.trainers.quantize import SIM_MODES
+from app.trainers.session_markov import build_transitions
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+
+def _fetch_sequences(conn, days: int) -> pd.DataFrame:
+    """
+    Every event with an identity in the last `days` (ts-bounded, so only those
+    monthly partitions are read). Sessions win over users: a logged-in browsing
+    session is still one sequence.
+    """
+    sql = """
+    select coalesce(session_id, 'user:' || user_id::text) as who, item_id, ts
+    from events
+    where item_id is not null
+      and (session_id is not null or user_id is not null)
+      and ts > now() - make_interval(days => %(days)s)
+    """
+    return pd.read_sql(sql, conn, params={"days": days})
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Train the session next-item transition model and register it.")
+    ap.add_argument("--model-id", default="session_markov")
+    ap.add_argument("--version", default="auto", help="version tag; 'auto' = sess-<UTC timestamp>")
+    ap.add_argument("--stage", default="dev", choices=["dev", "staging", "prod"])
+    ap.add_argument("--days", type=int, default=90, help="event history used")
+    ap.add_argument("--half-life-days", type=float, default=14.0, help="time decay of transitions")
+    ap.add_argument("--max-gap-minutes", type=float, default=30.0, help="a longer pause starts a new session")
+    ap.add_argument("--window", type=int, default=3, help="next items linked per event (weighted 1/distance)")
+    ap.add_argument("--topk", type=int, default=100, help="next items kept per item")
+    ap.add_argument("--quantize", choices=SIM_MODES, default=None,
+                    help="also write quantized transition scores (served when SERVE_QUANTIZED=1)")
+    args = ap.parse_args()
+
+    if not DATABASE_URL:
+        raise SystemExit("DATABASE_URL not set")
+    version = args.version if args.version != "auto" else time.strftime("sess-%Y%m%d%H%M", time.gmtime())
+
+    print(f"Connecting to DB at {DATABASE_URL.split('@')[-1]} ...")
+    with psycopg.connect(DATABASE_URL) as conn:
+        df = _fetch_sequences(conn, args.days)
+        if df.empty:
+            raise SystemExit("No session events found. Insert some interactions first.")
+        print(f"[session] events={len(df):,} identities={df['who'].nunique():,}", flush=True)
+
+        t0 = time.perf_counter()
+        payload = build_transitions(
+            df, half_life_days=args.half_life_days, max_gap_minutes=args.max_gap_minutes,
+            window=args.window, topk=args.topk,
+        )
+        m = payload["metrics"]
+        print(f"[session] sessions={m['n_sessions']:,} transitions={m['transitions']:,} "
+              f"items={m['n_items']:,} nnz={m['nnz']:,} in {time.perf_counter() - t0:.2f}s", flush=True)
+
+        artifact_uri = _save_artifacts(args.model_id, version, payload, args.quantize)
+        _upsert_registry(conn, args.model_id, version, args.stage, artifact_uri,
+                         payload["metrics"], "sparse_triplet")
+
+        print(json.dumps({
+            "model_id": args.model_id,
+            "version": version,
+            "stage": args.stage,
+            "artifact_uri": artifact_uri,
+            "metrics": payload["metrics"],
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
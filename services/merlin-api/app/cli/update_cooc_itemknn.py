@@ -0,0 +1,167 @@
+# services/merlin-api/app/cli/update_cooc_itemknn.py
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import psycopg
+from dotenv import load_dotenv
+
+from app import artifact_store
+from app.cli.train_and_register import _artifact_dir, _save_artifacts, _upsert_registry, ITEMKNN_TOPK
+from app.trainers.cooc_itemknn import CoocStore, STATE_FILES
+from app.trainers.interactions import EVENT_WEIGHTS, load_ref as load_interactions
+from app.trainers.quantize import SIM_MODES
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Event types that count as a positive co-occurrence signal
+POSITIVE_EVENTS = ("click", "like", "save")
+# Production model id; never rebuilt from an events-only graph
+DEFAULT_MODEL_ID = "cf_itemknn"
+
+
+def _find_parent(conn, model_id: str) -> Optional[Dict[str, Any]]:
+    """Newest registered version of model_id that carries co-occurrence state."""
+    sql = """
+    select version, artifact_uri from model_registry
+    where model_id = %s order by created_at desc limit 20
+    """
+    with conn.cursor() as cur:
+        cur.execute(sql, (model_id,))
+        rows = cur.fetchall()
+    for version, uri in rows:
+        try:
+            names = set(artifact_store.list_files(uri)) if uri else set()
+        except ValueError:  # scheme no backend reads
+            continue
+        if all(f in names for f in STATE_FILES):
+            # only the parent that is actually used gets fetched
+            return {"version": version, "base": artifact_store.local_path(uri)}
+    return None
+
+
+def _fetch_positives(conn, since: Optional[str], overlap_minutes: int) -> pd.DataFrame:
+    """
+    Positive (identity, item) pairs since the watermark. Anonymous sessions count
+    as their own identity so guest engagement feeds the graph too. Explicit
+    unlikes (context value 0) are skipped; counts only ever grow.
+
+    The window is widened by overlap_minutes because ts is assigned at insert but
+    rows become visible at commit; re-read pairs are already in X and add nothing.
+    """
+    sql = """
+    select coalesce(user_id::text, 'session:' || session_id) as who, item_id, ts
+    from events
+    where item_id is not null
+      and (user_id is not null or session_id is not null)
+      and event_type = any(%(types)s)
+      and coalesce((context->>'value')::int, 1) = 1
+    """
+    params: Dict[str, Any] = {"types": list(POSITIVE_EVENTS)}
+    if since:
+        sql += " and ts > %(since)s::timestamptz - make_interval(mins => %(overlap)s)"
+        params.update({"since": since, "overlap": overlap_minutes})
+    return pd.read_sql(sql, conn, params=params)
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Fold new events into the co-occurrence store and publish a new item-KNN version.")
+    ap.add_argument("--model-id", default=DEFAULT_MODEL_ID)
+    ap.add_argument("--version", default="auto", help="version tag; 'auto' = cooc-<UTC timestamp>")
+    ap.add_argument("--stage", default="dev", choices=["dev", "staging", "prod"])
+    ap.add_argument("--topk", type=int, default=ITEMKNN_TOPK, help="neighbors kept per item")
+    ap.add_argument("--full-rescore", action="store_true",
+                    help="recompute every item's neighbors, not just items whose counts changed")
+    ap.add_argument("--quantize", choices=SIM_MODES, default=None,
+                    help="also write quantized similarity scores (served when SERVE_QUANTIZED=1)")
+    ap.add_argument("--overlap-minutes", type=int, default=10,
+                    help="re-read this much history before the watermark (late commits)")
+    ap.add_argument("--interactions", default="latest",
+                    help="with no parent, seed from this interaction matrix (version, latest, or path/URI; "
+                         "see app.cli.build_interactions); 'none' = events only, not allowed for "
+                         f"{DEFAULT_MODEL_ID}")
+    ap.add_argument("--seed-min-weight", type=float, default=EVENT_WEIGHTS["click"],
+                    help="matrix weight that counts as a positive when seeding")
+    args = ap.parse_args()
+
+    if not DATABASE_URL:
+        raise SystemExit("DATABASE_URL not set")
+    version = args.version if args.version != "auto" else time.strftime("cooc-%Y%m%d%H%M", time.gmtime())
+
+    print(f"Connecting to DB at {DATABASE_URL.split('@')[-1]} ...")
+    with psycopg.connect(DATABASE_URL) as conn:
+        parent = _find_parent(conn, args.model_id)
+        ix = None  # seed matrix, on a first run
+        if parent:
+            store = CoocStore.load(parent["base"])
+            print(f"[cooc] parent={parent['version']} items={len(store.item_ids):,} "
+                  f"watermark={store.watermark_ts}", flush=True)
+        elif args.interactions != "none":
+            # first run: start from the full history, not just the events table
+            ix = load_interactions(conn, args.interactions)
+            store = CoocStore.from_matrix(ix.user_ids, ix.item_ids, ix.X.tocsr(),
+                                          args.seed_min_weight, ix.meta.get("watermark_ts"))
+            print(f"[cooc] no parent; seeded from interactions {ix.meta['version']} "
+                  f"users={len(store.user_ids):,} items={len(store.item_ids):,} "
+                  f"watermark={store.watermark_ts}", flush=True)
+        elif args.model_id == DEFAULT_MODEL_ID:
+            raise SystemExit(f"--interactions none builds from events only; publish it under another "
+                             f"--model-id than {DEFAULT_MODEL_ID}")
+        else:
+            store = CoocStore.empty()
+            print("[cooc] no parent with co-occurrence state; building from all events", flush=True)
+
+        df = _fetch_positives(conn, store.watermark_ts, args.overlap_minutes)
+        print(f"[cooc] new positive events: {len(df):,}", flush=True)
+
+        t0 = time.perf_counter()
+        changed = store.add_interactions(zip(df["who"].astype(str), df["item_id"].astype(str)))
+        if changed.size == 0 and parent and not args.full_rescore:
+            # includes a window that only re-read already-counted pairs
+            print("[cooc] nothing new; not publishing", flush=True)
+            return
+        if args.full_rescore or parent is None:
+            changed = np.arange(len(store.item_ids))
+        store.rescore(changed, args.topk)
+        if not df.empty:
+            # the overlap can re-read rows older than the watermark; never move it back
+            newest = pd.Timestamp(df["ts"].max())
+            if store.watermark_ts is None or newest > pd.Timestamp(store.watermark_ts):
+                store.watermark_ts = newest.isoformat()
+        print(f"[cooc] rescored {len(changed):,}/{len(store.item_ids):,} items "
+              f"in {time.perf_counter() - t0:.2f}s", flush=True)
+
+        payload = store.payload()
+        payload["metrics"].update({
+            "parent_version": parent["version"] if parent else None,
+            "seed_interactions": ix.meta["version"] if ix is not None else None,
+            "rescored_items": int(len(changed)),
+        })
+        # state first: _save_artifacts publishes the version dir as it stands
+        outdir = _artifact_dir(args.model_id, version)
+        os.makedirs(outdir, exist_ok=True)
+        store.save_state(outdir)
+        artifact_uri = _save_artifacts(args.model_id, version, payload, args.quantize)
+        _upsert_registry(conn, args.model_id, version, args.stage, artifact_uri,
+                         payload["metrics"], "sparse_triplet")
+
+        print(json.dumps({
+            "model_id": args.model_id,
+            "version": version,
+            "stage": args.stage,
+            "artifact_uri": artifact_uri,
+            "metrics": payload["metrics"],
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+# services/merlin-api/app/db/identity.py
+"""
+Identity resolution: email -> user_id, session -> user_id, and the items a
+freshly registered user's recommendations are seeded from.
+
+Registration is one statement: an insert that upserts on the unique email
+(migration users_email_unique), returning the user_id either way. Two
+concurrent sign-ups with the same email both get the one row. Until that
+migration has run there is no index to upsert on; registration then falls back
+to select-then-insert, which can race into duplicate rows (the migration
+refuses to build the index until they are merged).
+
+Registering with a session_id merges the anonymous session into the user. The
+session is recorded in public.session_identity (first user wins). Then, in the
+same transaction, the session's events that have no user are re-keyed to the
+user with one bulk UPDATE, and its like-states are copied to the user's
+(user_state.merge_session). The re-keyed rows come back from the UPDATE and
+become the user's seed items, so the user's first /recommend is served from
+their session history without another read.
+
+An /events insert for the session that overlaps the merge would not see the
+uncommitted session_identity row, nor would the merge's UPDATE see the
+uncommitted event. Both take a transaction-scoped advisory lock on the session
+(lock_session): anonymous inserts share it, the merge takes it exclusively. An
+insert in flight is committed before the merge re-keys, and one that starts
+during the merge waits and is then stamped with the user.
+
+Caches are per process, bounded LRUs. Email and session mappings never change
+once written, so they don't expire. Seeds expire after IDENTITY_SEEDS_TTL_S so
+users who registered on another worker are picked up by a re-read. /events
+keeps the seeds of cached users current.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Generic, List, Optional, Tuple, TypeVar
+
+from psycopg import errors
+
+from app.db import user_state
+
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "100000"))
+IDENTITY_SEED_LEN = int(os.getenv("IDENTITY_SEED_LEN", "10"))
+IDENTITY_SEEDS_TTL_S = float(os.getenv("IDENTITY_SEEDS_TTL_S", "300"))
+# weight of each older seed relative to the next newer one (recs._score_seeds)
+IDENTITY_SEED_DECAY = float(os.getenv("IDENTITY_SEED_DECAY", "0.8"))
+
+SESSION_IDENTITY_DDL = """
+create table if not exists public.session_identity (
+    session_id  text        primary key,
+    user_id     text        not null,
+    merged_at   timestamptz not null default now()
+)
+"""
+
+# The no-op update makes RETURNING yield the existing row on conflict;
+# xmax = 0 only for a freshly inserted tuple.
+REGISTER_SQL = """
+    insert into public.users (email, locale, name)
+    values (%s, %s, %s)
+    on conflict (email) do update set email = excluded.email
+    returning user_id, (xmax = 0) as created
+"""
+
+# A session belongs to the first user it is merged into; a repeat merge by the
+# same user returns the row, a different user gets nothing back.
+CLAIM_SESSION_SQL = """
+    insert into public.session_identity (session_id, user_id)
+    values (%s, %s)
+    on conflict (session_id) do update set merged_at = now()
+      where public.session_identity.user_id = excluded.user_id
+    returning user_id
+"""
+
+# (class, hashtext(session_id)) advisory key; the class keeps it apart from other locks
+SESSION_LOCK_CLASS = 0x6D726C73  # "mrls"
+SESSION_LOCK_SQL = "select pg_advisory_xact_lock(%s, hashtext(%s))"
+SESSION_LOCK_SHARED_SQL = "select pg_advisory_xact_lock_shared(%s, hashtext(%s))"
+
+REKEY_EVENTS_SQL = """
+    update public.events set user_id = %s
+    where session_id = %s and user_id is null
+    returning item_id, ts
+"""
+
+# without the unique index (migration users_email_unique not applied yet)
+FIND_USER_SQL = "select user_id from public.users where email = %s order by user_id limit 1"
+INSERT_USER_SQL = "insert into public.users (email, locale, name) values (%s, %s, %s) returning user_id"
+
+SEEDS_SQL = """
+    select item_id
+    from public.events
+    where user_id = %s
+    order by ts desc
+    limit %s
+"""
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class _LRU(Generic[K, V]):
+    """Bounded {key: (stored_at, value)}; ttl_s=None never expires."""
+
+    def __init__(self, maxsize: int, ttl_s: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._d: "OrderedDict[K, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            hit = self._d.get(key)
+            if hit is None:
+                return None
+            if self.ttl_s is not None and time.monotonic() - hit[0] > self.ttl_s:
+                del self._d[key]
+                return None
+            self._d.move_to_end(key)
+            return hit[1]
+
+    def put(self, key: K, value: V) -> None:
+        with self._lock:
+            self._d[key] = (time.monotonic(), value)
+            self._d.move_to_end(key)
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+
+_by_email: _LRU[str, str] = _LRU(IDENTITY_CACHE_SIZE)
+_by_session: _LRU[str, str] = _LRU(IDENTITY_CACHE_SIZE)
+_seeds: _LRU[str, List[str]] = _LRU(IDENTITY_CACHE_SIZE, IDENTITY_SEEDS_TTL_S)
+
+
+def _dedupe(items: List[str], n: int) -> List[str]:
+    """Newest-first, each item once."""
+    seen, out = set(), []
+    for iid in items:
+        if iid not in seen:
+            seen.add(iid)
+            out.append(iid)
+            if len(out) >= n:
+                break
+    return out
+
+
+def ensure_schema(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(SESSION_IDENTITY_DDL)
+
+
+# ---------- Write path ----------
+
+def lock_session(conn, session_id: str, shared: bool) -> None:
+    """Serialize a merge of session_id against its event inserts (see module docstring); held until commit."""
+    with conn.cursor() as cur:
+        cur.execute(SESSION_LOCK_SHARED_SQL if shared else SESSION_LOCK_SQL, (SESSION_LOCK_CLASS, session_id))
+
+
+_warned_no_index = False
+
+
+def _register_unindexed(cur, email: str, locale: Optional[str], name: Optional[str]) -> Tuple[object, bool]:
+    global _warned_no_index
+    if not _warned_no_index:
+        _warned_no_index = True
+        print("[MERLIN] identity: public.users has no unique email index; registering with "
+              "select-then-insert until python -m app.cli.migrate builds it", flush=True)
+    cur.execute(FIND_USER_SQL, (email,))
+    row = cur.fetchone()
+    if row:
+        return row[0], False
+    cur.execute(INSERT_USER_SQL, (email, locale, name))
+    return cur.fetchone()[0], True
+
+
+def register(conn, email: str, locale: Optional[str], name: Optional[str]) -> Tuple[str, bool]:
+    """(user_id, created); an existing email keeps its row as it is."""
+    with conn.cursor() as cur:
+        try:
+            with conn.transaction():  # savepoint: the caller's transaction survives a failed upsert
+                cur.execute(REGISTER_SQL, (email, locale, name))
+                user_id, created = cur.fetchone()
+        except errors.InvalidColumnReference:  # no unique index on email to conflict on
+            user_id, created = _register_unindexed(cur, email, locale, name)
+    user_id = str(user_id)
+    _by_email.put(email, user_id)
+    return user_id, bool(created)
+
+
+def merge_session(conn, session_id: str, user_id: str) -> Dict[str, object]:
+    """
+    Attach an anonymous session to user_id: claim it, re-key its events and
+    like-states, and seed the user from its history. Run inside a transaction
+    and call after_merge() once it has committed.
+    """
+    lock_session(conn, session_id, shared=False)
+    with conn.cursor() as cur:
+        cur.execute(CLAIM_SESSION_SQL, (session_id, user_id))
+        row = cur.fetchone()
+        if row is None:
+            # merged into another user earlier; leave that user's history alone
+            return {"merged": False, "events": 0, "states": 0, "seeds": []}
+        cur.execute(REKEY_EVENTS_SQL, (user_id, session_id))
+        rekeyed = sorted(cur.fetchall(), key=lambda r: r[1], reverse=True)
+    states = user_state.merge_session(conn, session_id, user_id)
+    return {
+        "merged": True,
+        "events": len(rekeyed),
+        "states": states,
+        "seeds": _dedupe([str(iid) for iid, _ in rekeyed], IDENTITY_SEED_LEN),
+    }
+
+
+def after_merge(session_id: str, user_id: str, merged: Dict[str, object]) -> None:
+    """Publish a committed merge to this process's caches."""
+    if not merged["merged"]:
+        return
+    _by_session.put(session_id, user_id)
+    user_state.invalidate(user_id, None)
+    if merged["seeds"]:
+        # the re-keyed events are newer than anything the user had, so they lead
+        prior = _seeds.get(user_id) or []
+        _seeds.put(user_id, _dedupe(list(merged["seeds"]) + prior, IDENTITY_SEED_LEN))
+
+
+def remember_session(session_id: str, user_id: str) -> None:
+    """Cache a session owner learned elsewhere (an /events insert stamped from session_identity)."""
+    _by_session.put(session_id, user_id)
+
+
+def note_event(user_id: str, item_id: str) -> None:
+    """Push a just-recorded event onto the user's seeds, if they are cached."""
+    seeds = _seeds.get(user_id)
+    if seeds is not None and (not seeds or seeds[0] != item_id):
+        _seeds.put(user_id, _dedupe([item_id] + seeds, IDENTITY_SEED_LEN))
+
+
+# ---------- Read path ----------
+
+def user_for_email(email: str) -> Optional[str]:
+    """user_id of an email registered through this process (never reads the DB)."""
+    return _by_email.get(email)
+
+
+def user_for_session(session_id: str) -> Optional[str]:
+    """Owner of a merged session, from this process only (never reads the DB)."""
+    return _by_session.get(session_id)
+
+
+def cached_seeds(user_id: str) -> Optional[List[str]]:
+    return _seeds.get(user_id)
+
+
+def load_seeds(conn, user_id: str) -> List[str]:
+    """Read the user's latest items from events and cache them (empty included, until the TTL)."""
+    with conn.cursor() as cur:
+        cur.execute(SEEDS_SQL, (user_id, IDENTITY_SEED_LEN * 3))
+        seeds = _dedupe([str(r[0]) for r in cur.fetchall()], IDENTITY_SEED_LEN)
+    _seeds.put(user_id, seeds)
+    return seeds
+
@@ -0,0 +1,372 @@
+# services/merlin-api/app/db/migrations.py
+"""
+Versioned schema migrations for the tables the API reads and writes.
+
+Migrations are applied in order, each in its own transaction, and are
+recorded in public.schema_migrations. A transaction-scoped advisory lock
+serializes concurrent runners (several workers starting at once, or a deploy
+racing `python -m app.cli.migrate`).
+
+Migrations that rewrite a table or build an index under a lock that blocks
+writes are marked online=False, as is anything that only makes sense after one
+of them. App startup applies the pending online migrations and leaves the rest
+to `python -m app.cli.migrate`, run by an operator before the deploy. No online
+migration depends on an offline one. Migrations marked transactional=False
+(CREATE INDEX CONCURRENTLY) run outside a transaction, under a session-level
+advisory lock, and need an autocommit connection.
+
+public.events is range-partitioned by month on ts:
+
+  - an existing unpartitioned table is kept as the history partition
+    events_legacy (everything before the first of next month). It is attached,
+    not copied: a CHECK on ts is validated first, so the attach skips its scan
+  - one partition per calendar month (UTC) after that, named events_pYYYYMM.
+    ensure_partitions() keeps EVENTS_PARTITIONS_AHEAD months ready. The app
+    calls it at startup and on every catalog refresh
+  - indexes are declared on the parent, so every partition (past and future)
+    gets them
+
+Queries with a ts lower bound (trending, popular, incremental exports) only
+touch the partitions in their window, however much history has accumulated.
+"""
+from __future__ import annotations
+import os
+from datetime import datetime, timezone
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from psycopg import sql
+
+from app.db import identity, user_state
+
+EVENTS_PARTITIONS_AHEAD = int(os.getenv("EVENTS_PARTITIONS_AHEAD", "3"))
+
+# pg_advisory_xact_lock key shared by every migration runner
+MIGRATION_LOCK_ID = 0x6D65726C696E  # "merlin"
+
+LEGACY_PARTITION = "events_legacy"
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[object], None]
+    online: bool = True  # safe to apply from app startup (see module docstring)
+    transactional: bool = True
+
+
+# ---------- Month arithmetic (UTC) ----------
+
+def month_start(dt: datetime) -> datetime:
+    dt = dt.astimezone(timezone.utc)
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(dt: datetime, n: int) -> datetime:
+    y, m = divmod(dt.month - 1 + n, 12)
+    return dt.replace(year=dt.year + y, month=m + 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"events_p{start:%Y%m}"
+
+
+# ---------- Migrations ----------
+
+def _user_item_state(conn) -> None:
+    user_state.ensure_schema(conn)
+
+
+def _catalog_available(conn) -> None:
+    # missing/NULL means available (see app/serve/filters.py)
+    with conn.cursor() as cur:
+        cur.execute("alter table public.item_catalog add column if not exists available boolean")
+
+
+FRESH_EVENTS_DDL = """
+create table public.events (
+    id          bigint      generated by default as identity,
+    user_id     text,
+    session_id  text,
+    item_id     text        not null references public.item_catalog (item_id),
+    event_type  text        not null,
+    context     jsonb       not null default '{}'::jsonb,
+    ts          timestamptz not null default now(),
+    primary key (id, ts)
+) partition by range (ts)
+"""
+
+
+def _relkind(cur, name: str) -> Optional[str]:
+    cur.execute(
+        "select c.relkind from pg_class c join pg_namespace n on n.oid = c.relnamespace "
+        "where n.nspname = 'public' and c.relname = %s",
+        (name,),
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _partition_events(conn) -> None:
+    """Create events partitioned, or convert the existing table in place (see module docstring)."""
+    with conn.cursor() as cur:
+        kind = _relkind(cur, "events")
+        if kind == "p":
+            return
+        if kind is None:
+            cur.execute(FRESH_EVENTS_DDL)
+            return
+
+        cutoff = add_months(month_start(datetime.now(timezone.utc)), 1)
+        cur.execute(sql.SQL("alter table public.events rename to {}").format(sql.Identifier(LEGACY_PARTITION)))
+        cur.execute(sql.SQL(
+            "create table public.events (like public.{} including defaults including identity "
+            "including generated including storage including comments) partition by range (ts)"
+        ).format(sql.Identifier(LEGACY_PARTITION)))
+
+        # a copied identity starts over at 1; continue after the legacy ids instead.
+        # The partition must not keep its own identity (ATTACH rejects it on
+        # Postgres 17+); rows inserted through the parent use the parent's.
+        cur.execute(
+            "select attname from pg_attribute where attrelid = 'public.events'::regclass "
+            "and attidentity <> '' and not attisdropped"
+        )
+        for (col,) in cur.fetchall():
+            cur.execute(sql.SQL(
+                "select setval(pg_get_serial_sequence('public.events', %s), "
+                "coalesce((select max({c}) from public.{t}), 0) + 1, false)"
+            ).format(c=sql.Identifier(col), t=sql.Identifier(LEGACY_PARTITION)), (col,))
+            cur.execute(sql.SQL("alter table public.{t} alter column {c} drop identity if exists").format(
+                t=sql.Identifier(LEGACY_PARTITION), c=sql.Identifier(col)))
+
+        # foreign keys are not copied by LIKE; declare them on the parent
+        cur.execute(
+            "select conname, pg_get_constraintdef(oid) from pg_constraint "
+            "where conrelid = %s::regclass and contype = 'f'",
+            (f"public.{LEGACY_PARTITION}",),
+        )
+        for conname, condef in cur.fetchall():
+            cur.execute(sql.SQL("alter table public.events add constraint {} {}").format(
+                sql.Identifier(f"events_{conname}"), sql.SQL(condef)))
+
+        # a validated CHECK matching the bound lets ATTACH skip its own scan
+        check = sql.Identifier(f"{LEGACY_PARTITION}_ts_bound")
+        cur.execute(sql.SQL(
+            "alter table public.{t} add constraint {c} check (ts is not null and ts < {cutoff})"
+        ).format(t=sql.Identifier(LEGACY_PARTITION), c=check, cutoff=sql.Literal(cutoff)))
+        cur.execute(sql.SQL(
+            "alter table public.events attach partition public.{t} for values from (minvalue) to ({cutoff})"
+        ).format(t=sql.Identifier(LEGACY_PARTITION), cutoff=sql.Literal(cutoff)))
+        cur.execute(sql.SQL("alter table public.{t} drop constraint {c}").format(
+            t=sql.Identifier(LEGACY_PARTITION), c=check))
+
+
+def _event_partitions(conn) -> None:
+    ensure_partitions(conn)
+
+
+# Each index matches one read path; INCLUDE columns make them index-only.
+EVENTS_INDEX_DDL = """
+-- like history per identity (user_item_state backfill / rebuilds)
+create index if not exists events_user_like_idx
+    on public.events (user_id, event_type, item_id, ts desc) include (context)
+    where user_id is not null;
+create index if not exists events_session_like_idx
+    on public.events (session_id, event_type, item_id, ts desc) include (context)
+    where session_id is not null;
+-- time-windowed aggregates and exports (trending, popular, incremental ALS / co-occurrence)
+create index if not exists events_ts_idx
+    on public.events (ts) include (item_id, event_type, user_id);
+-- per-item history (incremental ALS re-solves)
+create index if not exists events_item_ts_idx
+    on public.events (item_id, ts) include (user_id, event_type);
+"""
+
+
+def _events_indexes(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(EVENTS_INDEX_DDL)
+
+
+def _session_recent_index(conn) -> None:
+    # last items of a session, any event type (session_next, app/serve/session_tail.py)
+    with conn.cursor() as cur:
+        cur.execute("""
+            create index if not exists events_session_recent_idx
+                on public.events (session_id, ts desc) include (item_id)
+                where session_id is not null
+        """)
+
+
+def _session_identity(conn) -> None:
+    identity.ensure_schema(conn)
+
+
+def _users_email_unique(conn) -> None:
+    """
+    Registration upserts on email (app/db/identity.py). public.users itself is
+    created by the auth setup, not here; the migration fails until it exists.
+    Duplicates left by the old select-then-insert race must be merged by hand.
+    The index is built CONCURRENTLY, so sign-ups keep working meanwhile.
+    """
+    with conn.cursor() as cur:
+        if _relkind(cur, "users") is None:
+            raise RuntimeError("public.users does not exist; run the auth setup that creates it, then re-run")
+        cur.execute("select count(*) from (select 1 from public.users group by email having count(*) > 1) d")
+        dupes = cur.fetchone()[0]
+        if dupes:
+            raise RuntimeError(f"public.users has {dupes} emails on more than one row; merge them, then re-run")
+        # a failed concurrent build leaves an invalid index that "if not exists" would keep
+        cur.execute("select i.indisvalid from pg_index i where i.indexrelid = to_regclass('public.users_email_key')")
+        row = cur.fetchone()
+        if row and not row[0]:
+            cur.execute("drop index concurrently public.users_email_key")
+        cur.execute("create unique index concurrently if not exists users_email_key on public.users (email)")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "user_item_state", _user_item_state),
+    Migration(2, "item_catalog_available", _catalog_available),
+    # renames events and takes an exclusive lock on it
+    Migration(3, "events_partition_by_month", _partition_events, online=False),
+    Migration(4, "events_initial_partitions", _event_partitions, online=False),  # needs 3
+    # index builds on a partitioned parent can't be CONCURRENTLY; they block inserts
+    Migration(5, "events_covering_indexes", _events_indexes, online=False),
+    Migration(6, "events_session_recent_index", _session_recent_index, online=False),
+    Migration(7, "session_identity", _session_identity),
+    Migration(8, "users_email_unique", _users_email_unique, online=False, transactional=False),
+]
+
+SCHEMA_MIGRATIONS_DDL = """
+create table if not exists public.schema_migrations (
+    version     integer     primary key,
+    name        text        not null,
+    applied_at  timestamptz not null default now()
+)
+"""
+
+
+# ---------- Runner ----------
+
+def applied_versions(conn) -> List[Tuple[int, str, datetime]]:
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_MIGRATIONS_DDL)
+        cur.execute("select version, name, applied_at from public.schema_migrations order by version")
+        return cur.fetchall()
+
+
+def pending(conn) -> List[Migration]:
+    done = {v for v, _, _ in applied_versions(conn)}
+    return [m for m in MIGRATIONS if m.version not in done]
+
+
+def migrate(conn, online_only: bool = False) -> List[str]:
+    """
+    Apply pending migrations (one transaction each). Returns the names applied.
+    online_only leaves online=False migrations pending (see module docstring).
+    """
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(SCHEMA_MIGRATIONS_DDL)
+    applied: List[str] = []
+    for m in MIGRATIONS:
+        if not m.transactional:
+            if not online_only and _apply_outside_transaction(conn, m):
+                applied.append(m.name)
+            continue
+        with conn.transaction(), conn.cursor() as cur:
+            cur.execute("select pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            # re-check under the lock: another runner may have applied it meanwhile
+            cur.execute("select 1 from public.schema_migrations where version = %s", (m.version,))
+            if cur.fetchone():
+                continue
+            if online_only and not m.online:
+                continue
+            m.apply(conn)
+            cur.execute("insert into public.schema_migrations (version, name) values (%s, %s)", (m.version, m.name))
+        applied.append(m.name)
+    return applied
+
+
+def _apply_outside_transaction(conn, m: Migration) -> bool:
+    """Apply m in autocommit under the session advisory lock. False if it was already applied."""
+    if not conn.autocommit:
+        raise RuntimeError(f"migration {m.name} runs outside a transaction; "
+                           "apply it with python -m app.cli.migrate")
+    with conn.cursor() as cur:
+        cur.execute("select pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            cur.execute("select 1 from public.schema_migrations where version = %s", (m.version,))
+            if cur.fetchone():
+                return False
+            m.apply(conn)
+            cur.execute("insert into public.schema_migrations (version, name) values (%s, %s)", (m.version, m.name))
+            return True
+        finally:
+            cur.execute("select pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+
+
+# ---------- Partition maintenance ----------
+
+PARTITION_BOUNDS_SQL = """
+select (regexp_match(b, 'FROM \\(''([^'']+)''\\)'))[1]::timestamptz,
+       (regexp_match(b, 'TO \\(''([^'']+)''\\)'))[1]::timestamptz
+from (
+    select pg_get_expr(c.relpartbound, c.oid) as b
+    from pg_inherits i join pg_class c on c.oid = i.inhrelid
+    where i.inhparent = 'public.events'::regclass
+) p
+"""
+
+
+def _bounds(cur) -> List[Tuple[Optional[datetime], Optional[datetime]]]:
+    """(lower, upper) of every events partition; None = MINVALUE / MAXVALUE."""
+    cur.execute(PARTITION_BOUNDS_SQL)
+    return cur.fetchall()
+
+
+def _missing(months, bounds) -> List[Tuple[datetime, datetime]]:
+    """Months not overlapped by any existing partition."""
+    return [
+        (lo, hi) for lo, hi in months
+        if not any((b_lo is None or b_lo < hi) and (b_hi is None or b_hi > lo) for b_lo, b_hi in bounds)
+    ]
+
+
+def ensure_partitions(conn, months_ahead: Optional[int] = None, months_back: int = 0) -> List[str]:
+    """
+    Create the monthly partitions from months_back before the current month to
+    months_ahead after it, skipping months an existing partition already
+    covers. Returns the names created; a no-op (one catalog query) when all exist.
+    """
+    ahead = EVENTS_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+    first = add_months(month_start(datetime.now(timezone.utc)), -months_back)
+    months = [(add_months(first, i), add_months(first, i + 1)) for i in range(months_back + ahead + 1)]
+    created: List[str] = []
+    with conn.transaction(), conn.cursor() as cur:
+        if _relkind(cur, "events") != "p" or not _missing(months, _bounds(cur)):
+            return created
+        # re-read under the lock: another worker may have just created them
+        cur.execute("select pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        for lo, hi in _missing(months, _bounds(cur)):
+            name = partition_name(lo)
+            cur.execute(sql.SQL(
+                "create table public.{} partition of public.events for values from ({}) to ({})"
+            ).format(sql.Identifier(name), sql.Literal(lo), sql.Literal(hi)))
+            created.append(name)
+    return created
+
+
+def partitions(conn) -> List[Tuple[str, Optional[datetime], Optional[datetime], int]]:
+    """(name, lower, upper, estimated rows) per events partition, oldest first."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            select c.relname,
+                   (regexp_match(b, 'FROM \\(''([^'']+)''\\)'))[1]::timestamptz as lo,
+                   (regexp_match(b, 'TO \\(''([^'']+)''\\)'))[1]::timestamptz as hi,
+                   greatest(c.reltuples, 0)::bigint
+            from pg_inherits i
+            join pg_class c on c.oid = i.inhrelid,
+                 lateral pg_get_expr(c.relpartbound, c.oid) as b
+            where i.inhparent = 'public.events'::regclass
+            order by lo nulls first
+        """)
+        return cur.fetchall()
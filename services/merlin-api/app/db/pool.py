@@ -0,0 +1,90 @@
+# services/merlin-api/app/db/pool.py
+from __future__ import annotations
+import os
+import threading
+from typing import Optional
+
+from psycopg_pool import ConnectionPool
+
+# DB_POOL_MAX is the connection budget for the whole node. With N preforked workers
+# (app/cli/serve.py sets MERLIN_WORKERS) each worker gets its share, so adding
+# workers never raises the number of connections held against Supabase.
+MERLIN_WORKERS = max(1, int(os.getenv("MERLIN_WORKERS", "1")))
+DB_POOL_BUDGET = int(os.getenv("DB_POOL_MAX", "2"))     # keep this low; Supabase pooler is finite
+DB_POOL_MAX = max(1, DB_POOL_BUDGET // MERLIN_WORKERS)
+DB_POOL_MIN = min(int(os.getenv("DB_POOL_MIN", "1")), DB_POOL_MAX)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+_pool: Optional[ConnectionPool] = None
+_lock = threading.Lock()
+
+
+def dsn_with_ssl_keepalives(raw: str) -> str:
+    """
+    Ensure sslmode=require and TCP keepalives for stability on Render + Supabase.
+    Works with both direct (5432) and pooler (6543) URLs.
+    """
+    dsn = (raw or "").strip()  # <-- trims any stray newline/space
+    sep = "&" if "?" in dsn else "?"
+    if "sslmode=" not in dsn:
+        dsn += f"{sep}sslmode=require"
+        sep = "&"
+    # Reduce idle disconnects when using the pooler or long-lived connections
+    if "keepalives=" not in dsn:
+        dsn += f"{sep}keepalives=1&keepalives_idle=30&keepalives_interval=10&keepalives_count=5"
+    return dsn
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide pool, creating it (closed) on first use."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            database_url = os.environ.get("DATABASE_URL")
+            if not database_url:
+                raise RuntimeError("DATABASE_URL env var not set for merlin-api")
+            _pool = ConnectionPool(
+                dsn_with_ssl_keepalives(database_url),
+                min_size=DB_POOL_MIN,
+                max_size=DB_POOL_MAX,
+                timeout=DB_POOL_TIMEOUT,
+                kwargs={"autocommit": True},
+                open=False,
+            )
+        return _pool
+
+
+def open_pool(wait: bool = True) -> ConnectionPool:
+    """Open the pool (idempotent). Called from the app lifespan, not at import time."""
+    global _pool
+    pool = get_pool()
+    with _lock:
+        if pool.closed:
+            try:
+                pool.open(wait=wait, timeout=DB_POOL_TIMEOUT)
+            except Exception:
+                # a pool that failed to open cannot be reused; next call builds a fresh one
+                _pool = None
+                raise
+    return pool
+
+
+def close_pool() -> None:
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def pg_conn(timeout: Optional[float] = None):
+    """Borrow a pooled connection. Usage:
+        with pg_conn() as conn, conn.cursor() as cur:
+            cur.execute(...)
+    Opens the pool lazily for callers running outside the app lifespan (scripts, tests).
+    timeout overrides DB_POOL_TIMEOUT for the wait (raises psycopg_pool.PoolTimeout).
+    """
+    pool = get_pool()
+    if pool.closed:
+        open_pool()
+    return pool.connection(timeout=timeout)
@@ -0,0 +1,204 @@
+# services/merlin-api/app/db/user_state.py
+"""
+user_item_state: latest like-state per (identity, item), maintained on the
+/events write path instead of being recomputed from public.events with a
+ROW_NUMBER() window on every read.
+
+identity is either a user_id (kind='user') or a session_id (kind='session');
+a like event carrying both updates both rows.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "10000"))
+# Bounds staleness across workers: invalidation on write is per-process only.
+STATE_CACHE_TTL_S = float(os.getenv("STATE_CACHE_TTL_S", "30"))
+
+DDL = """
+create table if not exists public.user_item_state (
+    kind        text        not null check (kind in ('user', 'session')),
+    identity    text        not null,
+    item_id     text        not null,
+    value       smallint    not null,
+    updated_at  timestamptz not null default now(),
+    primary key (kind, identity, item_id)
+);
+create index if not exists user_item_state_recent_idx
+    on public.user_item_state (kind, identity, updated_at desc) include (item_id, value);
+"""
+
+# Out-of-order writes (older ts) never overwrite a newer state.
+UPSERT_SQL = """
+    insert into public.user_item_state (kind, identity, item_id, value, updated_at)
+    values (%s, %s, %s, %s, %s)
+    on conflict (kind, identity, item_id) do update
+      set value = excluded.value, updated_at = excluded.updated_at
+      where public.user_item_state.updated_at <= excluded.updated_at
+"""
+
+SELECT_SQL = """
+    select item_id, value
+    from public.user_item_state
+    where kind = %s and identity = %s
+    order by updated_at desc
+    limit %s
+"""
+
+# A session's states copied onto the user it merges into (app/db/identity.py).
+# The session rows stay; per item the newer state wins, as on the write path.
+MERGE_SQL = """
+    insert into public.user_item_state (kind, identity, item_id, value, updated_at)
+    select 'user', %s, item_id, value, updated_at
+    from public.user_item_state
+    where kind = 'session' and identity = %s
+    on conflict (kind, identity, item_id) do update
+      set value = excluded.value, updated_at = excluded.updated_at
+      where public.user_item_state.updated_at <= excluded.updated_at
+"""
+
+# One-off rebuild from history (same semantics as the old read query)
+BACKFILL_SQL = """
+    insert into public.user_item_state (kind, identity, item_id, value, updated_at)
+    select distinct on (kind, identity, item_id) kind, identity, item_id, value, ts
+    from (
+        select 'user' as kind, user_id as identity, item_id,
+               coalesce((context->>'value')::int, 1) as value, ts
+        from public.events where event_type = 'like' and user_id is not null
+        union all
+        select 'session', session_id, item_id,
+               coalesce((context->>'value')::int, 1), ts
+        from public.events where event_type = 'like' and session_id is not null
+    ) e
+    order by kind, identity, item_id, ts desc
+    on conflict (kind, identity, item_id) do update
+      set value = excluded.value, updated_at = excluded.updated_at
+      where public.user_item_state.updated_at <= excluded.updated_at
+"""
+
+Identity = Tuple[str, str]  # (kind, identity)
+
+
+def identities(user_id: Optional[str], session_id: Optional[str]) -> List[Identity]:
+    out: List[Identity] = []
+    if user_id:
+        out.append(("user", user_id))
+    if session_id:
+        out.append(("session", session_id))
+    return out
+
+
+class _StateCache:
+    """
+    LRU of {identity: (cached_at, limit, rows)} with TTL and explicit invalidation.
+
+    A reader takes token() before its query and passes it to put(). put() drops
+    the rows when the identity was invalidated after that token: the query may
+    have run before the write committed. Invalidations are remembered for the
+    last maxsize identities; older ones fold into one floor, which only makes
+    put() more conservative.
+    """
+
+    def __init__(self, maxsize: int, ttl_s: float):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._d: "OrderedDict[Identity, Tuple[float, int, List[Tuple[str, int]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._seq = 0  # bumped by every invalidate()
+        self._invalidated: "OrderedDict[Identity, int]" = OrderedDict()
+        self._floor = 0  # newest seq evicted from _invalidated
+
+    def get(self, key: Identity, limit: int) -> Optional[List[Tuple[str, int]]]:
+        with self._lock:
+            hit = self._d.get(key)
+            if hit is None:
+                return None
+            cached_at, cached_limit, rows = hit
+            if time.monotonic() - cached_at > self.ttl_s:
+                del self._d[key]
+                return None
+            # a smaller cached page only answers if it already holds everything
+            if cached_limit < limit and len(rows) >= cached_limit:
+                return None
+            self._d.move_to_end(key)
+            return rows[:limit]
+
+    def token(self) -> int:
+        with self._lock:
+            return self._seq
+
+    def put(self, key: Identity, limit: int, rows: List[Tuple[str, int]], token: int) -> None:
+        with self._lock:
+            if self._invalidated.get(key, self._floor) > token:
+                return  # a write landed while these rows were being read
+            self._d[key] = (time.monotonic(), limit, rows)
+            self._d.move_to_end(key)
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+    def invalidate(self, key: Identity) -> None:
+        with self._lock:
+            self._d.pop(key, None)
+            self._seq += 1
+            self._invalidated[key] = self._seq
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.maxsize:
+                _, seq = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, seq)
+
+
+_cache = _StateCache(STATE_CACHE_SIZE, STATE_CACHE_TTL_S)
+
+
+def ensure_schema(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(DDL)
+
+
+def apply_like(conn, user_id: Optional[str], session_id: Optional[str], item_id: str, value: int, ts) -> None:
+    """Upsert the projection for every identity on the event. Call invalidate() after commit."""
+    with conn.cursor() as cur:
+        for kind, who in identities(user_id, session_id):
+            cur.execute(UPSERT_SQL, (kind, who, item_id, value, ts))
+
+
+def invalidate(user_id: Optional[str], session_id: Optional[str]) -> None:
+    """Drop cached states for the event's identities. Call after commit: a read that
+    started before it then can't cache its (possibly pre-write) rows; see _StateCache."""
+    for key in identities(user_id, session_id):
+        _cache.invalidate(key)
+
+
+def merge_session(conn, session_id: str, user_id: str) -> int:
+    """Copy a session's states onto user_id. Returns rows written; invalidate the user after commit."""
+    with conn.cursor() as cur:
+        cur.execute(MERGE_SQL, (user_id, session_id))
+        return cur.rowcount
+
+
+def get_states(conn_factory, kind: str, who: str, limit: int) -> List[Tuple[str, int]]:
+    """
+    Latest (item_id, value) per item for one identity, newest first.
+    Read-through: only borrows a connection (via conn_factory) on a cache miss.
+    """
+    key = (kind, who)
+    rows = _cache.get(key, limit)
+    if rows is not None:
+        return rows
+    token = _cache.token()
+    with conn_factory() as conn, conn.cursor() as cur:
+        cur.execute(SELECT_SQL, (kind, who, limit))
+        rows = [(str(item_id), int(value)) for item_id, value in cur.fetchall()]
+    _cache.put(key, limit, rows, token)
+    return rows
+
+
+def backfill(conn) -> int:
+    """Rebuild the projection from public.events. Returns rows written."""
+    ensure_schema(conn)
+    with conn.cursor() as cur:
+        cur.execute(BACKFILL_SQL)
+        return cur.rowcount
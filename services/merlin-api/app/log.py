@@ -0,0 +1,186 @@
+# services/merlin-api/app/log.py
+"""
+Structured request-path logging.
+
+Records are enqueued by a QueueHandler, which costs the caller a put() on an
+in-memory queue. A QueueListener thread formats them as one JSON object per
+line and writes them to stdout, so handlers never block on stdout I/O.
+
+  - request ids: set per request by the middleware in app/main.py (honours an
+    incoming X-Request-ID) and stamped on every record logged while handling it
+  - sampling: each request is sampled once against LOG_SAMPLE_RATES (per route
+    path prefix, e.g. "/api/v1/events=0.01,/api/v1/recommend=0.1") or
+    LOG_SAMPLE_DEFAULT. INFO/DEBUG records of unsampled requests are dropped;
+    WARNING and above always pass
+  - debug toggle: LOG_DEBUG=1 (or set_debug(True) at runtime) lowers the level
+    to DEBUG and samples every request
+
+Lifecycle messages (startup, refreshes) still use the [MERLIN] prints.
+"""
+from __future__ import annotations
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+MAX_REQUEST_ID_LEN = 64
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_DEBUG = os.getenv("LOG_DEBUG", "0") == "1"
+LOG_SAMPLE_DEFAULT = float(os.getenv("LOG_SAMPLE_DEFAULT", "1.0"))
+
+
+def _parse_rates(raw: str) -> List[Tuple[str, float]]:
+    rates = []
+    for part in raw.split(","):
+        if "=" in part:
+            prefix, rate = part.split("=", 1)
+            rates.append((prefix.strip(), float(rate)))
+    # longest prefix first so "/api/v1/recommend:batch" beats "/api/v1/recommend"
+    return sorted(rates, key=lambda r: -len(r[0]))
+
+
+# probes are polled constantly; keep them out of the access log unless asked for
+LOG_SAMPLE_RATES = _parse_rates(os.getenv("LOG_SAMPLE_RATES", "/healthz=0,/readyz=0"))
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+sampled_var: contextvars.ContextVar[bool] = contextvars.ContextVar("log_sampled", default=True)
+
+_debug = LOG_DEBUG
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Loggers under the "merlin" hierarchy go through the queue."""
+    return logging.getLogger(f"merlin.{name}")
+
+
+def sample_rate(path: str) -> float:
+    if _debug:
+        return 1.0
+    for prefix, rate in LOG_SAMPLE_RATES:
+        if path.startswith(prefix):
+            return rate
+    return LOG_SAMPLE_DEFAULT
+
+
+def begin_request(path: str, request_id: Optional[str]) -> str:
+    """Bind a request id and this request's sampling decision to the current context."""
+    rid = (request_id or "")[:MAX_REQUEST_ID_LEN] or os.urandom(8).hex()
+    request_id_var.set(rid)
+    rate = sample_rate(path)
+    sampled_var.set(rate >= 1.0 or random.random() < rate)
+    return rid
+
+
+def set_debug(on: bool) -> None:
+    global _debug
+    _debug = on
+    logging.getLogger("merlin").setLevel(logging.DEBUG if on else LOG_LEVEL)
+
+
+def debug_enabled() -> bool:
+    return _debug
+
+
+class _ContextFilter(logging.Filter):
+    """Runs in the caller's thread (before enqueue): applies sampling and copies the request id."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING and not sampled_var.get():
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, Any] = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        rid = getattr(record, "request_id", None)
+        if rid:
+            out["request_id"] = rid
+        fields = getattr(record, "fields", None)
+        if fields:
+            out.update(fields)
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, default=str)
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware: binds request id + sampling for the request, echoes the id
+    in X-Request-ID and writes one (sampled) access record per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.log = get_logger("access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        incoming = None
+        for name, value in scope.get("headers") or ():
+            if name == b"x-request-id":
+                incoming = value.decode("latin-1")
+                break
+        rid = begin_request(scope["path"], incoming)
+        t0 = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers") or ()) + [(b"x-request-id", rid.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            self.log.info("request", extra={"fields": {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "duration_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+            }})
+
+
+def configure_logging() -> None:
+    """Install the queue handler + background writer (idempotent; call once per process)."""
+    global _listener
+    if _listener is not None:
+        return
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    qh = logging.handlers.QueueHandler(q)
+    qh.addFilter(_ContextFilter())
+    out = logging.StreamHandler(sys.stdout)
+    out.setFormatter(JsonFormatter())
+
+    root = logging.getLogger("merlin")
+    root.handlers[:] = [qh]
+    root.propagate = False
+    root.setLevel(logging.DEBUG if _debug else LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(q, out, respect_handler_level=False)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,10 +1,120 @@
 # services/merlin-api/app/main.py
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.v1 import recs
+from fastapi.responses import JSONResponse
+from app.api.v1 import recs, catalog, admin
+from app.db.pool import open_pool, close_pool, pg_conn
+from app.db import migrations
+from app.serve.catalog_index import refresh_catalog_index
+from app.serve.content_index import sync_new_items
+from app.serve.executor import get_scoring_executor
+from app.serve.trending import refresh_trending
+from app.serve import admission
+from app.log import RequestContextMiddleware, configure_logging, shutdown_logging
+from app.serve.profiling import ProfilingMiddleware
 
-app = FastAPI(title="Merlin API", version="0.1.0")
+STARTUP_RETRY_S = float(os.getenv("STARTUP_RETRY_S", "5"))
+CATALOG_REFRESH_S = float(os.getenv("CATALOG_REFRESH_S", "600"))
+# Apply pending online schema migrations at startup; the rest (table rewrites, blocking
+# index builds) always need `python -m app.cli.migrate`
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "1") == "1"
+
+
+async def _refresh_catalog_forever():
+    """Rebuild the catalog search index every CATALOG_REFRESH_S seconds."""
+    while True:
+        await asyncio.sleep(CATALOG_REFRESH_S)
+        try:
+            idx = await asyncio.to_thread(refresh_catalog_index)
+            print(f"[MERLIN] catalog index refreshed: {len(idx)} items", flush=True)
+        except Exception as e:
+            print(f"[MERLIN] catalog index refresh failed: {e}", flush=True)
+        try:
+            added = await asyncio.to_thread(sync_new_items, recs.MODEL_STAGE)
+            if added:
+                print(f"[MERLIN] content index: added {added} new catalog items", flush=True)
+        except Exception as e:
+            print(f"[MERLIN] content index sync failed: {e}", flush=True)
+        await _refresh_trending()
+        try:
+            created = await asyncio.to_thread(_ensure_partitions)
+            if created:
+                print(f"[MERLIN] events partitions created: {', '.join(created)}", flush=True)
+        except Exception as e:
+            print(f"[MERLIN] events partition check failed: {e}", flush=True)
+
+
+async def _refresh_trending():
+    """Recompute the fallback list /recommend serves when it sheds load."""
+    try:
+        trending = await asyncio.to_thread(refresh_trending)
+        print(f"[MERLIN] trending refreshed: {len(trending)} items ({trending.version})", flush=True)
+    except Exception as e:
+        print(f"[MERLIN] trending refresh failed: {e}", flush=True)
+
+
+def _ensure_schema():
+    with pg_conn() as conn:
+        if DB_MIGRATE_ON_STARTUP:
+            for name in migrations.migrate(conn, online_only=True):
+                print(f"[MERLIN] startup: applied migration {name}", flush=True)
+        left = [f"{m.version} {m.name}" for m in migrations.pending(conn)]
+        if left:
+            print(f"[MERLIN] startup: migrations pending ({', '.join(left)}); "
+                  "run python -m app.cli.migrate", flush=True)
+        for name in migrations.ensure_partitions(conn):
+            print(f"[MERLIN] startup: events partition created {name}", flush=True)
+
+
+def _ensure_partitions():
+    """Keep EVENTS_PARTITIONS_AHEAD months of events partitions ahead of now()."""
+    with pg_conn() as conn:
+        return migrations.ensure_partitions(conn)
+
+
+async def _startup(app: FastAPI):
+    """Open the DB pool, then preload + warm models. /readyz flips when this finishes."""
+    while True:
+        try:
+            await asyncio.to_thread(open_pool)
+            break
+        except Exception as e:
+            print(f"[MERLIN] startup: pool open failed ({e}); retrying in {STARTUP_RETRY_S}s", flush=True)
+            await asyncio.sleep(STARTUP_RETRY_S)
+    try:
+        await asyncio.to_thread(_ensure_schema)
+    except Exception as e:
+        print(f"[MERLIN] startup: schema check failed: {e}", flush=True)
+    try:
+        idx = await asyncio.to_thread(refresh_catalog_index)
+        print(f"[MERLIN] catalog index loaded: {len(idx)} items", flush=True)
+    except Exception as e:
+        print(f"[MERLIN] catalog index load failed: {e}", flush=True)
+    await _refresh_trending()
+    app.state.warmup = await asyncio.to_thread(recs.warm_models)
+    app.state.ready = True
+    print("[MERLIN] startup complete; ready", flush=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging()  # per worker: the writer thread must not be started before a fork
+    app.state.ready = False
+    app.state.warmup = {}
+    # Run in the background so /healthz answers (and the platform doesn't kill us)
+    # while models load; traffic is gated on /readyz instead.
+    tasks = [asyncio.create_task(_startup(app)), asyncio.create_task(_refresh_catalog_forever())]
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.to_thread(close_pool)
+    shutdown_logging()
+
+
+app = FastAPI(title="Merlin API", version="0.1.0", lifespan=lifespan)
 
 # Get frontend origin(s) from environment
 frontend_origin = os.getenv("FRONTEND_ORIGIN", "http://localhost:3000")
@@ -15,6 +125,8 @@ origins = [frontend_origin]
 if "," in frontend_origin:
     origins = [o.strip() for o in frontend_origin.split(",")]
 
+# Innermost: only wraps requests inside an armed profile window (see /api/v1/admin/profile)
+app.add_middleware(ProfilingMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -22,10 +134,23 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Added last = outermost: request id + sampling cover everything, including CORS preflights
+app.add_middleware(RequestContextMiddleware)
 
 @app.get("/healthz")
 def healthz():
+    """Liveness: the process is up. Does not imply models are loaded."""
     return {"ok": True}
 
+@app.get("/readyz")
+def readyz():
+    """Readiness: pool open and models warmed. 503 until startup finishes."""
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {"ready": True, "warmup": app.state.warmup, "scoring": get_scoring_executor().stats(),
+            "admission": admission.stats()}
+
 # API routes
-app.include_router(recs.router, prefix="/api/v1", tags=["recommendations"])
\ No newline at end of file
+app.include_router(recs.router, prefix="/api/v1", tags=["recommendations"])
+app.include_router(catalog.router, prefix="/api/v1", tags=["catalog"])
+app.include_router(admin.router, prefix="/api/v1", tags=["admin"], include_in_schema=False)
\ No newline at end of file
@@ -0,0 +1,94 @@
+# services/merlin-api/app/serve/admission.py
+"""
+Admission control: per-endpoint in-flight limits and per-request deadlines.
+
+A request that cannot get a slot is shed immediately instead of queueing behind
+the (small) DB pool or the scoring executor. Callers then degrade:
+/recommend serves the in-memory trending list, and write endpoints answer 503.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+# Default end-to-end latency budget for /recommend
+RECOMMEND_BUDGET_MS = float(os.getenv("RECOMMEND_BUDGET_MS", "800"))
+
+# Max concurrent requests per endpoint (per worker)
+ENDPOINT_LIMITS = {
+    "recommend": int(os.getenv("RECOMMEND_MAX_INFLIGHT", "64")),
+    "recommend_batch": int(os.getenv("BATCH_MAX_INFLIGHT", "4")),
+    "events": int(os.getenv("EVENTS_MAX_INFLIGHT", "128")),
+}
+
+
+class Deadline:
+    """Monotonic deadline for one request."""
+
+    def __init__(self, budget_ms: float):
+        self.budget_ms = budget_ms
+        self._start = time.monotonic()
+        self._expires = self._start + budget_ms / 1000.0
+
+    def remaining_s(self) -> float:
+        return max(0.0, self._expires - time.monotonic())
+
+    def remaining_ms(self) -> float:
+        return self.remaining_s() * 1000.0
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self._expires
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self._start) * 1000.0
+
+
+class ConcurrencyLimiter:
+    """Non-blocking counting limiter; over the limit means shed, never wait."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= self.limit:
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    @contextmanager
+    def admit(self) -> Iterator[bool]:
+        """Yields True with a slot held, or False (nothing held) when at the limit."""
+        ok = self.try_acquire()
+        try:
+            yield ok
+        finally:
+            if ok:
+                self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "in_flight": self.in_flight, "admitted": self.admitted, "shed": self.shed}
+
+
+_limiters: Dict[str, ConcurrencyLimiter] = {name: ConcurrencyLimiter(name, n) for name, n in ENDPOINT_LIMITS.items()}
+
+
+def limiter(name: str) -> ConcurrencyLimiter:
+    return _limiters[name]
+
+
+def stats() -> Dict[str, Any]:
+    return {name: lim.stats() for name, lim in _limiters.items()}
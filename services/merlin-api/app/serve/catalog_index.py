@@ -0,0 +1,174 @@
+# services/merlin-api/app/serve/catalog_index.py
+from __future__ import annotations
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+
+from app.db.pool import pg_conn
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _normalize(text: str) -> str:
+    """Lowercase and strip accents so 'Amélie' matches 'amelie'."""
+    text = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(_normalize(text))
+
+
+def _trigrams(text: str) -> Set[str]:
+    s = "  " + " ".join(_tokens(text)) + " "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class CatalogIndex:
+    """
+    Immutable in-memory index over item_catalog rows.
+      - by_id: item_id -> row dict (bulk hydration)
+      - sorted token list + postings: prefix lookup for type-ahead ("inc" -> Inception)
+      - trigram postings: typo-tolerant fallback ("intersteller" -> Interstellar)
+    Rebuilt wholesale on refresh and swapped in atomically, so readers never lock.
+    """
+
+    def __init__(self, rows: Iterable[Dict[str, Any]]):
+        self.docs: List[Dict[str, Any]] = []
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self._title_norm: List[str] = []
+        postings: Dict[str, Set[int]] = {}
+        trigrams: Dict[str, List[int]] = {}
+
+        for row in rows:
+            doc_id = len(self.docs)
+            self.docs.append(row)
+            self.by_id[row["item_id"]] = row
+            title = row.get("title") or ""
+            self._title_norm.append(" ".join(_tokens(title)))
+            if not title:
+                continue
+            for tok in _tokens(title):
+                postings.setdefault(tok, set()).add(doc_id)
+            for tg in _trigrams(title):
+                trigrams.setdefault(tg, []).append(doc_id)
+
+        self._vocab: List[str] = sorted(postings)
+        self._postings: Dict[str, Set[int]] = postings
+        self._trigrams: Dict[str, List[int]] = trigrams
+        self.built_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _prefix_docs(self, prefix: str) -> Set[int]:
+        lo = bisect.bisect_left(self._vocab, prefix)
+        hi = bisect.bisect_left(self._vocab, prefix + "\uffff")
+        out: Set[int] = set()
+        for tok in self._vocab[lo:hi]:
+            out |= self._postings[tok]
+        return out
+
+    def _rank(self, doc_id: int, q_norm: str, q_tokens: List[str]) -> float:
+        title = self._title_norm[doc_id]
+        score = 0.0
+        if title == q_norm:
+            score += 4.0
+        elif title.startswith(q_norm):
+            score += 2.0
+        title_tokens = set(title.split())
+        score += sum(1.0 for t in q_tokens if t in title_tokens)  # whole-word hits beat prefixes
+        return score - 0.01 * len(title)                           # shorter titles first on ties
+
+    def search(self, q: str, k: int = 20) -> List[Dict[str, Any]]:
+        q_tokens = _tokens(q)
+        if not q_tokens:
+            return []
+        q_norm = " ".join(q_tokens)
+
+        # 1) every query token must prefix-match some title token
+        hits: Optional[Set[int]] = None
+        for tok in q_tokens:
+            docs = self._prefix_docs(tok)
+            hits = docs if hits is None else hits & docs
+            if not hits:
+                break
+        ranked = sorted(hits or (), key=lambda d: self._rank(d, q_norm, q_tokens), reverse=True)[:k]
+
+        # 2) top up with trigram matches for typos / partial words
+        if len(ranked) < k:
+            q_grams = _trigrams(q)
+            counts: Counter = Counter()
+            for tg in q_grams:
+                counts.update(self._trigrams.get(tg, ()))
+            seen = set(ranked)
+            min_overlap = max(2, len(q_grams) // 2)
+            fuzzy = [
+                (c / len(q_grams), d) for d, c in counts.items()
+                if c >= min_overlap and d not in seen
+            ]
+            fuzzy.sort(key=lambda x: (-x[0], len(self._title_norm[x[1]])))
+            ranked += [d for _, d in fuzzy[: k - len(ranked)]]
+
+        return [self.docs[d] for d in ranked]
+
+    def bulk(self, item_ids: Sequence[str]) -> List[Dict[str, Any]]:
+        """Rows for the given ids, in request order; unknown ids are skipped."""
+        return [self.by_id[i] for i in item_ids if i in self.by_id]
+
+
+# ---------- process-wide instance ----------
+
+_index: CatalogIndex = CatalogIndex([])
+_refresh_lock = threading.Lock()
+
+
+# item_catalog.available comes from migration item_catalog_available; until that has
+# run (e.g. DB_MIGRATE_ON_STARTUP=0) every item counts as available
+HAS_AVAILABLE_SQL = """
+select exists (
+    select 1 from information_schema.columns
+    where table_schema = 'public' and table_name = 'item_catalog' and column_name = 'available'
+)
+"""
+
+
+def _fetch_rows(conn) -> List[Dict[str, Any]]:
+    with conn.cursor() as cur:
+        cur.execute(HAS_AVAILABLE_SQL)
+        available = "coalesce(available, true)" if cur.fetchone()[0] else "true"
+        cur.execute(f"""
+        select item_id, title, year, coalesce(genres, '{{}}') as genres, poster_url,
+               {available} as available
+        from public.item_catalog
+        """)
+        return [
+            {
+                "item_id": str(item_id),
+                "title": title,
+                "year": int(year) if year is not None else None,
+                "genres": list(genres or []),
+                "poster_url": poster_url,
+                "available": bool(available),
+            }
+            for item_id, title, year, genres, poster_url, available in cur.fetchall()
+        ]
+
+
+def get_catalog_index() -> CatalogIndex:
+    return _index
+
+
+def refresh_catalog_index() -> CatalogIndex:
+    """Rebuild from item_catalog and swap in. Concurrent refreshes are serialized."""
+    global _index
+    with _refresh_lock:
+        with pg_conn() as conn:
+            rows = _fetch_rows(conn)
+        # build outside the `with` so the pooled connection goes back immediately
+        _index = CatalogIndex(rows)
+    return _index
@@ -4,21 +4,17 @@ import os
 from typing import Dict, Tuple, List
 import numpy as np
 
+from app.artifact_store import local_path
+
 # Simple in-process cache: {(model_id, version): (item_ids, sim_matrix)}
 _CACHE: Dict[Tuple[str, str], Tuple[List[str], np.ndarray]] = {}
 
-def _path_from_uri(artifact_uri: str) -> str:
-    # Supports file:// URIs
-    if artifact_uri.startswith("file://"):
-        return artifact_uri[len("file://"):]
-    raise ValueError(f"Unsupported artifact URI: {artifact_uri}")
-
 def load_cf_itemknn(model_id: str, version: str, artifact_uri: str) -> Tuple[List[str], np.ndarray]:
     key = (model_id, version)
     if key in _CACHE:
         return _CACHE[key]
 
-    base = _path_from_uri(artifact_uri)
+    base = local_path(artifact_uri)
     ids_npz = os.path.join(base, "item_ids.npz")
     sim_npz = os.path.join(base, "similarity.npz")
 
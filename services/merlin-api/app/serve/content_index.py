@@ -0,0 +1,117 @@
+# services/merlin-api/app/serve/content_index.py
+"""
+Serving-side content index: the FAISS index + embedding pipeline published by
+train_and_register --source catalog_content. Catalog rows added after training
+are embedded and appended by sync_new_items(), so cold-start items get
+similar-item results without waiting for a retrain.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.artifact_store import local_path
+from app.db.pool import pg_conn
+from app.serve.executor import mark_cold
+from app.serve.itemknn_loader import _latest_row
+from app.serve.mf_loader import _faiss, _search
+from app.trainers.content_embed import embed
+
+CONTENT_MODEL_ID = os.getenv("CONTENT_MODEL_ID", "cf_content")
+CONTENT_RETRY_S = 300.0  # don't hit the registry on every request while no content model exists
+
+
+class ContentIndex:
+    def __init__(self, model_id: str = CONTENT_MODEL_ID, stage: str = "dev"):
+        import joblib  # ships with scikit-learn
+
+        row = _latest_row(model_id, stage)
+        base = local_path(row["artifact_uri"]).rstrip("/")
+        self.model_id = model_id
+        self.version = row["version"]
+        ids = np.load(os.path.join(base, "item_ids.npz"), allow_pickle=True)["item_ids"].tolist()
+        self.item_ids: List[str] = [str(x) for x in ids]
+        self.index_of: Dict[str, int] = {iid: i for i, iid in enumerate(self.item_ids)}
+        self.index = _faiss().read_index(os.path.join(base, "content.index"))
+        self.pipe = joblib.load(os.path.join(base, "content_pipeline.joblib"))
+        # IndexFlat add() may reallocate its storage, so adds and searches are serialized
+        self._lock = threading.Lock()
+
+    def add_items(self, rows: List[Dict[str, Any]]) -> int:
+        """Embed and append catalog rows not yet indexed. FAISS row == position in item_ids."""
+        new = [r for r in rows if str(r["item_id"]) not in self.index_of]
+        if not new:
+            return 0
+        E = embed(self.pipe, new)
+        with self._lock:
+            self.index.add(E)
+            for r in new:
+                self.index_of[str(r["item_id"])] = len(self.item_ids)
+                self.item_ids.append(str(r["item_id"]))
+        return len(new)
+
+    def similar_items(
+        self, seed_item_id: str, k: int = 10, mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[str, float]]:
+        i = self.index_of.get(str(seed_item_id))
+        if i is None or k <= 0:
+            return []
+        with self._lock:
+            q = self.index.reconstruct(i)[None, :]
+            if mask is not None and mask.size != self.index.ntotal:
+                mask = None  # built before the last add; serve unfiltered rather than misaligned
+            D, I = _search(self.index, q, k + 1, mask)  # +1: the seed itself comes back first
+        out = []
+        for score, j in zip(D[0].tolist(), I[0].tolist()):
+            if j < 0 or j == i:
+                continue
+            out.append((self.item_ids[j], float(score)))
+        return out[:k]
+
+
+_content: Optional[ContentIndex] = None
+_failed_at = -CONTENT_RETRY_S
+_lock = threading.Lock()
+
+
+def get_content_index(stage: str = "dev") -> Optional[ContentIndex]:
+    """Lazily load the registered content model; None while none is registered."""
+    global _content, _failed_at
+    if _content is None:
+        if time.monotonic() - _failed_at < CONTENT_RETRY_S:
+            return None
+        with _lock:
+            if _content is None:
+                mark_cold()
+                try:
+                    _content = ContentIndex(CONTENT_MODEL_ID, stage)
+                except (RuntimeError, FileNotFoundError, ValueError) as e:
+                    _failed_at = time.monotonic()
+                    print(f"[MERLIN] content index unavailable: {e}", flush=True)
+                    return None
+    return _content
+
+
+def sync_new_items(stage: str = "dev") -> int:
+    """Catalog-sync job: index catalog rows with a title that the content index hasn't seen."""
+    ci = get_content_index(stage)
+    if ci is None:
+        return 0
+    with pg_conn() as conn, conn.cursor() as cur:
+        cur.execute("select item_id from public.item_catalog where title is not null")
+        missing = [r[0] for r in cur.fetchall() if str(r[0]) not in ci.index_of]
+        if not missing:
+            return 0
+        cur.execute(
+            "select item_id, title, coalesce(overview, '') as overview, coalesce(genres, '{}') as genres "
+            "from public.item_catalog where item_id = any(%s)",
+            (missing,),
+        )
+        rows = [
+            {"item_id": r[0], "title": r[1], "overview": r[2], "genres": list(r[3] or [])}
+            for r in cur.fetchall()
+        ]
+    return ci.add_items(rows)
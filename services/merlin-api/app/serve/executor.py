@@ -0,0 +1,197 @@
+# services/merlin-api/app/serve/executor.py
+"""
+Bounded executor for CPU-bound scoring (numpy / FAISS / CSR slicing).
+
+Scoring used to run inline in the async handlers, blocking the event loop for
+every other request (e.g. /events) while it ran. It now runs on a small
+dedicated thread pool sized to this worker's share of the cores. numpy and
+FAISS release the GIL, so the threads really run in parallel. The OpenMP and
+BLAS runtimes are pinned to SCORING_OMP_THREADS per call, so N concurrent
+queries use about N cores instead of N x cores.
+
+Submissions beyond SCORING_QUEUE_MAX outstanding tasks are rejected with
+ScoringBusy rather than queued indefinitely.
+
+estimate_ms() predicts a task's run time from an exponentially weighted
+average (SCORING_EWMA_ALPHA) of recent runs. Tasks that loaded a model
+(mark_cold()) or whose caller stopped waiting are left out of it. Once a label
+has had no completed run for SCORING_PROBE_S, one call reports no estimate, so
+a request gets through and refreshes it. One slow outlier can't shut a path off.
+"""
+from __future__ import annotations
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from app.log import get_logger
+
+log = get_logger("scoring")
+
+
+def _cores() -> int:
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:  # not available on macOS
+        return max(1, os.cpu_count() or 1)
+
+
+_WORKERS = max(1, int(os.getenv("MERLIN_WORKERS", "1")))
+SCORING_THREADS = int(os.getenv("SCORING_THREADS", "0")) or max(1, _cores() // _WORKERS)
+SCORING_QUEUE_MAX = int(os.getenv("SCORING_QUEUE_MAX", "0")) or SCORING_THREADS * 8
+SCORING_OMP_THREADS = int(os.getenv("SCORING_OMP_THREADS", "1"))
+SCORING_SLOW_MS = float(os.getenv("SCORING_SLOW_MS", "250"))
+SCORING_EWMA_ALPHA = float(os.getenv("SCORING_EWMA_ALPHA", "0.2"))  # weight of the newest run
+SCORING_PROBE_S = float(os.getenv("SCORING_PROBE_S", "5"))
+
+# Read by libgomp / OpenBLAS when they initialize. faiss is imported lazily, so this
+# still applies to it; numpy's BLAS is usually up already and is capped below.
+for _var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(_var, str(SCORING_OMP_THREADS))
+
+
+class ScoringBusy(RuntimeError):
+    """Raised when the scoring queue is full; callers should shed or fall back."""
+
+
+_task = threading.local()
+
+
+def mark_cold() -> None:
+    """Called by model loaders on a cache miss: keep the running task out of the estimate."""
+    _task.cold = True
+
+
+class ScoringExecutor:
+    def __init__(self, threads: int, queue_max: int):
+        self.threads = threads
+        self.queue_max = queue_max
+        self._pool: Optional[ThreadPoolExecutor] = None  # created on first submit (after any fork)
+        self._lock = threading.Lock()
+        self._tls = threading.local()
+        self._pending = 0
+        self._rejected = 0
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    _limit_blas(SCORING_OMP_THREADS)
+                    self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="merlin-score")
+        return self._pool
+
+    def _call(self, label: str, submitted: float, abandoned: threading.Event, fn: Callable, args, kwargs):
+        # omp_set_num_threads is per calling thread, so set it once in each pool
+        # thread, as soon as faiss has been loaded by some model.
+        if not getattr(self._tls, "omp", False) and "faiss" in sys.modules:
+            sys.modules["faiss"].omp_set_num_threads(SCORING_OMP_THREADS)
+            self._tls.omp = True
+        _task.cold = False
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._record(label, (t0 - submitted) * 1000.0, (time.perf_counter() - t0) * 1000.0,
+                         sample=not _task.cold and not abandoned.is_set())
+
+    def _record(self, label: str, wait_ms: float, run_ms: float, sample: bool = True) -> None:
+        with self._lock:
+            s = self._stats.setdefault(label, {"count": 0, "run_ms_total": 0.0, "run_ms_max": 0.0,
+                                               "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+                                               "run_ms_ewma": None, "sampled_at": 0.0, "probe_at": 0.0})
+            s["count"] += 1
+            s["run_ms_total"] += run_ms
+            s["run_ms_max"] = max(s["run_ms_max"], run_ms)
+            s["wait_ms_total"] += wait_ms
+            s["wait_ms_max"] = max(s["wait_ms_max"], wait_ms)
+            if sample:
+                ewma = s["run_ms_ewma"]
+                s["run_ms_ewma"] = run_ms if ewma is None else ewma + SCORING_EWMA_ALPHA * (run_ms - ewma)
+                s["sampled_at"] = time.monotonic()
+        if run_ms + wait_ms >= SCORING_SLOW_MS:
+            log.warning("slow scoring task", extra={"fields": {
+                "task": label, "wait_ms": round(wait_ms, 1), "run_ms": round(run_ms, 1)}})
+
+    async def run(self, label: str, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) on the scoring pool and await its result."""
+        with self._lock:
+            if self._pending >= self.queue_max:
+                self._rejected += 1
+                raise ScoringBusy(f"scoring queue full ({self._pending}/{self.queue_max})")
+            self._pending += 1
+        # carry the request context (request id, log sampling) into the pool thread
+        ctx = contextvars.copy_context()
+        abandoned = threading.Event()
+        fut = self._get_pool().submit(ctx.run, self._call, label, time.perf_counter(), abandoned, fn, args, kwargs)
+        # released when the task actually finishes, not when the caller stops
+        # waiting (a timed-out caller leaves its task running on the pool)
+        fut.add_done_callback(self._release)
+        try:
+            return await asyncio.wrap_future(fut)
+        except asyncio.CancelledError:
+            abandoned.set()
+            raise
+
+    def _release(self, _fut) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def estimate_ms(self, label: str) -> float:
+        """
+        Rough completion time for a new `label` task: queue ahead of it plus its
+        recent run time. 0 when there is no sample yet, and for one probe call
+        once the sample is older than SCORING_PROBE_S.
+        """
+        with self._lock:
+            s = self._stats.get(label)
+            if not s or s["run_ms_ewma"] is None:
+                return 0.0
+            now = time.monotonic()
+            if now - s["sampled_at"] >= SCORING_PROBE_S and now - s["probe_at"] >= SCORING_PROBE_S:
+                s["probe_at"] = now
+                return 0.0
+            return s["run_ms_ewma"] * (1 + self._pending // self.threads)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tasks = {
+                label: {
+                    "count": int(s["count"]),
+                    "run_ms_avg": round(s["run_ms_total"] / s["count"], 2),
+                    "run_ms_max": round(s["run_ms_max"], 2),
+                    "run_ms_ewma": round(s["run_ms_ewma"], 2) if s["run_ms_ewma"] is not None else None,
+                    "wait_ms_avg": round(s["wait_ms_total"] / s["count"], 2),
+                    "wait_ms_max": round(s["wait_ms_max"], 2),
+                }
+                for label, s in self._stats.items()
+            }
+            return {"threads": self.threads, "queue_max": self.queue_max, "pending": self._pending,
+                    "rejected": self._rejected, "tasks": tasks}
+
+
+def _limit_blas(n: int) -> None:
+    """Cap already-initialized BLAS pools (numpy's OpenBLAS/MKL); threadpoolctl ships with scikit-learn."""
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=n, user_api="blas")
+
+
+_executor: Optional[ScoringExecutor] = None
+
+
+def get_scoring_executor() -> ScoringExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ScoringExecutor(SCORING_THREADS, SCORING_QUEUE_MAX)
+    return _executor
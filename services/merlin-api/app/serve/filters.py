@@ -0,0 +1,145 @@
+# services/merlin-api/app/serve/filters.py
+from __future__ import annotations
+import threading
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.serve.catalog_index import CatalogIndex, get_catalog_index
+
+MASK_CACHE_SIZE = 64
+
+
+class FilterSpec(NamedTuple):
+    """Hashable filter description; empty/None fields mean 'no constraint'."""
+    genres: Tuple[str, ...] = ()          # keep items having ANY of these
+    exclude_genres: Tuple[str, ...] = ()  # drop items having any of these
+    year_min: Optional[int] = None
+    year_max: Optional[int] = None
+    available_only: bool = False
+
+    def is_empty(self) -> bool:
+        return not (self.genres or self.exclude_genres or self.year_min is not None
+                    or self.year_max is not None or self.available_only)
+
+
+def _decade(year: int) -> int:
+    return (year // 10) * 10
+
+
+class AttributeBitmaps:
+    """
+    Per-attribute boolean bitmaps aligned to one model's item index space
+    (position i == model row i), built from the in-memory catalog:
+      - genres[g]: item has genre g (lowercased)
+      - decades[d]: release year in [d, d+10)
+      - available: not flagged unavailable (items missing from the catalog count as available)
+    Combined masks are cached per FilterSpec, so repeated filters cost one dict hit.
+    """
+
+    def __init__(self, item_ids: Sequence[Optional[str]], catalog: CatalogIndex):
+        n = len(item_ids)
+        self.catalog = catalog
+        self.n = n
+        self.genres: Dict[str, np.ndarray] = {}
+        self.decades: Dict[int, np.ndarray] = {}
+        self.year = np.zeros(n, dtype=np.int16)  # 0 = unknown
+        self.available = np.ones(n, dtype=bool)
+
+        by_id = catalog.by_id
+        for i, iid in enumerate(item_ids):
+            row = by_id.get(iid) if iid else None
+            if row is None:
+                continue
+            for g in row.get("genres") or ():
+                g = str(g).lower()
+                if g not in self.genres:
+                    self.genres[g] = np.zeros(n, dtype=bool)
+                self.genres[g][i] = True
+            year = row.get("year")
+            if year:
+                self.year[i] = year
+                d = _decade(int(year))
+                if d not in self.decades:
+                    self.decades[d] = np.zeros(n, dtype=bool)
+                self.decades[d][i] = True
+            if row.get("available") is False:
+                self.available[i] = False
+
+        self._masks: Dict[FilterSpec, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _year_mask(self, lo: Optional[int], hi: Optional[int]) -> np.ndarray:
+        lo = lo if lo is not None else 1
+        hi = hi if hi is not None else 9999
+        out = np.zeros(self.n, dtype=bool)
+        for d, bm in self.decades.items():
+            if lo <= d and d + 9 <= hi:
+                out |= bm                      # decade fully inside the range
+            elif d + 9 >= lo and d <= hi:
+                out |= bm & (self.year >= lo) & (self.year <= hi)  # edge decade
+        return out
+
+    def mask(self, spec: FilterSpec) -> Optional[np.ndarray]:
+        """Boolean keep-mask over model rows, or None when the spec filters nothing."""
+        if spec.is_empty():
+            return None
+        cached = self._masks.get(spec)
+        if cached is not None:
+            return cached
+
+        keep = np.ones(self.n, dtype=bool)
+        if spec.genres:
+            any_of = np.zeros(self.n, dtype=bool)
+            for g in spec.genres:
+                bm = self.genres.get(g.lower())
+                if bm is not None:
+                    any_of |= bm
+            keep &= any_of
+        for g in spec.exclude_genres:
+            bm = self.genres.get(g.lower())
+            if bm is not None:
+                keep &= ~bm
+        if spec.year_min is not None or spec.year_max is not None:
+            keep &= self._year_mask(spec.year_min, spec.year_max)
+        if spec.available_only:
+            keep &= self.available
+
+        with self._lock:
+            if len(self._masks) >= MASK_CACHE_SIZE:
+                self._masks.pop(next(iter(self._masks)))
+            self._masks[spec] = keep
+        return keep
+
+
+# {(model_id, version): AttributeBitmaps}; rebuilt when the catalog index is swapped
+_BITMAPS: Dict[Tuple[str, str], AttributeBitmaps] = {}
+_lock = threading.Lock()
+
+
+def bitmaps_for(model_key: Tuple[str, str], item_ids: Sequence[Optional[str]]) -> AttributeBitmaps:
+    catalog = get_catalog_index()
+    bm = _BITMAPS.get(model_key)
+    if bm is not None and bm.catalog is catalog and bm.n == len(item_ids):
+        return bm
+    with _lock:
+        bm = _BITMAPS.get(model_key)
+        if bm is None or bm.catalog is not catalog or bm.n != len(item_ids):
+            bm = AttributeBitmaps(item_ids, catalog)
+            _BITMAPS[model_key] = bm
+    return bm
+
+
+def drop_bitmaps(model_key: Tuple[str, str]) -> None:
+    """Forget a model version's bitmaps (it was unloaded)."""
+    with _lock:
+        _BITMAPS.pop(model_key, None)
+
+
+def filter_mask(
+    model_key: Tuple[str, str], item_ids: Sequence[Optional[str]], spec: Optional[FilterSpec]
+) -> Optional[np.ndarray]:
+    """Keep-mask for spec over a model's items (None = unfiltered)."""
+    if spec is None or spec.is_empty():
+        return None
+    return bitmaps_for(model_key, item_ids).mask(spec)
@@ -1,54 +1,92 @@
 import os, json, numpy as np
-from typing import List, Tuple, Dict
-from scipy.sparse import csr_matrix
+from typing import List, Tuple, Dict, Iterable, Iterator, Optional
 import psycopg
 
-DATABASE_URL = os.environ["DATABASE_URL"]
+from app.artifact_store import local_path
+from app.trainers.quantize import read_manifest, sims_decoder
 
-def _latest_row(model_id: str, stage: str = "dev") -> Dict:
-    sql = """
-      select model_id, version, artifact_uri, format
-      from public.model_registry
-      where model_id = %s and stage = %s
-      order by created_at desc limit 1
-    """
-    with psycopg.connect(DATABASE_URL) as conn, conn.cursor() as cur:
-      cur.execute(sql, (model_id, stage))
+# Load float16/uint16 similarity scores instead of float32 when the artifact ships them
+SERVE_QUANTIZED = os.getenv("SERVE_QUANTIZED", "0") == "1"
+
+def _latest_row(model_id: str, stage: str = "dev", version: Optional[str] = None) -> Dict:
+    """Newest row of model_id in stage, or the row of one specific version (any stage)."""
+    if version is None:
+      sql, params = """
+        select model_id, version, artifact_uri, format
+        from public.model_registry
+        where model_id = %s and stage = %s
+        order by created_at desc limit 1
+      """, (model_id, stage)
+    else:
+      sql, params = """
+        select model_id, version, artifact_uri, format
+        from public.model_registry
+        where model_id = %s and version = %s
+      """, (model_id, version)
+    with psycopg.connect(os.environ["DATABASE_URL"]) as conn, conn.cursor() as cur:
+      cur.execute(sql, params)
       row = cur.fetchone()
       if not row:
-        raise RuntimeError(f"model {model_id} (stage={stage}) not found")
+        raise RuntimeError(f"model {model_id} ({version or f'stage={stage}'}) not found")
       return {"model_id": row[0], "version": row[1], "artifact_uri": row[2], "format": row[3]}
 
-def _from_file_uri(uri: str) -> str:
-    if not uri.startswith("file://"):
-        raise ValueError(f"only file:// supported, got {uri}")
-    return uri[len("file://"):]
-
 class ItemKNN:
-    def __init__(self, model_id: str = "cf_itemknn", stage: str = "dev"):
-        row = _latest_row(model_id, stage)
-        base = _from_file_uri(row["artifact_uri"]).rstrip("/")
+    def __init__(self, model_id: str = "cf_itemknn", stage: str = "dev", version: Optional[str] = None):
+        row = _latest_row(model_id, stage, version)
+        self.model_id = row["model_id"]
+        self.version = row["version"]
+        base = local_path(row["artifact_uri"]).rstrip("/")
         # load ids
         ids = np.load(os.path.join(base, "item_ids.npz"), allow_pickle=True)["item_ids"].tolist()
         self.item_ids: List[str] = [str(x) for x in ids]
         self.index: Dict[str, int] = {iid: i for i, iid in enumerate(self.item_ids)}
-        # load sparse csr
-        data   = np.load(os.path.join(base, "sims_data.npy"))
-        indices= np.load(os.path.join(base, "sims_indices.npy"))
-        indptr = np.load(os.path.join(base, "sims_indptr.npy"))
+        # load sparse csr triplet; rows are sliced straight out of these arrays
+        quant = read_manifest(base).get("sims") if SERVE_QUANTIZED else None
+        if quant:
+            self.data = np.load(os.path.join(base, "sims_data_q.npy"))
+            self._decode = sims_decoder(quant)  # applied per neighbor slice
+        else:
+            self.data = np.load(os.path.join(base, "sims_data.npy"))
+            self._decode = None
+        self.indices = np.load(os.path.join(base, "sims_indices.npy"))
+        self.indptr = np.load(os.path.join(base, "sims_indptr.npy"))
         with open(os.path.join(base, "sims_shape.json")) as f:
-            shape = tuple(json.load(f)["shape"])
-        self.S = csr_matrix((data, indices, indptr), shape=shape)
+            self.shape = tuple(json.load(f)["shape"])
+
+    def similar_items(
+        self, seed_item_id: str, k: int = 10, mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[str, float]]:
+        """Top-k neighbors of seed. mask (bool over item indices) drops neighbors before top-k."""
+        return next(self.similar_items_batch([seed_item_id], k=k, mask=mask))[1]
 
-    def similar_items(self, seed_item_id: str, k: int = 10) -> List[Tuple[str, float]]:
-        i = self.index.get(str(seed_item_id))
-        if i is None:  # unknown seed
-            return []
-        row = self.S.getrow(i)
-        if row.nnz == 0:
-            return []
-        # sort by score, high→low
-        order = row.data.argsort()[::-1]
-        top_idx = row.indices[order][:k]
-        top_val = row.data[order][:k]
-        return [(self.item_ids[j], float(s)) for j, s in zip(top_idx, top_val)]
\ No newline at end of file
+    def similar_items_batch(
+        self, seed_item_ids: Iterable[str], k: int = 10, mask: Optional[np.ndarray] = None
+    ) -> Iterator[Tuple[str, List[Tuple[str, float]]]]:
+        """
+        Batch variant of similar_items. Yields (seed_item_id, [(item_id, score), ...])
+        lazily in input order. Rows are sliced straight out of the CSR arrays
+        instead of building a getrow() matrix per seed. The optional mask is applied
+        to the neighbor slice before selection, so filtered queries still return k
+        items whenever the stored neighbor list has k that pass.
+        """
+        data, indices, indptr, decode = self.data, self.indices, self.indptr, self._decode
+        for seed in seed_item_ids:
+            seed = str(seed)
+            i = self.index.get(seed)
+            if i is None or k <= 0:  # unknown seed
+                yield seed, []
+                continue
+            lo, hi = indptr[i], indptr[i + 1]
+            row_idx, row_val = indices[lo:hi], data[lo:hi]
+            if decode is not None:
+                row_val = decode(row_val)
+            if mask is not None:
+                keep = mask[row_idx]
+                row_idx, row_val = row_idx[keep], row_val[keep]
+            if k < row_val.size:
+                top = np.argpartition(-row_val, k - 1)[:k]
+                top = top[np.argsort(-row_val[top], kind="stable")]
+            else:
+                top = np.argsort(-row_val, kind="stable")
+            top_idx = row_idx[top]
+            yield seed, [(self.item_ids[j], float(s)) for j, s in zip(top_idx, row_val[top])]
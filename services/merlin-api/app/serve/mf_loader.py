@@ -1,25 +1,43 @@
 from __future__ import annotations
+import math
 import os
-from typing import Dict, Tuple, List, Optional
+from typing import TYPE_CHECKING, Dict, Tuple, List, Optional, Iterable, Iterator
 import numpy as np
-import faiss
+
+from app.artifact_store import local_path
+from app.serve.executor import mark_cold
+from app.trainers.quantize import load_rows, read_manifest
+
+if TYPE_CHECKING:  # faiss is heavy (OpenMP runtime); import it on first model load
+    import faiss
+
+# Load float16/int8 factors instead of float32 when the artifact ships them
+SERVE_QUANTIZED = os.getenv("SERVE_QUANTIZED", "0") == "1"
 
 # Cache: {(model_id, version): (user_f, item_f, u2i, it2i, faiss_index)}
+# user_f / item_f are float32 arrays, or QuantizedRows when SERVE_QUANTIZED=1
 _CACHE: Dict[Tuple[str, str], Tuple[np.ndarray, np.ndarray, Dict[str,int], Dict[str,int], faiss.Index]] = {}
+# {(model_id, version): {item_id: factor row}}, for re-ranking stages that gather item factors
+_ITEM_ROWS: Dict[Tuple[str, str], Dict[str, int]] = {}
 
-def _path_from_uri(uri: str) -> str:
-    if uri.startswith("file://"):
-        return uri[len("file://"):]
-    raise ValueError(f"Unsupported artifact URI: {uri}")
+def _faiss():
+    import faiss
+    return faiss
 
 def load_mf_als(model_id: str, version: str, artifact_uri: str):
     key = (model_id, version)
     if key in _CACHE:
         return _CACHE[key]
 
-    base = _path_from_uri(artifact_uri)
-    user_f = np.load(os.path.join(base, "user_factors.npz"))["user_factors"]
-    item_f = np.load(os.path.join(base, "item_factors.npz"))["item_factors"]
+    mark_cold()
+    base = local_path(artifact_uri)
+    if SERVE_QUANTIZED and read_manifest(base).get("factors"):
+        # rows dequantize on access; scoring only gathers the query rows per chunk
+        user_f = load_rows(os.path.join(base, "user_factors_q.npz"))
+        item_f = load_rows(os.path.join(base, "item_factors_q.npz"))
+    else:
+        user_f = np.load(os.path.join(base, "user_factors.npz"))["user_factors"]
+        item_f = np.load(os.path.join(base, "item_factors.npz"))["item_factors"]
 
     mp = np.load(os.path.join(base, "mappings.npz"), allow_pickle=True)
     u_pairs = mp["user_to_index"].tolist()
@@ -36,36 +54,132 @@ def load_mf_als(model_id: str, version: str, artifact_uri: str):
         if 0 <= idx <= max_idx:
             inv_items[idx] = str(item_id)
 
-    index = faiss.read_index(os.path.join(base, "items.index"))
+    index = _faiss().read_index(os.path.join(base, "items.index"))
 
+    _ITEM_ROWS[(model_id, version)] = it2i
     _CACHE[(model_id, version)] = (user_f, item_f, u2i, inv_items, index)
     return _CACHE[(model_id, version)]
 
+def evict(model_id: str, version: str) -> None:
+    """Drop a loaded version (e.g. a replaced shadow version) so its arrays can be freed."""
+    _CACHE.pop((model_id, version), None)
+    _ITEM_ROWS.pop((model_id, version), None)
+
+def item_index(model_id: str, version: str, artifact_uri: str) -> Dict[str, int]:
+    load_mf_als(model_id, version, artifact_uri)
+    return _ITEM_ROWS[(model_id, version)]
+
 def _l2norm(x: np.ndarray) -> np.ndarray:
     n = np.linalg.norm(x) + 1e-12
     return (x / n).astype(np.float32)
 
-def recommend_for_user(user_id: str, k: int, model_id: str, version: str, artifact_uri: str):
-    user_f, item_f, u2i, inv_items, index = load_mf_als(model_id, version, artifact_uri)
+def _l2norm_rows(x: np.ndarray) -> np.ndarray:
+    n = np.linalg.norm(x, axis=1, keepdims=True) + 1e-12
+    return (x / n).astype(np.float32)
 
-    if user_id not in u2i:
-        return []
+def _search(index: faiss.Index, Q: np.ndarray, k: int, mask: Optional[np.ndarray] = None):
+    """
+    index.search with an optional bool keep-mask over FAISS rows.
+    The mask is pushed into FAISS as an IDSelectorBitmap so excluded items are
+    skipped during the scan (k results come back without post-filtering). Index
+    types without selector support fall back to adaptive over-fetch: start at
+    k / selectivity and double until every query has k passing hits.
+    """
+    if mask is None:
+        return index.search(Q, k)
+    n_keep = int(mask.sum())
+    if n_keep == 0:
+        return (np.full((Q.shape[0], k), -np.inf, dtype=np.float32),
+                np.full((Q.shape[0], k), -1, dtype=np.int64))
 
-    u_idx = u2i[user_id]
-    if u_idx < 0 or u_idx >= user_f.shape[0]:
-     return []  # let API fall back (trending)
-    u_vec = _l2norm(user_f[u_idx])
+    faiss = _faiss()
+    bits = np.packbits(mask, bitorder="little")  # must outlive the search call
+    try:
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(bits.size, faiss.swig_ptr(bits)))
+        return index.search(Q, k, params=params)
+    except (AttributeError, RuntimeError, TypeError):
+        pass
+
+    ntotal = index.ntotal
+    fetch = min(ntotal, math.ceil(k * mask.size / n_keep * 1.5))
+    while True:
+        D, I = index.search(Q, fetch)
+        keep = (I >= 0) & mask[np.clip(I, 0, mask.size - 1)]
+        if fetch >= ntotal or bool((keep.sum(axis=1) >= k).all()):
+            break
+        fetch = min(ntotal, fetch * 2)
+    outD = np.full((Q.shape[0], k), -np.inf, dtype=np.float32)
+    outI = np.full((Q.shape[0], k), -1, dtype=np.int64)
+    for r in range(Q.shape[0]):
+        sel = np.flatnonzero(keep[r])[:k]
+        outD[r, : sel.size] = D[r, sel]
+        outI[r, : sel.size] = I[r, sel]
+    return outD, outI
 
-    D, I = index.search(u_vec[None, :], k)
+def _pairs_from_hits(scores: List[float], idxs: List[int], inv_items: List[Optional[str]]) -> List[Tuple[str, float]]:
     out = []
-    for score, idx in zip(D[0].tolist(), I[0].tolist()):
-        if idx == -1:
-            continue
-        # Guard against missing/short mapping
+    for score, idx in zip(scores, idxs):
+        # -1 means FAISS ran out of results; also guard against missing/short mapping
         if idx < 0 or idx >= len(inv_items):
             continue
         item_id = inv_items[idx]
         if not item_id:
             continue
         out.append((item_id, float(score)))
-    return out
\ No newline at end of file
+    return out
+
+def recommend_for_user(
+    user_id: str, k: int, model_id: str, version: str, artifact_uri: str,
+    mask: Optional[np.ndarray] = None,
+):
+    user_f, item_f, u2i, inv_items, index = load_mf_als(model_id, version, artifact_uri)
+
+    if user_id not in u2i:
+        return []
+
+    u_idx = u2i[user_id]
+    if u_idx < 0 or u_idx >= user_f.shape[0]:
+     return []  # let API fall back (trending)
+    u_vec = _l2norm(user_f[u_idx])
+
+    D, I = _search(index, u_vec[None, :], k, mask)
+    return _pairs_from_hits(D[0].tolist(), I[0].tolist(), inv_items)
+
+def recommend_for_users(
+    user_ids: Iterable[str],
+    k: int,
+    model_id: str,
+    version: str,
+    artifact_uri: str,
+    chunk_size: int = 512,
+    mask: Optional[np.ndarray] = None,
+) -> Iterator[Tuple[str, List[Tuple[str, float]]]]:
+    """
+    Batch variant of recommend_for_user. Yields (user_id, [(item_id, score), ...])
+    in input order; unknown users yield an empty list.
+    Known users are gathered into one [chunk x D] matrix per chunk so FAISS runs a
+    single multi-query search instead of one search per user. mask is a bool
+    keep-mask over item rows (see _search).
+    """
+    user_f, item_f, u2i, inv_items, index = load_mf_als(model_id, version, artifact_uri)
+
+    def flush(chunk: List[str]):
+        rows = [u2i.get(u, -1) for u in chunk]
+        known = [j for j, r in enumerate(rows) if 0 <= r < user_f.shape[0]]
+        hits: Dict[int, List[Tuple[str, float]]] = {}
+        if known:
+            Q = _l2norm_rows(user_f[[rows[j] for j in known]])
+            D, I = _search(index, Q, k, mask)
+            for pos, j in enumerate(known):
+                hits[j] = _pairs_from_hits(D[pos].tolist(), I[pos].tolist(), inv_items)
+        for j, u in enumerate(chunk):
+            yield u, hits.get(j, [])
+
+    chunk: List[str] = []
+    for user_id in user_ids:
+        chunk.append(str(user_id))
+        if len(chunk) >= chunk_size:
+            yield from flush(chunk)
+            chunk = []
+    if chunk:
+        yield from flush(chunk)
\ No newline at end of file
@@ -0,0 +1,174 @@
+# services/merlin-api/app/serve/profiling.py
+"""
+On-demand request profiling, armed from the admin API.
+
+arm(path_prefix, n, mode) profiles the window from the start of the first
+matching request to the end of the n-th. Two modes:
+
+  - "sample": a background thread snapshots every thread's stack each
+    interval_ms (sys._current_frames), so work on the scoring executor and
+    other pool threads is included. Idle waits (threading/selectors/queue
+    leaves) are skipped. The report lists the hottest frames by self and
+    cumulative samples.
+  - "cprofile": deterministic cProfile of the event-loop thread. Coroutines of
+    other requests that interleave in the window are included. Executor
+    threads are not.
+
+One session per process at a time; the report stays until the next arm().
+"""
+from __future__ import annotations
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+IDLE_LEAF_FILES = ("threading.py", "selectors.py", "queue.py")
+TOP_N = 40
+
+
+class _Sampler:
+    def __init__(self, interval_ms: float):
+        self.interval = interval_ms / 1000.0
+        self.self_counts: Counter = Counter()
+        self.cum_counts: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="merlin-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me or os.path.basename(frame.f_code.co_filename) in IDLE_LEAF_FILES:
+                    continue
+                self.samples += 1
+                seen = set()
+                leaf = True
+                while frame is not None:
+                    code = frame.f_code
+                    key = f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+                    if leaf:
+                        self.self_counts[key] += 1
+                        leaf = False
+                    if key not in seen:  # count recursive frames once per stack
+                        self.cum_counts[key] += 1
+                        seen.add(key)
+                    frame = frame.f_back
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000.0,
+            "top_self": [{"frame": k, "samples": v} for k, v in self.self_counts.most_common(TOP_N)],
+            "top_cumulative": [{"frame": k, "samples": v} for k, v in self.cum_counts.most_common(TOP_N)],
+        }
+
+
+class ProfileSession:
+    def __init__(self, path_prefix: str, requests: int, mode: str, interval_ms: float):
+        if mode not in ("sample", "cprofile"):
+            raise ValueError(f"unknown profile mode {mode!r}")
+        self.path_prefix = path_prefix
+        self.requests = requests
+        self.mode = mode
+        self.interval_ms = interval_ms
+        self.started = 0
+        self.finished = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self._sampler: Optional[_Sampler] = None
+        self._cprofile: Optional[cProfile.Profile] = None
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    def claim(self, path: str) -> bool:
+        """True if this request belongs to the window (starts the collector on the first one)."""
+        if self.done or self.started >= self.requests or not path.startswith(self.path_prefix):
+            return False
+        if self.started == 0:
+            self.started_at = time.time()
+            if self.mode == "sample":
+                self._sampler = _Sampler(self.interval_ms)
+                self._sampler.start()
+            else:
+                self._cprofile = cProfile.Profile()
+                self._cprofile.enable()
+        self.started += 1
+        return True
+
+    def release(self) -> None:
+        self.finished += 1
+        if self.finished >= self.requests:
+            self._finish()
+
+    def _finish(self) -> None:
+        self.finished_at = time.time()
+        if self._sampler is not None:
+            self._sampler.stop()
+            report = self._sampler.report()
+        else:
+            self._cprofile.disable()
+            buf = io.StringIO()
+            pstats.Stats(self._cprofile, stream=buf).sort_stats("cumulative").print_stats(TOP_N)
+            report = {"pstats": buf.getvalue()}
+        report["wall_s"] = round(self.finished_at - self.started_at, 3)
+        self.result = report
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "path_prefix": self.path_prefix,
+            "mode": self.mode,
+            "requests": self.requests,
+            "started": self.started,
+            "finished": self.finished,
+            "done": self.done,
+            "result": self.result,
+        }
+
+
+_session: Optional[ProfileSession] = None
+_lock = threading.Lock()
+
+
+def arm(path_prefix: str, requests: int, mode: str = "sample", interval_ms: float = 5.0) -> ProfileSession:
+    global _session
+    with _lock:
+        if _session is not None and _session.started and not _session.done:
+            raise RuntimeError("a profile is already in progress")
+        _session = ProfileSession(path_prefix, requests, mode, interval_ms)
+        return _session
+
+
+def status() -> Optional[Dict[str, Any]]:
+    return _session.status() if _session is not None else None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware; a no-op attribute check unless a session is armed."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        session = _session
+        if session is None or session.done or scope["type"] != "http" or not session.claim(scope["path"]):
+            return await self.app(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.release()
@@ -1,5 +1,25 @@
 # services/merlin-api/app/serve/ranker.py
-from typing import List, Dict
+"""
+Re-ranking stages applied to a retrieved candidate list.
+
+mmr() is the diversity pass behind RecommendRequest.diversity. Retrieval first
+over-fetches a pool of pool_size(k, diversity) candidates. One
+candidate x candidate similarity block is then built, either as cosine over item
+factors (factor_similarity) or as the KNN graph restricted to the pool
+(sparse_similarity). MMR picks k items greedily. A running max-similarity vector
+is updated with each picked item's row, so a step is a few O(n) numpy ops instead
+of a loop over the picks.
+"""
+from __future__ import annotations
+import os
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# candidates fetched per requested item when diversity > 0, and the pool cap
+DIVERSITY_POOL_FACTOR = int(os.getenv("DIVERSITY_POOL_FACTOR", "5"))
+DIVERSITY_POOL_MAX = int(os.getenv("DIVERSITY_POOL_MAX", "500"))
+
 
 def rerank(candidates: List[Dict], model_id: str, version: str, k: int = 20) -> List[Dict]:
     """
@@ -7,4 +27,96 @@ def rerank(candidates: List[Dict], model_id: str, version: str, k: int = 20) ->
     TODO: load ONNX/TorchScript model and rerank candidates.
     """
     ranked = sorted(candidates, key=lambda x: x["score"], reverse=True)
-    return ranked[:k]
\ No newline at end of file
+    return ranked[:k]
+
+
+# ---------- diversity (MMR) ----------
+
+def pool_size(k: int, diversity: float) -> int:
+    """Candidates to retrieve for a request of k items."""
+    if diversity <= 0:
+        return k
+    return max(k, min(k * DIVERSITY_POOL_FACTOR, DIVERSITY_POOL_MAX))
+
+
+def factor_similarity(X: np.ndarray) -> np.ndarray:
+    """Cosine similarity block [n x n] of candidate factor rows X [n x d]."""
+    X = np.asarray(X, dtype=np.float32)
+    X = X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-12)
+    return X @ X.T
+
+
+def sparse_similarity(
+    data: np.ndarray, indices: np.ndarray, indptr: np.ndarray, rows: np.ndarray,
+    decode: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+) -> np.ndarray:
+    """
+    Dense block [n x n] of a square CSR similarity matrix (the item-KNN triplet)
+    restricted to the candidate rows on both axes, symmetrized with max. rows may
+    hold -1 for candidates the matrix doesn't know; their rows stay zero. Cost is
+    one gather over the candidates' stored neighbors (pool size x row length).
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    n = rows.size
+    B = np.zeros((n, n), dtype=np.float32)
+    known = rows >= 0
+    starts = np.where(known, indptr[np.maximum(rows, 0)], 0).astype(np.int64)
+    lens = np.where(known, indptr[np.maximum(rows, 0) + 1] - starts, 0)
+    total = int(lens.sum())
+    if total == 0:
+        return B
+    # every stored neighbor of every candidate, as one flat gather
+    owner = np.repeat(np.arange(n), lens)
+    flat = np.repeat(starts - (np.cumsum(lens) - lens), lens) + np.arange(total)
+    # position of each neighbor in the candidate list (-1 = not a candidate)
+    pos = np.full(len(indptr) - 1, -1, dtype=np.int32)
+    pos[rows[known]] = np.flatnonzero(known)
+    hit = pos[indices[flat]]
+    keep = np.flatnonzero(hit >= 0)
+    vals = data[flat[keep]]
+    B[owner[keep], hit[keep]] = decode(vals) if decode is not None else vals
+    return np.maximum(B, B.T)
+
+
+def mmr(scores: np.ndarray, sim: np.ndarray, k: int, diversity: float) -> np.ndarray:
+    """
+    Greedy maximal-marginal-relevance order: indices into scores, length min(k, n).
+    Step t picks argmax (1 - diversity) * rel - diversity * max_sim_to_picked,
+    with rel = scores min-max scaled to [0, 1] (retrievers score on different
+    scales). diversity=0 is plain score order.
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    n = scores.size
+    k = min(k, n)
+    diversity = min(max(float(diversity), 0.0), 1.0)
+    lo, hi = float(scores.min()) if n else 0.0, float(scores.max()) if n else 0.0
+    rel = (scores - lo) / (hi - lo) if hi > lo else np.ones(n, dtype=np.float32)
+    gain = ((1.0 - diversity) * rel).astype(np.float32)
+    max_sim = np.zeros(n, dtype=np.float32)
+    g = np.empty(n, dtype=np.float32)
+    out = np.empty(k, dtype=np.int64)
+    for t in range(k):
+        np.multiply(max_sim, -diversity, out=g)
+        g += gain
+        j = int(g.argmax())
+        out[t] = j
+        gain[j] = -np.inf  # picked; stays -inf whatever max_sim becomes
+        np.maximum(max_sim, sim[j], out=max_sim)
+    return out
+
+
+def diversify(
+    pairs: Sequence[Tuple[str, float]], k: int, diversity: float,
+    similarity: Callable[[List[str]], np.ndarray],
+) -> List[Tuple[str, float]]:
+    """Re-order retrieved (item_id, score) pairs with MMR and keep k. Scores are left as retrieved."""
+    if diversity <= 0 or len(pairs) <= 1:
+        return list(pairs[:k])
+    sim = similarity([iid for iid, _ in pairs])
+    order = mmr(np.fromiter((s for _, s in pairs), dtype=np.float32, count=len(pairs)), sim, k, diversity)
+    return [pairs[i] for i in order]
+
+
+def item_rows(index: Dict[str, int], item_ids: Sequence[str]) -> np.ndarray:
+    """Model rows of item_ids (-1 where the model doesn't know the item)."""
+    return np.fromiter((index.get(iid, -1) for iid in item_ids), dtype=np.int64, count=len(item_ids))
@@ -0,0 +1,96 @@
+# services/merlin-api/app/serve/session_markov_loader.py
+"""
+Serving side of the session next-item model (app/trainers/session_markov.py).
+
+Rows are stored sorted by descending P(next | item), so the best candidates
+of an item are a prefix of its row. next_items() reads a short prefix of the
+row of each of the session's last few items. Older items are down-weighted by
+SESSION_NEXT_DECAY per step, and the prefixes are summed. The work is
+O(len(recent) * k), independent of the catalog size, and uses no FAISS.
+"""
+from __future__ import annotations
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.artifact_store import local_path
+from app.serve.executor import mark_cold
+from app.trainers.quantize import read_manifest, sims_decoder
+
+SERVE_QUANTIZED = os.getenv("SERVE_QUANTIZED", "0") == "1"
+# weight of the item one step older than the latest (then squared, cubed, ...)
+SESSION_NEXT_DECAY = float(os.getenv("SESSION_NEXT_DECAY", "0.6"))
+
+
+class SessionMarkov:
+    def __init__(self, model_id: str, version: str, base: str):
+        self.model_id = model_id
+        self.version = version
+        ids = np.load(os.path.join(base, "item_ids.npz"), allow_pickle=True)["item_ids"].tolist()
+        self.item_ids: List[str] = [str(x) for x in ids]
+        self.index: Dict[str, int] = {iid: i for i, iid in enumerate(self.item_ids)}
+        quant = read_manifest(base).get("sims") if SERVE_QUANTIZED else None
+        if quant:
+            self.data = np.load(os.path.join(base, "sims_data_q.npy"))
+            self._decode = sims_decoder(quant)
+        else:
+            self.data = np.load(os.path.join(base, "sims_data.npy"))
+            self._decode = None
+        self.indices = np.load(os.path.join(base, "sims_indices.npy"))
+        self.indptr = np.load(os.path.join(base, "sims_indptr.npy"))
+        with open(os.path.join(base, "sims_shape.json")) as f:
+            self.shape = tuple(json.load(f)["shape"])
+
+    def next_items(
+        self, recent: Sequence[str], k: int = 10, mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Top-k next items after `recent` (newest first). Items already in
+        `recent` are never returned. With a mask the whole stored row is read
+        (filters may reject most of a prefix).
+        """
+        seen = [i for i in (self.index.get(str(x)) for x in recent) if i is not None]
+        if not seen or k <= 0:
+            return []
+        take = k + len(seen)
+        idx_parts, val_parts = [], []
+        for step, i in enumerate(seen):
+            lo, hi = self.indptr[i], self.indptr[i + 1]
+            if mask is None:
+                hi = min(hi, lo + take)
+            row_idx, row_val = self.indices[lo:hi], self.data[lo:hi]
+            if self._decode is not None:
+                row_val = self._decode(row_val)
+            if mask is not None:
+                keep = mask[row_idx]
+                row_idx, row_val = row_idx[keep], row_val[keep]
+            idx_parts.append(row_idx)
+            val_parts.append(row_val * (SESSION_NEXT_DECAY ** step))
+        if len(idx_parts) == 1:
+            cand, score = idx_parts[0], val_parts[0].astype(np.float32)
+        else:
+            cand, inv = np.unique(np.concatenate(idx_parts), return_inverse=True)
+            score = np.bincount(inv, weights=np.concatenate(val_parts)).astype(np.float32)
+        drop = np.isin(cand, seen)
+        cand, score = cand[~drop], score[~drop]
+        if k < score.size:
+            top = np.argpartition(-score, k - 1)[:k]
+            top = top[np.argsort(-score[top], kind="stable")]
+        else:
+            top = np.argsort(-score, kind="stable")
+        return [(self.item_ids[j], float(s)) for j, s in zip(cand[top], score[top])]
+
+
+# Cache: {(model_id, version): SessionMarkov}
+_CACHE: Dict[Tuple[str, str], SessionMarkov] = {}
+
+
+def load_session_markov(model_id: str, version: str, artifact_uri: str) -> SessionMarkov:
+    key = (model_id, version)
+    model = _CACHE.get(key)
+    if model is None:
+        mark_cold()
+        model = _CACHE[key] = SessionMarkov(model_id, version, local_path(artifact_uri))
+    return model
@@ -0,0 +1,96 @@
+# services/merlin-api/app/serve/session_tail.py
+"""
+Last few items of each active session, kept in process for session_next.
+
+A session's tail is read from public.events once (events_session_recent_idx).
+After that, /events on this worker appends to it. Entries expire after
+SESSION_TAIL_TTL_S, so events recorded by other workers show up within that
+bound. Clients that know the tail can send it in the request and skip all of
+this.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+SESSION_TAIL_LEN = int(os.getenv("SESSION_TAIL_LEN", "5"))
+SESSION_TAIL_SESSIONS = int(os.getenv("SESSION_TAIL_SESSIONS", "50000"))
+SESSION_TAIL_TTL_S = float(os.getenv("SESSION_TAIL_TTL_S", "30"))
+
+RECENT_SQL = """
+    select item_id
+    from public.events
+    where session_id = %s
+    order by ts desc
+    limit %s
+"""
+
+
+def _dedupe(items: List[str]) -> List[str]:
+    """Newest-first, consecutive repeats collapsed (view -> like on one item is one step)."""
+    out: List[str] = []
+    for iid in items:
+        if not out or out[-1] != iid:
+            out.append(iid)
+    return out
+
+
+class SessionTails:
+    """LRU of {session_id: (loaded_at, [item_id newest first])}."""
+
+    def __init__(self, maxsize: int, length: int, ttl_s: float):
+        self.maxsize = maxsize
+        self.length = length
+        self.ttl_s = ttl_s
+        self._d: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[List[str]]:
+        with self._lock:
+            hit = self._d.get(session_id)
+            if hit is None:
+                return None
+            if time.monotonic() - hit[0] > self.ttl_s:
+                del self._d[session_id]
+                return None
+            self._d.move_to_end(session_id)
+            return list(hit[1])
+
+    def put(self, session_id: str, items: List[str]) -> None:
+        with self._lock:
+            self._d[session_id] = (time.monotonic(), _dedupe(items)[: self.length])
+            self._d.move_to_end(session_id)
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+    def push(self, session_id: str, item_id: str) -> None:
+        """Append a just-recorded event. Unknown sessions are left to the next read (it sees this event)."""
+        with self._lock:
+            hit = self._d.get(session_id)
+            if hit is None:
+                return
+            items = hit[1]
+            if not items or items[0] != item_id:
+                hit[1][:] = [item_id] + items[: self.length - 1]
+
+
+_tails = SessionTails(SESSION_TAIL_SESSIONS, SESSION_TAIL_LEN, SESSION_TAIL_TTL_S)
+
+
+def get_tail(session_id: str) -> Optional[List[str]]:
+    return _tails.get(session_id)
+
+
+def push(session_id: str, item_id: str) -> None:
+    _tails.push(session_id, item_id)
+
+
+def load_tail(conn, session_id: str) -> List[str]:
+    """Read the tail from events (a few extra rows so repeats can be collapsed) and cache it."""
+    with conn.cursor() as cur:
+        cur.execute(RECENT_SQL, (session_id, SESSION_TAIL_LEN * 3))
+        items = [str(r[0]) for r in cur.fetchall()]
+    _tails.put(session_id, items)
+    return _tails.get(session_id) or []
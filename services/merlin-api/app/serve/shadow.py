@@ -0,0 +1,263 @@
+# services/merlin-api/app/serve/shadow.py
+"""
+Shadow scoring: replay a sample of /recommend requests against a candidate
+model version, off the request path, and aggregate how far its answers are
+from the version that served them.
+
+recs.py offers a job from a BackgroundTask, i.e. after the response has been
+sent. Jobs go into a bounded queue (SHADOW_QUEUE_MAX). A full queue drops the
+job and counts it; nobody ever waits on it. SHADOW_THREADS low-priority
+threads (niced by SHADOW_NICE, one OpenMP thread each) drain it, so shadowing
+only takes CPU the request path leaves idle.
+
+Aggregates are kept per (model_id, primary version, shadow version), at most
+SHADOW_MAX_PAIRS of them, oldest evicted first. Each keeps running sums of
+overlap@K, Spearman correlation over the shared items and top-1 agreement,
+plus a ring of the last SHADOW_LATENCY_WINDOW shadow run times for
+percentiles.
+"""
+from __future__ import annotations
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.log import get_logger
+
+log = get_logger("shadow")
+
+# "model_id=version,..." e.g. "mf_als=als-20261018,cf_itemknn=0.0.2"; also settable via /admin/shadow
+SHADOW_MODELS = os.getenv("SHADOW_MODELS", "")
+SHADOW_SAMPLE = float(os.getenv("SHADOW_SAMPLE", "0.05"))  # fraction of eligible requests replayed
+SHADOW_QUEUE_MAX = int(os.getenv("SHADOW_QUEUE_MAX", "32"))
+SHADOW_THREADS = int(os.getenv("SHADOW_THREADS", "1"))
+SHADOW_NICE = int(os.getenv("SHADOW_NICE", "10"))
+SHADOW_MAX_PAIRS = int(os.getenv("SHADOW_MAX_PAIRS", "16"))
+SHADOW_LATENCY_WINDOW = int(os.getenv("SHADOW_LATENCY_WINDOW", "1024"))
+
+
+def _parse_targets(spec: str) -> Dict[str, str]:
+    out = {}
+    for part in spec.split(","):
+        if "=" in part:
+            model_id, version = part.split("=", 1)
+            if model_id.strip() and version.strip():
+                out[model_id.strip()] = version.strip()
+    return out
+
+
+def compare(primary: Sequence[str], shadow: Sequence[str], k: int) -> Dict[str, Optional[float]]:
+    """
+    overlap@k: shared items / k (k capped at the longer list).
+    spearman: rank correlation of the shared items' positions (None below 2 shared).
+    top1: both lists lead with the same item.
+    """
+    p, s = list(primary[:k]), list(shadow[:k])
+    depth = max(len(p), len(s))
+    if depth == 0:
+        return {"overlap": None, "spearman": None, "top1": None}
+    pos_s = {iid: i for i, iid in enumerate(s)}
+    shared = [iid for iid in p if iid in pos_s]
+    m = len(shared)
+    rho = None
+    if m >= 2:
+        # ranks within the shared items: primary order is 0..m-1 by construction
+        rank_s = np.argsort(np.argsort([pos_s[iid] for iid in shared]))
+        d2 = float(((np.arange(m) - rank_s) ** 2).sum())
+        rho = 1.0 - 6.0 * d2 / (m * (m * m - 1))
+    top1 = float(bool(p) and bool(s) and p[0] == s[0])
+    return {"overlap": m / depth, "spearman": rho, "top1": top1}
+
+
+class PairStats:
+    """Running aggregate for one (model_id, primary version, shadow version)."""
+
+    def __init__(self, window: int):
+        self.n = 0
+        self.overlap_sum = 0.0
+        self.spearman_sum = 0.0
+        self.spearman_n = 0
+        self.top1_sum = 0.0
+        self.shadow_empty = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.run_ms = np.zeros(window, dtype=np.float32)  # ring; memory is fixed
+        self.run_n = 0
+        self.wait_ms_max = 0.0
+        self.updated = time.time()
+
+    def add(self, m: Dict[str, Optional[float]], empty: bool, run_ms: float, wait_ms: float) -> None:
+        self.n += 1
+        if m["overlap"] is not None:
+            self.overlap_sum += m["overlap"]
+            self.top1_sum += m["top1"]
+        if m["spearman"] is not None:
+            self.spearman_sum += m["spearman"]
+            self.spearman_n += 1
+        self.shadow_empty += int(empty)
+        self._timing(run_ms, wait_ms)
+
+    def fail(self, err: str, run_ms: float, wait_ms: float) -> None:
+        self.errors += 1
+        self.last_error = err
+        self._timing(run_ms, wait_ms)
+
+    def _timing(self, run_ms: float, wait_ms: float) -> None:
+        self.run_ms[self.run_n % self.run_ms.size] = run_ms
+        self.run_n += 1
+        self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+        self.updated = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        lat = self.run_ms[: min(self.run_n, self.run_ms.size)]
+        p50, p95, p99 = (np.percentile(lat, [50, 95, 99]).round(2).tolist() if lat.size else (None,) * 3)
+        return {
+            "compared": self.n,
+            "overlap_at_k": round(self.overlap_sum / self.n, 4) if self.n else None,
+            "spearman": round(self.spearman_sum / self.spearman_n, 4) if self.spearman_n else None,
+            "top1_agreement": round(self.top1_sum / self.n, 4) if self.n else None,
+            "shadow_empty": self.shadow_empty,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "shadow_ms": {"p50": p50, "p95": p95, "p99": p99, "window": int(lat.size)},
+            "queue_wait_ms_max": round(self.wait_ms_max, 1),
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.updated)),
+        }
+
+
+class ShadowScorer:
+    def __init__(self, targets: Dict[str, str], sample: float, queue_max: int, threads: int):
+        self.targets = dict(targets)
+        self.sample = sample
+        self.threads = threads
+        self._q: "queue.Queue[Tuple]" = queue.Queue(maxsize=queue_max)
+        self._workers: List[threading.Thread] = []  # started on first offer (after any fork)
+        self._lock = threading.Lock()
+        self._pairs: "OrderedDict[Tuple[str, str, str], PairStats]" = OrderedDict()
+        self.offered = 0
+        self.queued = 0
+        self.dropped = 0
+
+    # ---------- config ----------
+    def target(self, model_id: str) -> Optional[str]:
+        return self.targets.get(model_id)
+
+    def set_target(self, model_id: str, version: Optional[str], sample: Optional[float] = None) -> None:
+        with self._lock:
+            if version:
+                self.targets[model_id] = version
+            else:
+                self.targets.pop(model_id, None)
+            if sample is not None:
+                self.sample = min(max(sample, 0.0), 1.0)
+
+    # ---------- request side ----------
+    def offer(self, model_id: str, primary_version: str, primary_ids: List[str], k: int,
+              score: Callable[[str], List[str]]) -> bool:
+        """
+        Queue a replay of one answered request; never blocks. score(shadow_version)
+        returns the shadow's item ids. False when not sampled, no target, or the queue is full.
+        """
+        version = self.targets.get(model_id)
+        if not version or version == primary_version or random.random() >= self.sample:
+            return False
+        self._start()
+        try:
+            self._q.put_nowait((model_id, primary_version, version, primary_ids, k, score, time.perf_counter()))
+            queued = True
+        except queue.Full:
+            queued = False
+        # += is not atomic; offers come from every request thread
+        with self._lock:
+            self.offered += 1
+            if queued:
+                self.queued += 1
+            else:
+                self.dropped += 1
+        return queued
+
+    # ---------- worker side ----------
+    def _start(self) -> None:
+        if len(self._workers) >= self.threads:
+            return
+        with self._lock:
+            while len(self._workers) < self.threads:
+                t = threading.Thread(target=self._run, name=f"merlin-shadow-{len(self._workers)}", daemon=True)
+                t.start()
+                self._workers.append(t)
+
+    def _run(self) -> None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), SHADOW_NICE)  # this thread only (Linux)
+        except (AttributeError, OSError):
+            pass
+        omp_set = False
+        while True:
+            model_id, primary_version, version, primary_ids, k, score, queued_at = self._q.get()
+            if not omp_set and "faiss" in sys.modules:
+                sys.modules["faiss"].omp_set_num_threads(1)
+                omp_set = True
+            t0 = time.perf_counter()
+            wait_ms = (t0 - queued_at) * 1000.0
+            try:
+                shadow_ids = score(version)
+                err = None
+            except Exception as e:  # a broken shadow version must never take the worker down
+                shadow_ids, err = [], f"{type(e).__name__}: {e}"
+            run_ms = (time.perf_counter() - t0) * 1000.0
+            with self._lock:
+                stats = self._pair(model_id, primary_version, version)
+                if err is None:
+                    stats.add(compare(primary_ids, shadow_ids, k), not shadow_ids, run_ms, wait_ms)
+                else:
+                    stats.fail(err, run_ms, wait_ms)
+            if err is not None:
+                log.warning("shadow scoring failed", extra={"fields": {
+                    "model_id": model_id, "shadow_version": version, "error": err}})
+
+    def _pair(self, model_id: str, primary_version: str, version: str) -> PairStats:
+        key = (model_id, primary_version, version)
+        stats = self._pairs.get(key)
+        if stats is None:
+            while len(self._pairs) >= SHADOW_MAX_PAIRS:
+                self._pairs.popitem(last=False)
+            stats = self._pairs[key] = PairStats(SHADOW_LATENCY_WINDOW)
+        self._pairs.move_to_end(key)
+        return stats
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            pairs = [
+                {"model_id": m, "primary_version": pv, "shadow_version": sv, **s.snapshot()}
+                for (m, pv, sv), s in self._pairs.items()
+            ]
+            return {
+                "targets": dict(self.targets),
+                "sample": self.sample,
+                "queue": {"max": self._q.maxsize, "depth": self._q.qsize(), "threads": len(self._workers)},
+                "offered": self.offered,
+                "queued": self.queued,
+                "dropped": self.dropped,
+                "pairs": pairs,
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._pairs.clear()
+            self.offered = self.queued = self.dropped = 0
+
+
+_scorer: Optional[ShadowScorer] = None
+
+
+def get_shadow() -> ShadowScorer:
+    global _scorer
+    if _scorer is None:
+        _scorer = ShadowScorer(_parse_targets(SHADOW_MODELS), SHADOW_SAMPLE, SHADOW_QUEUE_MAX, SHADOW_THREADS)
+    return _scorer
@@ -0,0 +1,95 @@
+# services/merlin-api/app/serve/trending.py
+"""
+In-memory trending list: the degraded answer /recommend serves when it cannot
+meet its deadline (slow DB, saturated scoring). Refreshed in the background
+alongside the catalog index, so serving it never touches the database.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from app.db.pool import pg_conn
+from app.serve.catalog_index import get_catalog_index
+from app.serve.filters import AttributeBitmaps, FilterSpec
+
+TRENDING_WINDOW_DAYS = int(os.getenv("TRENDING_WINDOW_DAYS", "7"))
+TRENDING_SIZE = int(os.getenv("TRENDING_SIZE", "500"))
+
+# Used until the first refresh succeeds (or when there are no events at all)
+SEED_POPULAR = [
+    "tt1375666",  # Inception
+    "tt0133093",  # The Matrix
+    "tt0111161",  # Shawshank
+    "tt0120737",  # LOTR:FOTR
+    "tt0468569",  # The Dark Knight
+    "tt0816692",  # Interstellar
+    "tt0103064",  # Terminator 2
+    "tt0088763",  # Back to the Future
+    "tt2395427",  # Avengers: Age of Ultron
+    "tt4154796",  # Avengers: Endgame
+]
+
+
+class Trending:
+    """Ranked (item_id, score) list with a lazily built attribute bitmap for filters."""
+
+    def __init__(self, pairs: List[Tuple[str, float]], version: str):
+        self.item_ids = [iid for iid, _ in pairs]
+        self.scores = [score for _, score in pairs]
+        self.version = version
+        self._bitmaps: Optional[AttributeBitmaps] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.item_ids)
+
+    def top(self, k: int, spec: Optional[FilterSpec] = None) -> List[Tuple[str, float]]:
+        if spec is None or spec.is_empty():
+            return list(zip(self.item_ids[:k], self.scores[:k]))
+        catalog = get_catalog_index()
+        with self._lock:
+            if self._bitmaps is None or self._bitmaps.catalog is not catalog:
+                self._bitmaps = AttributeBitmaps(self.item_ids, catalog)
+            bm = self._bitmaps
+        keep = bm.mask(spec)
+        out = []
+        for i in keep.nonzero()[0][:k]:
+            out.append((self.item_ids[i], self.scores[i]))
+        return out
+
+
+_trending = Trending([(iid, 0.0) for iid in SEED_POPULAR], "seed")
+
+
+# ts-bounded: only the last one or two monthly events partitions are scanned
+TRENDING_SQL = """
+select item_id,
+       sum(case event_type when 'like' then 3 when 'save' then 3 when 'click' then 1 else 0.2 end) as score
+from public.events
+where item_id is not null and ts > now() - make_interval(days => %s)
+group by item_id
+order by score desc
+limit %s
+"""
+
+
+def _fetch(conn, days: int, limit: int) -> List[Tuple[str, float]]:
+    with conn.cursor() as cur:
+        cur.execute(TRENDING_SQL, (days, limit))
+        return [(str(item_id), float(score)) for item_id, score in cur.fetchall()]
+
+
+def get_trending() -> Trending:
+    return _trending
+
+
+def refresh_trending() -> Trending:
+    """Recompute from the last TRENDING_WINDOW_DAYS of events and swap in."""
+    global _trending
+    with pg_conn() as conn:
+        pairs = _fetch(conn, TRENDING_WINDOW_DAYS, TRENDING_SIZE)
+    if pairs:
+        _trending = Trending(pairs, time.strftime("%Y%m%dT%H%M", time.gmtime()))
+    return _trending
@@ -0,0 +1,253 @@
+# services/merlin-api/app/trainers/als_sweep.py
+"""
+Hyperparameter sweep for implicit ALS.
+
+The interaction matrix is built once and split into train / held-out parts
+(a fraction of each active user's interactions is held out). Both CSRs are
+placed in shared memory. Each worker of a spawn-started process pool attaches
+to them without copying and trains one candidate config at a time. Every
+worker gets cores // workers threads for implicit and one BLAS thread, so
+the candidates don't oversubscribe the machine.
+
+Candidates are scored on the held-out interactions (NDCG@k and recall@k over
+a fixed sample of users, with training items masked out).
+"""
+from __future__ import annotations
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context, shared_memory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+HP_KEYS = ("factors", "reg", "alpha", "iters")
+
+
+# ---------- Shared CSR ----------
+
+class SharedCSR:
+    """A CSR matrix whose three arrays live in named shared-memory segments."""
+
+    def __init__(self, csr: sp.csr_matrix):
+        self.shape = csr.shape
+        self._segments: List[shared_memory.SharedMemory] = []
+        self.arrays: Dict[str, Tuple[str, str, int]] = {}
+        for name in ("data", "indices", "indptr"):
+            arr = np.ascontiguousarray(getattr(csr, name))
+            seg = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=seg.buf)[:] = arr
+            self._segments.append(seg)
+            self.arrays[name] = (seg.name, arr.dtype.str, arr.shape[0])
+
+    def spec(self) -> Dict[str, Any]:
+        """Picklable handle for attach()."""
+        return {"shape": self.shape, "arrays": self.arrays}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(seg.size for seg in self._segments)
+
+    def unlink(self) -> None:
+        for seg in self._segments:
+            seg.close()
+            seg.unlink()
+        self._segments = []
+
+
+def attach(spec: Dict[str, Any]) -> Tuple[sp.csr_matrix, List[shared_memory.SharedMemory]]:
+    """CSR view over the shared segments (no copy). Keep the segments referenced while it is used."""
+    segments, parts = [], {}
+    for name, (seg_name, dtype, n) in spec["arrays"].items():
+        seg = shared_memory.SharedMemory(name=seg_name)
+        segments.append(seg)
+        parts[name] = np.ndarray((n,), dtype=np.dtype(dtype), buffer=seg.buf)
+    csr = sp.csr_matrix((parts["data"], parts["indices"], parts["indptr"]), shape=spec["shape"], copy=False)
+    return csr, segments
+
+
+# ---------- Holdout + metric ----------
+
+def holdout_split(
+    csr: sp.csr_matrix, frac: float = 0.2, min_user_items: int = 3, seed: int = 42
+) -> Tuple[sp.csr_matrix, sp.csr_matrix]:
+    """
+    Hold out floor(frac * n) random interactions of every user with at least
+    min_user_items (so each keeps at least one training item). Both parts keep
+    the full shape, so factor rows stay aligned with the user/item lists.
+    """
+    csr = csr.tocsr()
+    csr.sum_duplicates()
+    rng = np.random.default_rng(seed)
+    lengths = np.diff(csr.indptr)
+    rows = np.repeat(np.arange(csr.shape[0]), lengths)
+    order = np.lexsort((rng.random(csr.nnz), rows))
+    pos = np.arange(csr.nnz) - csr.indptr[rows[order]]
+    n_test = np.where(lengths >= min_user_items, np.floor(frac * lengths), 0).astype(np.int64)
+    is_test = np.zeros(csr.nnz, dtype=bool)
+    is_test[order] = pos < n_test[rows[order]]
+
+    def part(mask: np.ndarray) -> sp.csr_matrix:
+        coo = sp.coo_matrix((csr.data[mask], (rows[mask], csr.indices[mask])), shape=csr.shape)
+        return coo.tocsr()
+
+    return part(~is_test), part(is_test)
+
+
+def ranking_metrics(
+    user_f: np.ndarray,
+    item_f: np.ndarray,
+    train: sp.csr_matrix,
+    test: sp.csr_matrix,
+    users: np.ndarray,
+    k: int = 20,
+    batch: int = 512,
+) -> Dict[str, float]:
+    """
+    Mean NDCG@k / recall@k over `users`, ranking all items not seen in training.
+    Items are ranked by cosine, as served (FAISS inner product on L2-normalized
+    item factors); the user's norm doesn't change their order.
+    """
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    item_f = item_f / (np.linalg.norm(item_f, axis=1, keepdims=True) + 1e-12)
+    ndcg, recall = [], []
+    for start in range(0, len(users), batch):
+        b = users[start:start + batch]
+        scores = user_f[b] @ item_f.T
+        seen = train[b]
+        scores[np.repeat(np.arange(len(b)), np.diff(seen.indptr)), seen.indices] = -np.inf
+        top = np.argpartition(-scores, k, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+        relevant = test[b].toarray() > 0
+        hits = np.take_along_axis(relevant, top, axis=1)
+        n_rel = np.minimum(relevant.sum(axis=1), k)
+        idcg = np.cumsum(discounts)[n_rel - 1]
+        ndcg.append((hits @ discounts) / idcg)
+        recall.append(hits.sum(axis=1) / n_rel)
+    return {
+        f"ndcg@{k}": float(np.concatenate(ndcg).mean()),
+        f"recall@{k}": float(np.concatenate(recall).mean()),
+    }
+
+
+def eval_users(test: sp.csr_matrix, max_users: int, seed: int = 42) -> np.ndarray:
+    """Fixed sample of users with held-out items; every candidate is scored on the same set."""
+    users = np.flatnonzero(np.diff(test.indptr) > 0)
+    if len(users) > max_users:
+        users = np.sort(np.random.default_rng(seed).choice(users, max_users, replace=False))
+    return users
+
+
+# ---------- Candidates ----------
+
+def grid(space: Dict[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    return [dict(zip(HP_KEYS, combo)) for combo in itertools.product(*(space[k] for k in HP_KEYS))]
+
+
+def sample(space: Dict[str, Sequence[Any]], trials: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Random search: `trials` distinct configs drawn from the grid."""
+    configs = grid(space)
+    return random.Random(seed).sample(configs, min(trials, len(configs)))
+
+
+# ---------- Workers ----------
+
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(train_spec, test_spec, users: np.ndarray, k: int, threads: int, train_fn: Callable) -> None:
+    # each worker is a fresh (spawned) interpreter; pin its native thread pools
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        pass
+    else:
+        threadpool_limits(limits=1, user_api="blas")
+        threadpool_limits(limits=threads, user_api="openmp")
+    train, train_segs = attach(train_spec)
+    test, test_segs = attach(test_spec)
+    _worker.update(train=train, test=test, segments=train_segs + test_segs,
+                   users=users, k=k, threads=threads, train_fn=train_fn)
+
+
+def _evaluate(config: Dict[str, Any]) -> Dict[str, Any]:
+    w = _worker
+    t0 = time.perf_counter()
+    user_f, item_f = w["train_fn"](w["train"], config, w["threads"])
+    t1 = time.perf_counter()
+    metrics = ranking_metrics(user_f, item_f, w["train"], w["test"], w["users"], w["k"])
+    return {
+        **config,
+        **metrics,
+        "train_s": round(t1 - t0, 2),
+        "eval_s": round(time.perf_counter() - t1, 2),
+    }
+
+
+def run_sweep(
+    csr: sp.csr_matrix,
+    configs: List[Dict[str, Any]],
+    train_fn: Callable[[sp.csr_matrix, Dict[str, Any], int], Tuple[np.ndarray, np.ndarray]],
+    workers: int,
+    k: int = 20,
+    holdout: float = 0.2,
+    max_eval_users: int = 2000,
+    seed: int = 42,
+    log: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Train and score every config. train_fn(train_csr, config, threads) must be
+    a module-level function (it is pickled to the workers) returning
+    (user_factors, item_factors) aligned with the CSR rows / columns.
+    Returns {"candidates": [...] sorted best first, "best": {...}, ...}.
+    """
+    log = log or (lambda msg: None)
+    k = min(k, csr.shape[1] - 1)
+    train, test = holdout_split(csr, holdout, seed=seed)
+    users = eval_users(test, max_eval_users, seed)
+    if not len(users):
+        raise ValueError("no users with enough interactions to hold out; cannot score a sweep")
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    workers = max(1, min(workers, len(configs), cores))
+    threads = max(1, cores // workers)
+
+    shared_train, shared_test = SharedCSR(train), SharedCSR(test)
+    log(f"[sweep] {len(configs)} configs on {workers} workers x {threads} threads; "
+        f"train nnz={train.nnz:,} held-out nnz={test.nnz:,} eval users={len(users):,} "
+        f"shared={(shared_train.nbytes + shared_test.nbytes) / 1e6:.1f} MB")
+    metric = f"ndcg@{k}"
+    results: List[Dict[str, Any]] = []
+    t0 = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context("spawn"),  # forking after BLAS / OpenMP init is unsafe
+            initializer=_init_worker,
+            initargs=(shared_train.spec(), shared_test.spec(), users, k, threads, train_fn),
+        ) as pool:
+            futures = [pool.submit(_evaluate, c) for c in configs]
+            for fut in as_completed(futures):
+                r = fut.result()
+                results.append(r)
+                log(f"[sweep] {len(results)}/{len(configs)} "
+                    + " ".join(f"{key}={r[key]}" for key in HP_KEYS)
+                    + f" {metric}={r[metric]:.4f} recall@{k}={r[f'recall@{k}']:.4f} ({r['train_s']}s)")
+    finally:
+        shared_train.unlink()
+        shared_test.unlink()
+
+    results.sort(key=lambda r: -r[metric])
+    return {
+        "metric": metric,
+        "k": k,
+        "holdout": holdout,
+        "eval_users": int(len(users)),
+        "workers": workers,
+        "threads_per_worker": threads,
+        "wall_s": round(time.perf_counter() - t0, 2),
+        "best": {key: results[0][key] for key in HP_KEYS},
+        "candidates": results,
+    }
@@ -0,0 +1,47 @@
+# services/merlin-api/app/trainers/content_embed.py
+"""
+Content embeddings shared by the trainer (fit) and the serving content index
+(transform new catalog rows). TF-IDF stays sparse end to end and is reduced
+with TruncatedSVD to a compact dense embedding, so memory is N x CONTENT_DIM
+rather than N x vocab.
+"""
+from __future__ import annotations
+import os
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+
+CONTENT_DIM = int(os.getenv("CONTENT_DIM", "128"))
+CONTENT_MAX_FEATURES = int(os.getenv("CONTENT_MAX_FEATURES", "50000"))
+
+
+def content_text(row: Dict[str, Any]) -> str:
+    """Concatenate title + overview + genres for simple content signal."""
+    g = row.get("genres")
+    genres = " ".join(g) if isinstance(g, (list, tuple)) else str(g or "")
+    return f"{row.get('title') or ''} {row.get('overview') or ''} {genres}"
+
+
+def fit_pipeline(texts: List[str], dim: int = CONTENT_DIM):
+    """Fit TF-IDF -> TruncatedSVD -> L2 normalize. Returns (pipeline, embeddings[N x d])."""
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import Normalizer
+
+    tfidf = TfidfVectorizer(max_features=CONTENT_MAX_FEATURES, ngram_range=(1, 2), dtype=np.float32)
+    X = tfidf.fit_transform(texts)  # sparse [items x vocab]; never densified
+    # SVD rank is bounded by the matrix shape on tiny catalogs
+    d = max(1, min(dim, X.shape[1] - 1, X.shape[0] - 1))
+    svd = TruncatedSVD(n_components=d, random_state=42)
+    E = svd.fit_transform(X)
+    norm = Normalizer(copy=False)
+    E = norm.fit_transform(E).astype(np.float32)
+    pipe = Pipeline([("tfidf", tfidf), ("svd", svd), ("norm", norm)])
+    return pipe, E
+
+
+def embed(pipe, rows: Iterable[Dict[str, Any]]) -> np.ndarray:
+    """Embed catalog rows with a fitted pipeline (unit-norm float32)."""
+    texts = [content_text(r) for r in rows]
+    return np.ascontiguousarray(pipe.transform(texts), dtype=np.float32)
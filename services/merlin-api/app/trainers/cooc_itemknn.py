@@ -0,0 +1,191 @@
+# services/merlin-api/app/trainers/cooc_itemknn.py
+"""
+Incremental co-occurrence item-KNN.
+
+State kept between runs (saved next to every published version):
+  X  binary user x item matrix (who has interacted with what)
+  C  symmetric item x item co-occurrence counts, C = X^T X (diag = item norms^2)
+  S  top-K cosine neighbors, S_ij = C_ij / sqrt(C_ii * C_jj), in the sparse
+     triplet layout ItemKNN already serves
+
+Adding new interactions X_new for users with prior history X_old changes C by
+    dC = X_new^T X_old + X_old^T X_new + X_new^T X_new
+so only items with a nonzero row in dC need their neighbor list recomputed.
+Items whose own counts did not change keep their list; their scores against
+items whose norm grew are slightly stale until the next full rescore.
+"""
+from __future__ import annotations
+import json
+import os
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+STATE_FILES = ("cooc_counts.npz", "cooc_user_items.npz", "cooc_user_ids.npz", "cooc_state.json")
+
+
+class CoocStore:
+    def __init__(self, user_ids: List[str], item_ids: List[str],
+                 X: sp.csr_matrix, C: sp.csr_matrix, S: sp.csr_matrix, watermark_ts: str | None):
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.u2i: Dict[str, int] = {u: i for i, u in enumerate(user_ids)}
+        self.it2i: Dict[str, int] = {it: i for i, it in enumerate(item_ids)}
+        self.X = X
+        self.C = C
+        self.S = S
+        self.watermark_ts = watermark_ts
+
+    @classmethod
+    def empty(cls) -> "CoocStore":
+        z = sp.csr_matrix((0, 0), dtype=np.float32)
+        return cls([], [], z, z.copy(), z.copy(), None)
+
+    @classmethod
+    def from_matrix(cls, user_ids: List[str], item_ids: List[str], W: sp.csr_matrix,
+                    min_weight: float, watermark_ts: str | None) -> "CoocStore":
+        """
+        Seed from a weighted user x item matrix (app/trainers/interactions.py):
+        pairs with weight >= min_weight count as one positive. S starts empty;
+        rescore every item before publishing.
+        """
+        X = (W >= min_weight).astype(np.float32).tocsr()
+        X.eliminate_zeros()
+        C = (X.T @ X).tocsr()
+        S = sp.csr_matrix((len(item_ids), len(item_ids)), dtype=np.float32)
+        return cls(list(user_ids), list(item_ids), X, C, S, watermark_ts)
+
+    # ---------- persistence ----------
+
+    @classmethod
+    def load(cls, base: str) -> "CoocStore":
+        with open(os.path.join(base, "cooc_state.json")) as f:
+            state = json.load(f)
+        ids = np.load(os.path.join(base, "item_ids.npz"), allow_pickle=True)["item_ids"].tolist()
+        users = np.load(os.path.join(base, "cooc_user_ids.npz"), allow_pickle=True)["user_ids"].tolist()
+        X = sp.load_npz(os.path.join(base, "cooc_user_items.npz")).tocsr()
+        C = sp.load_npz(os.path.join(base, "cooc_counts.npz")).tocsr()
+        data = np.load(os.path.join(base, "sims_data.npy"))
+        indices = np.load(os.path.join(base, "sims_indices.npy"))
+        indptr = np.load(os.path.join(base, "sims_indptr.npy"))
+        S = sp.csr_matrix((data, indices, indptr), shape=(len(ids), len(ids)))
+        return cls([str(u) for u in users], [str(i) for i in ids], X, C, S, state.get("watermark_ts"))
+
+    def save_state(self, outdir: str) -> None:
+        """Write the count state; the S triplet + item_ids are written by the publisher."""
+        sp.save_npz(os.path.join(outdir, "cooc_counts.npz"), self.C)
+        sp.save_npz(os.path.join(outdir, "cooc_user_items.npz"), self.X)
+        np.savez_compressed(os.path.join(outdir, "cooc_user_ids.npz"),
+                            user_ids=np.array(self.user_ids, dtype=object))
+        with open(os.path.join(outdir, "cooc_state.json"), "w") as f:
+            json.dump({"watermark_ts": self.watermark_ts,
+                       "n_users": len(self.user_ids), "n_items": len(self.item_ids),
+                       "cooc_nnz": int(self.C.nnz)}, f, indent=2)
+
+    # ---------- updates ----------
+
+    def _grow(self, pairs: Iterable[Tuple[str, str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Assign indices to unseen users/items and resize X, C, S to match."""
+        rows, cols = [], []
+        for u, it in pairs:
+            if u not in self.u2i:
+                self.u2i[u] = len(self.user_ids)
+                self.user_ids.append(u)
+            if it not in self.it2i:
+                self.it2i[it] = len(self.item_ids)
+                self.item_ids.append(it)
+            rows.append(self.u2i[u])
+            cols.append(self.it2i[it])
+        n_u, n_i = len(self.user_ids), len(self.item_ids)
+        self.X.resize((n_u, n_i))
+        self.C.resize((n_i, n_i))
+        self.S.resize((n_i, n_i))
+        return np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+
+    def add_interactions(self, pairs: Iterable[Tuple[str, str]]) -> np.ndarray:
+        """
+        Fold new (user_id, item_id) positives into X and C.
+        Returns the indices of items whose co-occurrence counts changed.
+        """
+        rows, cols = self._grow(pairs)
+        n_u, n_i = self.X.shape
+        if rows.size == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        X_new = sp.csr_matrix((np.ones(rows.size, dtype=np.float32), (rows, cols)), shape=(n_u, n_i))
+        X_new.data[:] = 1.0                              # duplicates in the batch collapse to 1
+        X_new = X_new - X_new.multiply(self.X)           # drop pairs we already counted
+        X_new.eliminate_zeros()
+        if X_new.nnz == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # only users touched by the batch contribute to dC
+        touched = np.unique(X_new.nonzero()[0])
+        X_old_t = self.X[touched]
+        X_new_t = X_new[touched]
+        cross = X_new_t.T @ X_old_t
+        dC = (cross + cross.T + X_new_t.T @ X_new_t).tocsr()
+
+        self.X = (self.X + X_new).tocsr()
+        self.C = (self.C + dC).tocsr()
+        return np.flatnonzero(np.diff(dC.indptr))
+
+    def rescore(self, items: np.ndarray, topk: int) -> None:
+        """Recompute the top-K cosine neighbor rows for `items` and splice them into S."""
+        n_i = len(self.item_ids)
+        if items.size == 0:
+            return
+        norms = np.sqrt(np.maximum(self.C.diagonal(), 1e-12)).astype(np.float32)
+        indptr, indices, data = [0], [], []
+        C = self.C
+        for i in items:
+            lo, hi = C.indptr[i], C.indptr[i + 1]
+            nbr = C.indices[lo:hi]
+            score = C.data[lo:hi] / (norms[i] * norms[nbr])
+            keep = nbr != i                                       # drop self
+            nbr, score = nbr[keep], score[keep]
+            if score.size > topk:
+                top = np.argpartition(-score, topk - 1)[:topk]
+                nbr, score = nbr[top], score[top]
+            order = np.argsort(-score, kind="stable")
+            indices.extend(nbr[order].tolist())
+            data.extend(score[order].tolist())
+            indptr.append(len(indices))
+
+        # rows of S for `items`, laid out at their positions
+        fresh = sp.csr_matrix(
+            (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32),
+             np.asarray(indptr, dtype=np.int64)),
+            shape=(items.size, n_i),
+        )
+        place = sp.csr_matrix(
+            (np.ones(items.size, dtype=np.float32), (items, np.arange(items.size))),
+            shape=(n_i, items.size),
+        )
+        keep = np.ones(n_i, dtype=np.float32)
+        keep[items] = 0.0
+        self.S = (sp.diags(keep).tocsr() @ self.S + place @ fresh).tocsr()
+        self.S.eliminate_zeros()
+        self.S.sort_indices()
+
+    def payload(self) -> Dict:
+        """Artifact payload in the shape train_and_register._save_artifacts expects."""
+        S = self.S
+        return {
+            "item_ids": self.item_ids,
+            "similarity_sparse": {
+                "data": S.data.astype(np.float32),
+                "indices": S.indices.astype(np.int32),
+                "indptr": S.indptr.astype(np.int32),
+                "shape": S.shape,
+            },
+            "metrics": {
+                "avg_sim": float(S.data.mean()) if S.nnz else 0.0,
+                "n_items": len(self.item_ids),
+                "n_users": len(self.user_ids),
+                "nnz": int(S.nnz),
+                "cooc_nnz": int(self.C.nnz),
+                "watermark_ts": self.watermark_ts,
+            },
+        }
@@ -0,0 +1,317 @@
+# services/merlin-api/app/trainers/interactions.py
+"""
+Shared interaction-matrix stage: one user x item matrix built from MovieLens
+positives and weighted live events, published as a versioned artifact that
+every trainer (and any evaluation script) loads instead of re-reading the
+sources.
+
+Sources:
+  movielens  ratings >= IMPLICIT_THRESHOLD, weight MOVIELENS_WEIGHT, users
+             namespaced "ml:<userId>" so they never collide with app user ids
+  events     public.events weighted by EVENT_WEIGHTS; events without a user_id
+             count for their session as "session:<session_id>"
+Repeated (user, item) pairs are summed.
+
+ID mappings are stable across builds: ids of the parent build keep their
+row/column, and ids seen for the first time are appended in sorted order. A
+parent user or item that no longer appears keeps its (now empty) row.
+
+Artifact layout (model_id "interactions" in the registry):
+  interactions_data.npy / _indices.npy / _indptr.npy   CSR triplet, float32 weights
+  user_ids.npy / item_ids.npy                          fixed-width unicode, row/column order
+  interactions.json                                    shape, fingerprint, sources, watermark
+
+Everything is plain .npy, so load() memory-maps the arrays without unpickling.
+The fingerprint is a sha256 over the shape, the triplet and both id tables:
+the same inputs built on the same parent give the same fingerprint, and a
+trainer records the one it trained on.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from app import artifact_store
+
+MODEL_ID = "interactions"
+META = "interactions.json"
+
+# Optional: MovieLens settings (used when the movielens source is on)
+MOVIELENS_DIR = os.getenv("MOVIELENS_DIR", "/app/data/movielens")  # path to extracted MovieLens files
+IMPLICIT_THRESHOLD = float(os.getenv("IMPLICIT_THRESHOLD", "4.0"))  # ratings >= threshold count as positive
+MOVIELENS_WEIGHT = float(os.getenv("MOVIELENS_WEIGHT", "1.0"))  # weight of one MovieLens positive
+
+# views get a tiny weight, likes/saves bigger
+EVENT_WEIGHTS = {"view": 0.1, "click": 0.3, "like": 1.0, "save": 1.2}
+
+# Row id of an event: its user, else its session. Every trainer keys events this way.
+IDENTITY_SQL = "coalesce(user_id::text, 'session:' || session_id)"
+
+
+# ---------- Sources ----------
+
+def _tt_from_imdb_int(imdb_int):
+    """
+    Convert MovieLens imdbId (numeric) to IMDb 'tt' style, zero-padded to 7.
+    Example: 1375666 -> 'tt1375666'
+    """
+    if pd.isna(imdb_int):
+        return None
+    try:
+        s = str(int(imdb_int))
+        return f"tt{s.zfill(7)}"
+    except Exception:
+        return None
+
+
+def load_movielens() -> pd.DataFrame:
+    """
+    Load implicit positives from MovieLens.
+    Supports:
+      - CSV style: ratings.csv (+ optional links.csv for IMDb mapping)
+      - 100K style: u.data (tab-delimited)
+    Returns: DataFrame with columns [userId, item_id] where item_id is:
+      - IMDb 'tt...' if links.csv available (CSV style only)
+      - else MovieLens movieId as string
+    """
+    print("Movielens dir " + MOVIELENS_DIR, flush=True)
+
+    ratings_csv = os.path.join(MOVIELENS_DIR, "ratings.csv")
+    links_csv   = os.path.join(MOVIELENS_DIR, "links.csv")
+    udata_path  = os.path.join(MOVIELENS_DIR, "u.data")
+
+    # ---- Path A: CSV style (ml-20m/25m)
+    if os.path.exists(ratings_csv):
+        print(f"[load] reading {ratings_csv} ...", flush=True)
+        ratings = pd.read_csv(
+            ratings_csv,
+            usecols=["userId", "movieId", "rating"],
+            dtype={"userId": "int32", "movieId": "int32", "rating": "float32"},
+            low_memory=False,
+        )
+        print(f"[load] ratings shape={ratings.shape}", flush=True)
+
+        pos = ratings.loc[ratings["rating"] >= IMPLICIT_THRESHOLD, ["userId", "movieId"]].copy()
+        print(f"[filter] positives >= {IMPLICIT_THRESHOLD}: {len(pos):,}", flush=True)
+
+        if os.path.exists(links_csv):
+            print(f"[map] reading {links_csv} ...", flush=True)
+            links = pd.read_csv(links_csv, usecols=["movieId", "imdbId"])
+            links["item_id"] = links["imdbId"].apply(_tt_from_imdb_int)
+            pos = pos.merge(links[["movieId", "item_id"]], on="movieId", how="left")
+            pos["item_id"] = pos["item_id"].where(pos["item_id"].notna(),
+                                                  pos["movieId"].astype(str))
+        else:
+            print("[map] links.csv not found; using movieId strings", flush=True)
+            pos["item_id"] = pos["movieId"].astype(str)
+
+        out = pos[["userId", "item_id"]]
+        print(f"[out] interactions rows={len(out):,}", flush=True)
+        return out
+
+    # ---- Path B: ML-100K style (u.data)
+    if os.path.exists(udata_path):
+        print(f"[load] reading {udata_path} (ML-100K) ...", flush=True)
+        # u.data columns: user id | item id | rating | timestamp (tab-separated)
+        ratings = pd.read_csv(
+            udata_path,
+            sep="\t",
+            header=None,
+            names=["userId", "movieId", "rating", "timestamp"],
+            dtype={"userId": "int32", "movieId": "int32", "rating": "float32", "timestamp": "int64"},
+            engine="python",
+        )
+        print(f"[load] u.data shape={ratings.shape}", flush=True)
+
+        pos = ratings.loc[ratings["rating"] >= IMPLICIT_THRESHOLD, ["userId", "movieId"]].copy()
+        print(f"[filter] positives >= {IMPLICIT_THRESHOLD}: {len(pos):,}", flush=True)
+
+        # ML-100K has no links.csv; use movieId strings as item ids
+        pos["item_id"] = pos["movieId"].astype(str)
+
+        out = pos[["userId", "item_id"]]
+        print(f"[out] interactions rows={len(out):,}", flush=True)
+        return out
+
+    # ---- Neither format found
+    raise FileNotFoundError(
+        f"No MovieLens files found.\n"
+        f"Looked for CSV: {ratings_csv}\n"
+        f"and ML-100K: {udata_path}\n"
+        f"Set MOVIELENS_DIR correctly and mount the folder into the container."
+    )
+
+
+def movielens_source() -> pd.DataFrame:
+    """MovieLens positives as [user_id, item_id, weight] rows."""
+    pos = load_movielens()
+    return pd.DataFrame({
+        "user_id": "ml:" + pos["userId"].astype(str),
+        "item_id": pos["item_id"].astype(str),
+        "weight": np.float32(MOVIELENS_WEIGHT),
+    })
+
+
+def events_source(conn, days: int = 0) -> Tuple[pd.DataFrame, Optional[str]]:
+    """Weighted events as [user_id, item_id, weight] rows, plus their max ts (the watermark)."""
+    sql = f"""
+    select {IDENTITY_SQL} as user_id, item_id, event_type, ts
+    from events
+    where item_id is not null
+      and (user_id is not null or session_id is not null)
+    """
+    params: Dict[str, Any] = {}
+    if days > 0:
+        # ts-bounded, so only those monthly partitions are read
+        sql += " and ts > now() - make_interval(days => %(days)s)"
+        params["days"] = days
+    df = pd.read_sql(sql, conn, params=params)
+    watermark = pd.Timestamp(df["ts"].max()).isoformat() if not df.empty else None
+    weight = df["event_type"].map(EVENT_WEIGHTS).fillna(0.1).astype(np.float32)
+    return pd.DataFrame({"user_id": df["user_id"].astype(str), "item_id": df["item_id"].astype(str),
+                         "weight": weight}), watermark
+
+
+# ---------- Matrix ----------
+
+class Interactions:
+    """User x item weights with their id tables; X rows follow user_ids, columns item_ids."""
+
+    def __init__(self, X: sp.csr_matrix, user_ids: List[str], item_ids: List[str], meta: Dict[str, Any]):
+        self.X = X
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.meta = meta
+
+    @property
+    def fingerprint(self) -> str:
+        return self.meta["fingerprint"]
+
+    def user_index(self) -> Dict[str, int]:
+        return {u: i for i, u in enumerate(self.user_ids)}
+
+    def item_index(self) -> Dict[str, int]:
+        return {it: i for i, it in enumerate(self.item_ids)}
+
+    def frame(self) -> pd.DataFrame:
+        """[user_id, item_id, weight] rows, for trainers that start from a DataFrame."""
+        coo = self.X.tocoo()
+        return pd.DataFrame({
+            "user_id": np.asarray(self.user_ids, dtype=object)[coo.row],
+            "item_id": np.asarray(self.item_ids, dtype=object)[coo.col],
+            "weight": coo.data,
+        })
+
+
+def _ids(parent: Optional[List[str]], seen: pd.Series) -> List[str]:
+    """Parent ids in their order, then unseen ids sorted."""
+    if not parent:
+        return sorted(seen.unique().tolist())
+    known = set(parent)
+    return list(parent) + sorted(x for x in seen.unique().tolist() if x not in known)
+
+
+def fingerprint(X: sp.csr_matrix, user_ids: List[str], item_ids: List[str]) -> str:
+    h = hashlib.sha256()
+    h.update(json.dumps(list(X.shape)).encode())
+    for arr in (X.data, X.indices, X.indptr):
+        h.update(np.ascontiguousarray(arr).tobytes())
+    for ids in (user_ids, item_ids):
+        h.update("\n".join(ids).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def build(frames: List[pd.DataFrame], parent: Optional[Interactions] = None,
+          meta: Optional[Dict[str, Any]] = None) -> Interactions:
+    """Merge [user_id, item_id, weight] frames into one CSR on stable ids (see module docstring)."""
+    frames = [f for f in frames if not f.empty]
+    df = (pd.concat(frames, ignore_index=True) if frames
+          else pd.DataFrame({"user_id": [], "item_id": [], "weight": []}))
+    user_ids = _ids(parent.user_ids if parent else None, df["user_id"])
+    item_ids = _ids(parent.item_ids if parent else None, df["item_id"])
+    # categorical codes map every row in one vectorized pass
+    rows = pd.Categorical(df["user_id"], categories=user_ids).codes.astype(np.int64)
+    cols = pd.Categorical(df["item_id"], categories=item_ids).codes.astype(np.int64)
+    X = sp.csr_matrix((df["weight"].to_numpy(dtype=np.float32), (rows, cols)),
+                      shape=(len(user_ids), len(item_ids)), dtype=np.float32)
+    X.sum_duplicates()
+    X.sort_indices()
+    out = dict(meta or {})
+    out.update({
+        "shape": [len(user_ids), len(item_ids)],
+        "nnz": int(X.nnz),
+        "rows_in": int(len(df)),
+        "parent_version": (parent.meta.get("version") if parent else None),
+        "new_users": len(user_ids) - (len(parent.user_ids) if parent else 0),
+        "new_items": len(item_ids) - (len(parent.item_ids) if parent else 0),
+        "fingerprint": fingerprint(X, user_ids, item_ids),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    })
+    return Interactions(X, user_ids, item_ids, out)
+
+
+# ---------- Persistence ----------
+
+def save(outdir: str, ix: Interactions) -> None:
+    os.makedirs(outdir, exist_ok=True)
+    np.save(os.path.join(outdir, "interactions_data.npy"), ix.X.data.astype(np.float32, copy=False))
+    np.save(os.path.join(outdir, "interactions_indices.npy"), ix.X.indices.astype(np.int32, copy=False))
+    np.save(os.path.join(outdir, "interactions_indptr.npy"), ix.X.indptr.astype(np.int64, copy=False))
+    np.save(os.path.join(outdir, "user_ids.npy"), np.asarray(ix.user_ids, dtype=str))
+    np.save(os.path.join(outdir, "item_ids.npy"), np.asarray(ix.item_ids, dtype=str))
+    with open(os.path.join(outdir, META), "w") as f:
+        json.dump(ix.meta, f, indent=2)
+
+
+def load(base: str, mmap: bool = True) -> Interactions:
+    """Read a saved matrix; with mmap the triplet stays on disk until it is touched."""
+    mode = "r" if mmap else None
+    with open(os.path.join(base, META)) as f:
+        meta = json.load(f)
+    data = np.load(os.path.join(base, "interactions_data.npy"), mmap_mode=mode)
+    indices = np.load(os.path.join(base, "interactions_indices.npy"), mmap_mode=mode)
+    indptr = np.load(os.path.join(base, "interactions_indptr.npy"), mmap_mode=mode)
+    X = sp.csr_matrix((data, indices, indptr), shape=tuple(meta["shape"]), copy=False)
+    user_ids = np.load(os.path.join(base, "user_ids.npy")).tolist()
+    item_ids = np.load(os.path.join(base, "item_ids.npy")).tolist()
+    return Interactions(X, user_ids, item_ids, meta)
+
+
+def resolve(conn, ref: str) -> Tuple[str, str]:
+    """
+    (version, artifact_uri) of a registered matrix: ref is a version or "latest".
+    A path or URI is returned as-is, for matrices that were never registered.
+    """
+    if "/" in ref:
+        return os.path.basename(ref.rstrip("/")), ref
+    sql = "select version, artifact_uri from model_registry where model_id = %s"
+    params: List[Any] = [MODEL_ID]
+    if ref != "latest":
+        sql += " and version = %s"
+        params.append(ref)
+    else:
+        sql += " order by created_at desc limit 1"
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        row = cur.fetchone()
+    if not row:
+        raise SystemExit(f"No {MODEL_ID} matrix found ({ref}); run python -m app.cli.build_interactions first")
+    return row[0], row[1]
+
+
+def load_ref(conn, ref: str) -> Interactions:
+    """Resolve ref (see resolve) and load it through the artifact store (fetched + verified if remote)."""
+    version, uri = resolve(conn, ref)
+    t0 = time.perf_counter()
+    ix = load(artifact_store.local_path(uri))
+    ix.meta.setdefault("version", version)
+    print(f"[interactions] {version} {ix.X.shape[0]:,} users x {ix.X.shape[1]:,} items nnz={ix.X.nnz:,} "
+          f"fingerprint={ix.fingerprint[:12]} loaded in {(time.perf_counter() - t0) * 1000:.1f}ms", flush=True)
+    return ix
@@ -0,0 +1,175 @@
+# services/merlin-api/app/trainers/quantize.py
+"""
+Quantized storage for serving artifacts, shared by the trainers (encode +
+drift report) and the loaders (decode).
+
+Factors:  float16, or int8 with one float32 scale per row (x ~= q * scale).
+Sims:     float16, or uint16 linearly mapped onto the [lo, hi] score range.
+
+Trainers always write the float32 files too; quantized files sit next to them
+and are described by quantization.json. Serving picks them up only when
+SERVE_QUANTIZED=1, so a version can be compared before it is adopted.
+"""
+from __future__ import annotations
+import json
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+FACTOR_MODES = ("float16", "int8")
+SIM_MODES = ("float16", "uint16")
+MANIFEST = "quantization.json"
+BLOCK_ROWS = 65536  # rows encoded per block, bounds the float32 temporaries
+
+_U16_MAX = 65535.0
+
+
+# ---------- factors ----------
+
+class QuantizedRows:
+    """
+    Read-only row matrix stored quantized. Indexing (int, slice, list or array of
+    rows) returns dequantized float32, so scoring code that gathers a handful of
+    user rows per query only ever materializes those rows.
+    """
+
+    def __init__(self, q: np.ndarray, scale: Optional[np.ndarray] = None):
+        self.q = q
+        self.scale = scale
+        self.shape = q.shape
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, idx) -> np.ndarray:
+        out = self.q[idx].astype(np.float32)
+        if self.scale is not None:
+            s = self.scale[idx]
+            out *= s[..., None] if np.ndim(s) else s
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.q.nbytes + (self.scale.nbytes if self.scale is not None else 0))
+
+
+def quantize_rows(X: np.ndarray, mode: str) -> Dict[str, np.ndarray]:
+    """Encode a float matrix; returns the arrays to store (q, and scale for int8)."""
+    X = np.asarray(X, dtype=np.float32)
+    if mode == "float16":
+        return {"q": X.astype(np.float16)}
+    if mode != "int8":
+        raise ValueError(f"unknown factor quantization {mode!r}")
+    q = np.empty(X.shape, dtype=np.int8)
+    scale = np.empty(X.shape[0], dtype=np.float32)
+    for lo in range(0, X.shape[0], BLOCK_ROWS):
+        blk = X[lo:lo + BLOCK_ROWS]
+        s = np.abs(blk).max(axis=1) / 127.0
+        s[s == 0] = 1.0  # all-zero rows (e.g. users with no history)
+        q[lo:lo + BLOCK_ROWS] = np.clip(np.rint(blk / s[:, None]), -127, 127)
+        scale[lo:lo + BLOCK_ROWS] = s
+    return {"q": q, "scale": scale}
+
+
+def save_rows(path: str, arrays: Dict[str, np.ndarray]) -> None:
+    np.savez_compressed(path, **arrays)
+
+
+def load_rows(path: str) -> QuantizedRows:
+    z = np.load(path)
+    return QuantizedRows(z["q"], z["scale"] if "scale" in z.files else None)
+
+
+# ---------- similarity scores ----------
+
+def quantize_sims(data: np.ndarray, mode: str):
+    """Encode CSR similarity values. Returns (q, params) with params stored in the manifest."""
+    data = np.asarray(data, dtype=np.float32)
+    if mode == "float16":
+        return data.astype(np.float16), {"mode": mode}
+    if mode != "uint16":
+        raise ValueError(f"unknown similarity quantization {mode!r}")
+    lo = float(data.min()) if data.size else 0.0
+    hi = float(data.max()) if data.size else 1.0
+    span = (hi - lo) or 1.0
+    q = np.rint((data - lo) * (_U16_MAX / span)).astype(np.uint16)
+    return q, {"mode": mode, "lo": lo, "hi": hi}
+
+
+def sims_decoder(params: Dict[str, Any]):
+    """Returns a function mapping a slice of stored values back to float32 scores."""
+    if params["mode"] == "float16":
+        return lambda q: q.astype(np.float32)
+    lo = np.float32(params["lo"])
+    step = np.float32(((params["hi"] - params["lo"]) or 1.0) / _U16_MAX)
+    return lambda q: q.astype(np.float32) * step + lo
+
+
+# ---------- manifest ----------
+
+def read_manifest(base: str) -> Dict[str, Any]:
+    path = os.path.join(base, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(base: str, manifest: Dict[str, Any]) -> None:
+    with open(os.path.join(base, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+# ---------- ranking drift ----------
+
+def _topk(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _compare(ref: np.ndarray, got: np.ndarray) -> Dict[str, float]:
+    k = ref.shape[1]
+    overlap = [len(np.intersect1d(a, b, assume_unique=True)) / k for a, b in zip(ref, got)]
+    return {
+        "overlap_at_k": float(np.mean(overlap)) if overlap else 1.0,
+        "top1_agreement": float(np.mean(ref[:, 0] == got[:, 0])) if len(ref) else 1.0,
+    }
+
+
+def factor_drift(user_f: np.ndarray, user_q: QuantizedRows, item_f: np.ndarray,
+                 k: int = 20, sample: int = 2000, seed: int = 42) -> Dict[str, float]:
+    """
+    Top-k agreement between float32 and dequantized user factors on a user sample,
+    scored the way serving does (cosine of the user vector vs normalized items).
+    """
+    rng = np.random.default_rng(seed)
+    n = user_f.shape[0]
+    rows = np.sort(rng.choice(n, size=min(sample, n), replace=False))
+    items = item_f / (np.linalg.norm(item_f, axis=1, keepdims=True) + 1e-12)
+    ref = _topk(np.asarray(user_f[rows], dtype=np.float32) @ items.T, k)
+    got = _topk(user_q[rows] @ items.T, k)
+    return {"k": min(k, items.shape[0]), "sample_users": int(rows.size), **_compare(ref, got)}
+
+
+def sims_drift(data: np.ndarray, q: np.ndarray, params: Dict[str, Any], indptr: np.ndarray,
+               k: int = 20, sample: int = 2000, seed: int = 42) -> Dict[str, float]:
+    """Top-k neighbor agreement between float32 and dequantized similarity rows."""
+    decode = sims_decoder(params)
+    lens = np.diff(indptr)
+    candidates = np.flatnonzero(lens > 0)
+    if candidates.size == 0:
+        return {"k": k, "sample_items": 0, "overlap_at_k": 1.0, "top1_agreement": 1.0}
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(candidates, size=min(sample, candidates.size), replace=False)
+    overlap, top1 = [], []
+    for i in rows:
+        lo, hi = indptr[i], indptr[i + 1]
+        ref = np.argsort(-data[lo:hi], kind="stable")[:k]
+        got = np.argsort(-decode(q[lo:hi]), kind="stable")[:k]
+        overlap.append(len(np.intersect1d(ref, got)) / ref.size)
+        top1.append(ref[0] == got[0])
+    return {"k": k, "sample_items": int(rows.size),
+            "overlap_at_k": float(np.mean(overlap)), "top1_agreement": float(np.mean(top1))}
@@ -0,0 +1,105 @@
+# services/merlin-api/app/trainers/session_markov.py
+"""
+Session next-item model: a sparse item -> next-item transition matrix.
+
+Each identity's events (session_id, or user_id when there is no session) are
+cut into sessions wherever two consecutive events are more than max_gap
+apart. Repeated events on the same item (view, then like) are collapsed.
+Within a session every item a is linked to each of the next `window` items
+b with weight
+
+    w(a, b) = 1/d * 0.5 ** (age / half_life)
+
+where d is the distance in steps and age is how long ago b happened. Rows
+are normalized to P(b | a) with an additive prior (low-support items don't
+get a confident 1.0), truncated to the top-K and stored sorted by descending
+score in the sparse triplet layout. Serving then only reads row prefixes
+(app/serve/session_markov_loader.py).
+"""
+from __future__ import annotations
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+def sorted_topk_rows(S: sp.csr_matrix, topk: int) -> sp.csr_matrix:
+    """Keep each row's topk entries, ordered by descending score within the row."""
+    S = S.tocsr()
+    rows = np.repeat(np.arange(S.shape[0]), np.diff(S.indptr))
+    order = np.lexsort((-S.data, rows))
+    rank = np.arange(S.nnz) - S.indptr[rows[order]]
+    keep = order[rank < topk]
+    counts = np.bincount(rows[keep], minlength=S.shape[0])
+    indptr = np.concatenate(([0], np.cumsum(counts)))
+    return sp.csr_matrix((S.data[keep], S.indices[keep], indptr), shape=S.shape)
+
+
+def build_transitions(
+    df: pd.DataFrame,
+    half_life_days: float = 14.0,
+    max_gap_minutes: float = 30.0,
+    window: int = 3,
+    topk: int = 100,
+    prior: float = 1.0,
+    now: Optional[pd.Timestamp] = None,
+) -> Dict[str, Any]:
+    """
+    df: columns who, item_id, ts. Returns the payload train_and_register._save_artifacts
+    expects (item_ids + similarity_sparse + metrics).
+    """
+    df = df.sort_values(["who", "ts"], kind="stable")
+    item_codes, item_ids = pd.factorize(df["item_id"].astype(str))
+    who_codes = pd.factorize(df["who"].astype(str))[0]
+    ts = pd.to_datetime(df["ts"], utc=True)
+    t = (ts - pd.Timestamp(0, tz="UTC")).dt.total_seconds().to_numpy()  # independent of datetime64 unit
+    now_s = (now or pd.Timestamp.now(tz="UTC")).timestamp()
+
+    # session boundaries: new identity, or a gap longer than max_gap
+    brk = np.ones(len(df), dtype=bool)
+    brk[1:] = (who_codes[1:] != who_codes[:-1]) | (np.diff(t) > max_gap_minutes * 60.0)
+    session = np.cumsum(brk)
+    # collapse runs of the same item within a session
+    keep = brk.copy()
+    keep[1:] |= item_codes[1:] != item_codes[:-1]
+    items, session, t = item_codes[keep], session[keep], t[keep]
+
+    decay = 0.5 ** ((now_s - t) / (half_life_days * 86400.0))
+    src, dst, w = [], [], []
+    for d in range(1, window + 1):
+        ok = (session[:-d] == session[d:]) & (items[:-d] != items[d:])
+        src.append(items[:-d][ok])
+        dst.append(items[d:][ok])
+        w.append(decay[d:][ok] / d)
+    src, dst, w = np.concatenate(src), np.concatenate(dst), np.concatenate(w).astype(np.float32)
+
+    n = len(item_ids)
+    T = sp.coo_matrix((w, (src, dst)), shape=(n, n)).tocsr()
+    T.sum_duplicates()
+    row_sum = np.asarray(T.sum(axis=1)).ravel()
+    T = sp.diags((1.0 / (row_sum + prior)).astype(np.float32)) @ T
+    S = sorted_topk_rows(T, topk)
+
+    return {
+        "item_ids": [str(x) for x in item_ids],
+        "similarity_sparse": {
+            "data": S.data.astype(np.float32),
+            "indices": S.indices.astype(np.int32),
+            "indptr": S.indptr.astype(np.int32),
+            "shape": S.shape,
+        },
+        "metrics": {
+            "n_items": n,
+            "n_sessions": int(session[-1]) if len(session) else 0,
+            "transitions": int(len(w)),
+            "nnz": int(S.nnz),
+            "rows_with_next": int((np.diff(S.indptr) > 0).sum()),
+            "half_life_days": half_life_days,
+            "max_gap_minutes": max_gap_minutes,
+            "window": window,
+            "topk": topk,
+            "rows_sorted": True,
+            "watermark_ts": ts.max().isoformat() if len(ts) else None,
+        },
+    }